@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from .models import User
+from .models import OutboundEmail, User
 
 
 @admin.register(User)
@@ -50,3 +50,11 @@ class UserAdmin(DjangoUserAdmin):
     list_filter = ("user_type", "is_disabled", "is_staff", "is_superuser")
     search_fields = ("email", "first_name", "last_name")
     ordering = ("email",)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "status", "attempts", "created_at", "next_attempt_at", "sent_at")
+    search_fields = ("subject",)
+    list_filter = ("status",)
+    readonly_fields = ("created_at",)
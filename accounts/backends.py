@@ -0,0 +1,64 @@
+"""Authentication backend that serves the per-request user from the cache.
+
+``AuthenticationMiddleware`` resolves ``request.user`` through the backend that
+logged the user in, so every authenticated request used to SELECT the full user
+row. ``CachedModelBackend`` caches the few columns that requests actually read
+(name, disabled flag, plan, verification and the fields Django's auth checks need)
+for ``ACCOUNTS_USER_CACHE_TTL`` seconds and builds the user from them; any other
+field is loaded on first access like a deferred field. The password hash is never
+cached: the entry holds the session auth hash (an HMAC of it) that the session
+check compares against.
+
+Saving or deleting a user drops the entry (see ``accounts.signals``). Writes that
+skip model signals, such as queryset updates, are picked up once the entry
+expires, so a disabled user is blocked within the TTL at worst.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+CACHED_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "user_type",
+    "is_disabled",
+    "email_verified_at",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+def user_cache_key(user_id):
+    return f"accounts:user:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+    # A request that read the old row before the write committed may have cached it again.
+    transaction.on_commit(lambda: cache.delete(user_cache_key(user_id)))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        User = get_user_model()
+        # from_db expects the values in model field order.
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in CACHED_FIELDS]
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            user = User._default_manager.filter(pk=user_id).first()
+            if user is None:
+                return None
+            entry = ([getattr(user, field) for field in fields], user.get_session_auth_hash())
+            cache.set(key, entry, settings.ACCOUNTS_USER_CACHE_TTL)
+        else:
+            values, session_auth_hash = entry
+            user = User.from_db(DEFAULT_DB_ALIAS, fields, values)
+            user.cached_session_auth_hash = session_auth_hash
+        return user if self.user_can_authenticate(user) else None
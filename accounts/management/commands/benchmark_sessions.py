@@ -0,0 +1,79 @@
+import random
+import time
+from importlib import import_module
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts import sessions
+
+ENGINES = (
+    "django.contrib.sessions.backends.db",
+    "django.contrib.sessions.backends.cached_db",
+    "accounts.sessions",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the same mix of session reads and writes against the db, cached_db and accounts.sessions "
+        "engines and report requests per second and database queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--write-ratio", type=float, default=0.2, help="Share of requests that change the session")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['requests']} requests over {options['sessions']} sessions, "
+            f"{options['write_ratio']:.0%} writing (sessions are removed afterwards)"
+        )
+        for engine in ENGINES:
+            store_class = import_module(engine).SessionStore
+            keys = self._create(store_class, options["sessions"])
+            try:
+                elapsed, queries = self._replay(store_class, keys, options)
+            finally:
+                Session.objects.filter(session_key__in=keys).delete()
+            self.stdout.write(
+                f"{engine:>42} {elapsed:7.2f}s  {options['requests'] / elapsed:9.0f} requests/s  {queries:6} queries"
+            )
+
+    def _create(self, store_class, count):
+        keys = []
+        for index in range(count):
+            store = store_class()
+            store["_auth_user_id"] = str(index)
+            store["visits"] = 0
+            store.create()
+            keys.append(store.session_key)
+        sessions.flush_sessions(force=True)
+        return keys
+
+    def _replay(self, store_class, keys, options):
+        # Each iteration is one request: load the session, maybe change it, save if modified.
+        rng = random.Random(options["seed"])
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            for _ in range(options["requests"]):
+                store = store_class(rng.choice(keys))
+                visits = store.get("visits", 0)
+                if rng.random() < options["write_ratio"]:
+                    store["visits"] = visits + 1
+                if store.modified:
+                    store.save()
+                if store_class is sessions.SessionStore:
+                    sessions.flush_sessions()
+            sessions.flush_sessions(force=True)
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries)
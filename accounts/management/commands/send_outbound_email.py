@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS, send_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound email in batches over one mail server connection, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Emails sent per connection")
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=DEFAULT_MAX_ATTEMPTS,
+            help="Give up on an email (status 'failed') after this many attempts",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new email instead of exiting")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds to sleep when the outbox is empty (--loop)")
+
+    def handle(self, *args, **options):
+        while True:
+            result = send_batch(options["batch_size"], options["max_attempts"])
+            if result:
+                self.stdout.write(f"Outbound email - {result}")
+            if result.sent + result.retried + result.failed >= options["batch_size"]:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.sessions import SWEEP_CHUNK_SIZE, sweep_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired rows from the session table in small chunks, pausing between them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=SWEEP_CHUNK_SIZE)
+        parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between chunks")
+        parser.add_argument("--max-chunks", type=int, help="Stop after this many chunks")
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired(options["chunk_size"], max_chunks=options["max_chunks"], pause=options["pause"])
+        self.stdout.write(f"Deleted {deleted} expired sessions")
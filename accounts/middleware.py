@@ -1,17 +1,42 @@
 from django.contrib import messages
 from django.contrib.auth import logout
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
 from django.shortcuts import redirect
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
 
 
-class DisabledUserMiddleware:
-    """Logs out and blocks disabled users from accessing the site."""
+class SessionAuthenticationMiddleware(AuthenticationMiddleware):
+    """``AuthenticationMiddleware`` that leaves the session alone when no session cookie was sent.
 
-    def __init__(self, get_response):
-        self.get_response = get_response
+    Such a request cannot be signed in, so it gets ``AnonymousUser`` directly and
+    anonymous pages never load (or mark as accessed) a session.
+    """
 
-    def __call__(self, request):
+    def process_request(self, request):
+        if request.session.session_key is None:
+            request.user = AnonymousUser()
+            request.anonymous_without_session = True
+            return None
+        return super().process_request(request)
+
+    def process_response(self, request, response):
+        # The page would differ had a session cookie been sent, as SessionMiddleware marks on access.
+        if getattr(request, "anonymous_without_session", False):
+            patch_vary_headers(response, ("Cookie",))
+        return response
+
+
+class DisabledUserMiddleware(MiddlewareMixin):
+    """Logs out and blocks disabled users from accessing the site.
+
+    Built on MiddlewareMixin so it also runs natively in an async (ASGI) middleware chain.
+    """
+
+    def process_request(self, request):
         if request.user.is_authenticated and getattr(request.user, "is_disabled", False):
             logout(request)
             messages.error(request, "Your account has been disabled.")
             return redirect("accounts:login")
-        return self.get_response(request)
+        return None
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.26 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='attachments',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='outboundemail',
+            name='content_subtype',
+            field=models.CharField(default='plain', max_length=50),
+        ),
+    ]
@@ -60,6 +60,14 @@ class User(AbstractUser):
     def is_verified(self):
         return self.email_verified_at is not None
 
+    def get_session_auth_hash(self):
+        # Users built by accounts.backends.CachedModelBackend carry the hash instead of the password.
+        return self.__dict__.get("cached_session_auth_hash") or super().get_session_auth_hash()
+
+    def set_password(self, raw_password):
+        self.__dict__.pop("cached_session_auth_hash", None)
+        super().set_password(raw_password)
+
     def verify_email(self):
         self.email_verified_at = timezone.now()
         self.save(update_fields=["email_verified_at"])
@@ -99,4 +107,41 @@ class PendingRegistration(models.Model):
         return self.expires_at >= timezone.now()
 
 
+class OutboundEmail(models.Model):
+    """Email queued by ``accounts.outbox.OutboxEmailBackend`` and sent later by ``send_outbound_email``."""
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    # "plain", or "html" for a message whose body is HTML.
+    content_subtype = models.CharField(max_length=50, default="plain")
+    from_email = models.CharField(max_length=320)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    # [[content, mimetype], ...], e.g. an HTML version of the body.
+    alternatives = models.JSONField(default=list)
+    # [[filename, content, mimetype, encoding], ...]; binary content is stored base64-encoded.
+    attachments = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="accounts_outbox_due_idx")]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
 # Create your models here.
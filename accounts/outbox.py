@@ -0,0 +1,181 @@
+"""Email outbox: views queue mail in ``OutboundEmail`` and a worker delivers it.
+
+With ``EMAIL_BACKEND = "accounts.outbox.OutboxEmailBackend"`` sending a message is
+one INSERT, so a slow or failing mail server no longer holds up (or breaks) the
+request that sends it. ``manage.py send_outbound_email`` claims due rows in
+batches, sends each batch over one connection to ``EMAIL_DELIVERY_BACKEND`` (SMTP
+in production) and retries temporary failures with exponential backoff.
+Permanent SMTP rejections (5xx) fail the message straight away.
+
+Attachments added with ``attach(filename, content, mimetype)`` or ``attach_file``
+are stored with the message; ready-made ``MIMEBase`` parts cannot be stored and
+are rejected with a ``ValueError``.
+"""
+
+import base64
+import logging
+import random
+import smtplib
+from datetime import timedelta
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# How long a claimed batch stays hidden from other workers; a crashed worker's rows come back after it.
+CLAIM_SECONDS = 300
+
+
+def _stored_attachments(message):
+    attachments = []
+    for attachment in message.attachments:
+        if isinstance(attachment, MIMEBase):
+            raise ValueError("The email outbox cannot store MIMEBase attachments; attach (filename, content, mimetype)")
+        filename, content, mimetype = attachment
+        if isinstance(content, bytes):
+            attachments.append([filename, base64.b64encode(content).decode(), mimetype, "base64"])
+        else:
+            attachments.append([filename, content, mimetype, ""])
+    return attachments
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        rows = [
+            OutboundEmail(
+                subject=message.subject,
+                body=message.body,
+                content_subtype=message.content_subtype,
+                from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                to=list(message.to),
+                cc=list(message.cc),
+                bcc=list(message.bcc),
+                reply_to=list(message.reply_to),
+                headers=dict(message.extra_headers),
+                alternatives=[list(alternative) for alternative in getattr(message, "alternatives", [])],
+                attachments=_stored_attachments(message),
+            )
+            for message in email_messages
+            if message.recipients()
+        ]
+        OutboundEmail.objects.bulk_create(rows)
+        return len(rows)
+
+
+class SendResult:
+    __slots__ = ("sent", "retried", "failed")
+
+    def __init__(self):
+        self.sent = self.retried = self.failed = 0
+
+    def __bool__(self):
+        return bool(self.sent or self.retried or self.failed)
+
+    def __str__(self):
+        return f"sent: {self.sent}, retried: {self.retried}, failed: {self.failed}"
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter so a failing batch does not retry in lockstep."""
+    delay = min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.75, 1.0))
+
+
+def is_permanent(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+def to_message(email, connection=None):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        connection=connection,
+    )
+    message.content_subtype = email.content_subtype
+    for content, mimetype in email.alternatives:
+        message.attach_alternative(content, mimetype)
+    for filename, content, mimetype, encoding in email.attachments:
+        message.attach(filename, base64.b64decode(content) if encoding == "base64" else content, mimetype)
+    return message
+
+
+def claim_batch(batch_size):
+    """Take up to ``batch_size`` due emails off the queue for ``CLAIM_SECONDS``."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return emails
+
+
+def _record_failure(email, exc, result, max_attempts):
+    email.last_error = f"{type(exc).__name__}: {exc}"
+    if is_permanent(exc) or email.attempts >= max_attempts:
+        email.status = OutboundEmail.FAILED
+        result.failed += 1
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        result.retried += 1
+
+
+def send_batch(batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    result = SendResult()
+    emails = claim_batch(batch_size)
+    if not emails:
+        return result
+
+    # Rows are claimed in their own short transaction so no lock is held while talking to the server.
+    connection = get_connection(settings.EMAIL_DELIVERY_BACKEND, fail_silently=False)
+    try:
+        for index, email in enumerate(emails):
+            try:
+                # Opened here rather than by send_messages, which would close it again after each message.
+                connection.open()
+            except Exception as exc:
+                logger.warning("Could not connect to the mail server: %s", exc)
+                for pending in emails[index:]:
+                    pending.attempts += 1
+                    _record_failure(pending, exc, result, max_attempts)
+                break
+            email.attempts += 1
+            try:
+                connection.send_messages([to_message(email, connection)])
+            except Exception as exc:
+                logger.warning("Email %s failed (attempt %s): %s", email.pk, email.attempts, exc)
+                _record_failure(email, exc, result, max_attempts)
+                # The connection may be unusable after an error; the next message opens a fresh one.
+                connection.close()
+                continue
+            email.status = OutboundEmail.SENT
+            email.sent_at = timezone.now()
+            email.last_error = ""
+            result.sent += 1
+    finally:
+        connection.close()
+        OutboundEmail.objects.bulk_update(emails, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"])
+    return result
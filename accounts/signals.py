@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+
+from .backends import invalidate_cached_user
+
+
+def _invalidate(instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+User = get_user_model()
+post_save.connect(_invalidate, sender=User, dispatch_uid="accounts_user_cache_save")
+post_delete.connect(_invalidate, sender=User, dispatch_uid="accounts_user_cache_delete")
@@ -0,0 +1,96 @@
+"""Test support: a local stand-in for an SMTP server, used by the outbox tests.
+
+Speaks just enough SMTP for ``smtplib`` and Django's SMTP backend. It counts the
+connections it accepts and keeps each delivered message. The first ``failures``
+messages are answered with ``reply`` (a temporary 451 unless told otherwise), and
+each message waits ``delay`` seconds to simulate a slow server.
+"""
+
+import threading
+from email import message_from_bytes
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class SMTPStubHandler(StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 smtp.stub ready")
+        envelope = {"from": None, "to": []}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("latin-1").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 smtp.stub")
+            elif verb == "MAIL":
+                envelope = {"from": command.split(":", 1)[1].strip(), "to": []}
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                envelope["to"].append(command.split(":", 1)[1].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.receive(envelope)
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def receive(self, envelope):
+        server = self.server
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                break
+            lines.append(line[1:] if line.startswith(b"..") else line)
+        server.wait()
+        with server.lock:
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+            else:
+                server.messages.append({**envelope, "message": message_from_bytes(b"".join(lines))})
+        self.reply(server.reply_line if failing else "250 OK: queued")
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+
+class SMTPStubServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0, failures=0, reply="451 Temporary failure, try again later"):
+        super().__init__(("127.0.0.1", 0), SMTPStubHandler)
+        self.delay = delay
+        self.failures = failures
+        self.reply_line = reply
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def wait(self):
+        if self.delay:
+            self.stopped.wait(self.delay)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
@@ -1,3 +1,285 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from email.mime.text import MIMEText
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.mail import EmailMessage, send_mail
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .backends import CachedModelBackend, user_cache_key
+from .models import OutboundEmail, User
+from .outbox import OutboxEmailBackend, send_batch
+from .sessions import KEY_PREFIX, SessionStore, _local, _queue, flush_sessions, sweep_expired
+from .testing import SMTPStubServer
+
+
+class OutboxTests(TestCase):
+    def start_smtp_stub(self, **kwargs):
+        server = SMTPStubServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        smtp_settings = override_settings(
+            EMAIL_BACKEND="accounts.outbox.OutboxEmailBackend",
+            EMAIL_DELIVERY_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=server.port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False,
+            EMAIL_TIMEOUT=5,
+        )
+        smtp_settings.enable()
+        self.addCleanup(smtp_settings.disable)
+        return server
+
+    def queue(self, count):
+        for index in range(count):
+            send_mail(f"Message {index}", "Hello", "shop@example.com", [f"user{index}@example.com"])
+
+    def test_registration_queues_the_code_without_contacting_the_server(self):
+        server = self.start_smtp_stub(delay=5)
+
+        response = self.client.post(
+            reverse("accounts:register"),
+            {"email": "new@example.com", "password1": "Sturdy-pass-123", "password2": "Sturdy-pass-123"},
+        )
+
+        self.assertRedirects(response, reverse("accounts:verify_email"))
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, ["new@example.com"])
+        self.assertIn("verification code", email.body)
+        self.assertEqual(server.connections, 0)
+
+    def test_batch_is_sent_over_one_connection(self):
+        server = self.start_smtp_stub()
+        self.queue(3)
+
+        result = send_batch()
+
+        self.assertEqual(result.sent, 3)
+        self.assertEqual(server.connections, 1)
+        subjects = [message["message"]["Subject"] for message in server.messages]
+        self.assertEqual(subjects, ["Message 0", "Message 1", "Message 2"])
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_temporary_failure_is_retried_with_backoff(self):
+        server = self.start_smtp_stub(failures=1)
+        self.queue(2)
+
+        with self.assertLogs("accounts.outbox", "WARNING"):
+            result = send_batch()
+
+        self.assertEqual((result.sent, result.retried), (1, 1))
+        failed = OutboundEmail.objects.get(status=OutboundEmail.PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn("451", failed.last_error)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertFalse(send_batch())
+
+        OutboundEmail.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(send_batch().sent, 1)
+        self.assertEqual(len(server.messages), 2)
+
+    def test_html_body_and_attachments_are_delivered(self):
+        server = self.start_smtp_stub()
+        message = EmailMessage("Receipt", "<p>Thanks</p>", "shop@example.com", ["buyer@example.com"])
+        message.content_subtype = "html"
+        message.attach("receipt.csv", "product,amount\nSoup,2.50\n", "text/csv")
+        message.attach("logo.png", b"\x89PNG\r\n\x1a\n\x00\xff", "image/png")
+        message.send()
+
+        self.assertEqual(send_batch().sent, 1)
+
+        parts = list(server.messages[0]["message"].walk())
+        self.assertEqual([part.get_content_type() for part in parts], ["multipart/mixed", "text/html", "text/csv", "image/png"])
+        self.assertEqual(parts[1].get_payload(decode=True), b"<p>Thanks</p>")
+        self.assertEqual(parts[2].get_filename(), "receipt.csv")
+        self.assertEqual(parts[3].get_payload(decode=True), b"\x89PNG\r\n\x1a\n\x00\xff")
+
+    def test_mime_attachments_are_rejected(self):
+        message = EmailMessage("Receipt", "Thanks", "shop@example.com", ["buyer@example.com"])
+        message.attach(MIMEText("inline part"))
+
+        with self.assertRaises(ValueError):
+            OutboxEmailBackend().send_messages([message])
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_permanent_rejection_is_not_retried(self):
+        self.start_smtp_stub(failures=1, reply="550 No such user")
+        self.queue(1)
+
+        with self.assertLogs("accounts.outbox", "WARNING"):
+            result = send_batch()
+
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.FAILED)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="member@example.com", password="x", email_verified_at=timezone.now())
+        self.client.force_login(self.user)
+        self.profile_url = reverse("accounts:profile")
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.profile_url)
+        return response, [query for query in queries.captured_queries if "accounts_user" in query["sql"]]
+
+    def test_signed_in_requests_do_not_query_the_user_table(self):
+        _, first = self.user_queries()
+        response, second = self.user_queries()
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.user)
+
+    def test_cache_holds_the_session_hash_not_the_password(self):
+        self.client.get(self.profile_url)
+
+        values, session_auth_hash = cache.get(user_cache_key(self.user.pk))
+
+        self.assertNotIn(self.user.password, values)
+        self.assertEqual(session_auth_hash, self.user.get_session_auth_hash())
+
+    def test_saving_the_user_refreshes_the_cached_row(self):
+        self.client.get(self.profile_url)
+        self.user.user_type = User.PRO
+        self.user.save(update_fields=["user_type"])
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.wsgi_request.user.user_type, User.PRO)
+
+        self.user.is_disabled = True
+        self.user.save(update_fields=["is_disabled"])
+        response = self.client.get(self.profile_url)
+        self.assertRedirects(response, reverse("accounts:login"), fetch_redirect_response=False)
+
+    @override_settings(ACCOUNTS_USER_CACHE_TTL=1)
+    def test_disable_without_save_is_picked_up_within_the_ttl(self):
+        self.client.get(self.profile_url)
+        User.objects.filter(pk=self.user.pk).update(is_disabled=True)
+
+        self.assertEqual(self.client.get(self.profile_url).status_code, 200)
+        time.sleep(1.1)
+        response = self.client.get(self.profile_url)
+        self.assertRedirects(response, reverse("accounts:login"), fetch_redirect_response=False)
+
+    def test_password_change_uses_the_new_hash(self):
+        self.client.get(self.profile_url)
+        user = CachedModelBackend().get_user(self.user.pk)
+
+        cached_hash = user.get_session_auth_hash()
+        user.set_password("changed")
+
+        self.assertNotEqual(user.get_session_auth_hash(), cached_hash)
+        self.assertEqual(user.get_session_auth_hash(), User(password=user.password).get_session_auth_hash())
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SESSION_WRITE_BEHIND_INTERVAL=60,
+)
+class SessionStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _local.entries.clear()
+        _queue.pending.clear()
+        self.addCleanup(_queue.pending.clear)
+        self.addCleanup(_local.entries.clear)
+
+    def create_session(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.create()
+        return session
+
+    def stored(self, session_key):
+        return SessionStore().decode(Session.objects.get(pk=session_key).session_data)
+
+    def test_saves_are_coalesced_into_one_write(self):
+        session = self.create_session(step=1)
+        session["step"] = 2
+        session.save()
+        session["step"] = 3
+        session.save()
+
+        self.assertEqual(self.stored(session.session_key), {"step": 1})
+        self.assertEqual(SessionStore(session.session_key)["step"], 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_sessions(force=True), 1)
+        self.assertEqual(self.stored(session.session_key), {"step": 3})
+
+    def test_unchanged_session_is_not_queued(self):
+        session = self.create_session(step=1)
+        loaded = SessionStore(session.session_key)
+        loaded.load()
+        loaded.save()
+
+        self.assertNotIn(session.session_key, _queue)
+        self.assertEqual(flush_sessions(force=True), 0)
+
+    def test_flush_waits_for_the_interval(self):
+        session = self.create_session(step=1)
+        session["step"] = 2
+        session.save()
+
+        self.assertEqual(flush_sessions(), 0)
+        self.assertIn(session.session_key, _queue)
+
+    def test_tombstone_stops_a_queued_write_from_restoring_a_deleted_session(self):
+        session = self.create_session(step=1)
+        session_key = session.session_key
+        session.delete()
+        # Another process queued a write for the session before it was deleted.
+        _queue.put(session_key, session.encode({"step": 2}), session.get_expiry_date())
+
+        self.assertEqual(flush_sessions(force=True), 0)
+        self.assertFalse(Session.objects.filter(pk=session_key).exists())
+        self.assertFalse(SessionStore().exists(session_key))
+
+    def test_sweep_deletes_expired_rows_in_chunks(self):
+        now = timezone.now()
+        for index in range(3):
+            Session.objects.create(session_key=f"expired{index}", session_data="", expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key="active", session_data="", expire_date=now + timedelta(days=1))
+
+        self.assertEqual(sweep_expired(chunk_size=2, max_chunks=1), 2)
+        self.assertEqual(sweep_expired(chunk_size=2), 1)
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["active"])
+
+    @override_settings(SESSION_LOCAL_TTL=0.2)
+    def test_local_copy_is_trusted_until_the_ttl(self):
+        session = self.create_session(step=1)
+        cache.set(KEY_PREFIX + session.session_key, {"step": 2})
+
+        self.assertEqual(SessionStore(session.session_key)["step"], 1)
+        time.sleep(0.25)
+        self.assertEqual(SessionStore(session.session_key)["step"], 2)
+
+    def test_session_deleted_elsewhere_is_not_served_by_default(self):
+        session = self.create_session(step=1)
+        self.assertEqual(SessionStore(session.session_key)["step"], 1)
+
+        cache.delete(KEY_PREFIX + session.session_key)
+        Session.objects.filter(pk=session.session_key).delete()
+
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+
+    def test_queued_write_is_lost_with_the_process(self):
+        session = self.create_session(step=1)
+        session["step"] = 2
+        session.save()
+        _queue.pending.clear()
+
+        self.assertEqual(SessionStore(session.session_key)["step"], 2)
+        self.assertEqual(self.stored(session.session_key), {"step": 1})
+        cache.clear()
+        self.assertEqual(SessionStore(session.session_key)["step"], 1)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Purchase, Subscription
+from .models import CartLine, PendingCheckout, Purchase, Subscription, WebhookEvent
 
 
 @admin.register(Subscription)
@@ -21,3 +21,24 @@ class PurchaseAdmin(admin.ModelAdmin):
     list_display = ("user", "product", "quantity", "amount", "currency", "discount_applied", "created_at")
     search_fields = ("user__email", "product__name_en", "stripe_checkout_session_id")
     list_filter = ("discount_applied",)
+
+
+@admin.register(CartLine)
+class CartLineAdmin(admin.ModelAdmin):
+    list_display = ("user", "product", "quantity")
+    search_fields = ("user__email",)
+    raw_id_fields = ("user", "product")
+
+
+@admin.register(PendingCheckout)
+class PendingCheckoutAdmin(admin.ModelAdmin):
+    list_display = ("stripe_checkout_session_id", "user", "total", "currency", "created_at", "completed_at")
+    search_fields = ("stripe_checkout_session_id", "user__email")
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "event_type", "status", "attempts", "event_created", "next_attempt_at", "processed_at")
+    search_fields = ("event_id",)
+    list_filter = ("status", "event_type")
+    readonly_fields = ("received_at",)
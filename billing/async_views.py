@@ -0,0 +1,189 @@
+"""Async versions of the checkout, success and webhook views, for serving under ASGI.
+
+``billing.urls`` routes to these instead of ``billing.views`` when
+``BILLING_ASYNC_VIEWS`` is on. Stripe calls go through the gateway's httpx client
+and standalone queries through the async ORM, so while Stripe answers a worker's
+event loop keeps serving other checkouts instead of parking a thread per request.
+
+The session, the lazy ``request.user`` and cart pricing have no async API in this
+Django version, so each view does that part in one ``sync_to_async`` hop using the
+sync views' helpers. Django's view decorators are sync-only here as well, hence the
+small async equivalents below.
+"""
+
+import asyncio
+import time
+from functools import wraps
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import redirect
+
+from . import views
+from .gateway import UNAVAILABLE_ERRORS, GatewayUnavailable, get_gateway
+from .models import PendingCheckout
+from .webhooks import (
+    CHECKOUT_COMPLETE,
+    CHECKOUT_PENDING,
+    CHECKOUT_UNKNOWN,
+    acheckout_state,
+    arecord_event,
+    checkout_marker_key,
+    handle_checkout_completed,
+)
+
+
+async def _is_authenticated(request):
+    # Resolving the lazy user reads the session and user tables, so it runs off the event loop.
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+def _login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await _is_authenticated(request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _require_method(method):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != method:
+                return HttpResponseNotAllowed([method])
+            return await view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def _start_payment_checkout(user, quote, metadata):
+    """Async ``views._start_payment_checkout``: same cache, idempotency key and frozen lines."""
+    last_completed = await views._completed_checkouts(user).afirst()
+    fingerprint = views._checkout_fingerprint(user, quote, metadata, last_completed)
+    cache_key = views._checkout_cache_key(fingerprint)
+    url = await cache.aget(cache_key)
+    if url:
+        return url
+
+    params, idempotency_key = views._payment_session_params(user, quote, metadata, fingerprint)
+    session = await get_gateway().create_checkout_session_async(params, idempotency_key=idempotency_key)
+    await PendingCheckout.objects.aget_or_create(
+        stripe_checkout_session_id=session.id, defaults=views._payment_checkout_defaults(user, quote)
+    )
+    await cache.aset(cache_key, session.url, views._session_url_timeout(params))
+    return session.url
+
+
+@_login_required
+@_require_method("POST")
+async def create_subscription_checkout(request):
+    error = await sync_to_async(views._subscription_checkout_error)(request)
+    if error:
+        return error
+    try:
+        session = await get_gateway().create_checkout_session_async(views._subscription_session_params(request.user))
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, views.STRIPE_UNAVAILABLE_MESSAGE)
+        return redirect("billing:subscribe_page")
+    await PendingCheckout.objects.aget_or_create(
+        stripe_checkout_session_id=session.id, defaults=views._subscription_checkout_defaults(request.user)
+    )
+    return redirect(session.url)
+
+
+@_login_required
+@_require_method("POST")
+async def create_product_checkout(request, product_id):
+    checkout, error = await sync_to_async(views._product_checkout)(request, product_id)
+    if error:
+        return error
+    try:
+        url = await _start_payment_checkout(request.user, *checkout)
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, views.STRIPE_UNAVAILABLE_MESSAGE)
+        return redirect("catalog:product_list")
+    return redirect(url)
+
+
+@_login_required
+@_require_method("POST")
+async def create_cart_checkout(request):
+    checkout, error = await sync_to_async(views._cart_checkout)(request)
+    if error:
+        return error
+    try:
+        url = await _start_payment_checkout(request.user, *checkout)
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, views.STRIPE_UNAVAILABLE_MESSAGE)
+        return redirect("billing:cart")
+    return redirect(url)
+
+
+async def _verify_with_stripe(user, session_id):
+    try:
+        session = await get_gateway().retrieve_checkout_session_async(session_id)
+    except (stripe.StripeError, GatewayUnavailable):
+        return None
+    state = views._stripe_session_state(session, user)
+    if state == CHECKOUT_COMPLETE:
+        await sync_to_async(handle_checkout_completed)(session)
+    return state
+
+
+class CheckoutSuccessView(views.CheckoutSuccessView):
+    async def get(self, request, *args, **kwargs):
+        session_id = request.GET.get("session_id", "")
+        state = None
+        if session_id and await _is_authenticated(request):
+            state = await acheckout_state(session_id, request.user)
+            if state == CHECKOUT_UNKNOWN and settings.STRIPE_SECRET_KEY:
+                state = await _verify_with_stripe(request.user, session_id)
+                if state is None:
+                    messages.warning(request, "Could not verify payment status from Stripe.")
+                    state = CHECKOUT_PENDING
+        await sync_to_async(views._clear_cart)(request)
+        context = self.get_context_data(session_id=session_id, checkout_state=state, **kwargs)
+        return self.render_to_response(context)
+
+
+@_login_required
+@_require_method("GET")
+async def checkout_status(request):
+    """Long-poll: answers once the checkout is applied, or after ``BILLING_CHECKOUT_STATUS_WAIT``."""
+    session_id = request.GET.get("session_id", "")
+    if not session_id:
+        return HttpResponseBadRequest("Missing session_id")
+    state = await acheckout_state(session_id, request.user)
+    deadline = time.monotonic() + settings.BILLING_CHECKOUT_STATUS_WAIT
+    while state == CHECKOUT_PENDING and time.monotonic() < deadline:
+        await asyncio.sleep(views.CHECKOUT_POLL_INTERVAL)
+        # The webhook worker leaves a cache marker, so waiting costs no queries.
+        if await cache.aget(checkout_marker_key(session_id)):
+            state = await acheckout_state(session_id, request.user)
+    if state == CHECKOUT_PENDING:
+        state = await acheckout_state(session_id, request.user)
+    if state == CHECKOUT_PENDING and await sync_to_async(views._may_verify)(session_id):
+        state = await _verify_with_stripe(request.user, session_id) or CHECKOUT_PENDING
+    return JsonResponse({"status": state})
+
+
+async def stripe_webhook(request):
+    event, error = views._webhook_event(request)
+    if error:
+        return error
+    await arecord_event(event)
+    return HttpResponse(status=200)
+
+
+# csrf_exempt wraps views in a sync function, which would turn this view back into a sync one.
+stripe_webhook.csrf_exempt = True
@@ -0,0 +1,188 @@
+"""Shopping cart storage.
+
+Views reach the cart through ``get_cart_backend(request)``: signed-in users get the
+backend named by ``BILLING_CART_BACKEND``, anonymous visitors always the session.
+Carts are ``{product_id: quantity}`` dicts. ``DatabaseCart`` (the default) keeps
+one ``CartLine`` row per user and product, so adding an item is a single atomic
+increment and a bulk quantity edit a single upsert, and the session row is never
+rewritten. ``SessionCart`` keeps the cart in ``request.session["cart"]`` as before;
+a session cart is merged into the user's lines the first time they are read after
+signing in.
+
+Both keep the item count next to the cart (in the cache or the session) and update
+it on every write, so the header badge reads one value instead of summing the cart.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Least
+from django.utils.module_loading import import_string
+
+from catalog.snapshot import get_snapshot
+
+from .models import CartLine
+
+SESSION_KEY = "cart"
+SESSION_COUNT_KEY = "cart_count"
+MAX_QUANTITY = 999
+# Bounds how long a count can lag behind a change it raced with.
+COUNT_CACHE_TIMEOUT = 300
+
+
+class CartBackend:
+    def items(self, request):
+        raise NotImplementedError
+
+    def add(self, request, product_id, quantity=1):
+        raise NotImplementedError
+
+    def remove(self, request, product_id):
+        """Remove a line; returns whether it was in the cart."""
+        raise NotImplementedError
+
+    def set_quantities(self, request, quantities):
+        """Set several lines at once; a quantity of 0 removes the line."""
+        raise NotImplementedError
+
+    def clear(self, request):
+        raise NotImplementedError
+
+    def count(self, request):
+        return sum(self.items(request).values())
+
+
+class SessionCart(CartBackend):
+    def items(self, request):
+        return {int(pid): int(qty) for pid, qty in request.session.get(SESSION_KEY, {}).items()}
+
+    def _save(self, request, cart):
+        cart = {str(pid): qty for pid, qty in cart.items() if qty > 0}
+        request.session[SESSION_KEY] = cart
+        request.session[SESSION_COUNT_KEY] = sum(cart.values())
+
+    def add(self, request, product_id, quantity=1):
+        cart = self.items(request)
+        cart[int(product_id)] = min(cart.get(int(product_id), 0) + quantity, MAX_QUANTITY)
+        self._save(request, cart)
+
+    def remove(self, request, product_id):
+        cart = self.items(request)
+        if cart.pop(int(product_id), None) is None:
+            return False
+        self._save(request, cart)
+        return True
+
+    def set_quantities(self, request, quantities):
+        cart = self.items(request)
+        cart.update({int(pid): qty for pid, qty in quantities.items()})
+        self._save(request, cart)
+
+    def clear(self, request):
+        for key in (SESSION_KEY, SESSION_COUNT_KEY):
+            request.session.pop(key, None)
+
+    def count(self, request):
+        count = request.session.get(SESSION_COUNT_KEY)
+        if count is None:
+            count = super().count(request)
+        return count
+
+
+class DatabaseCart(CartBackend):
+    def _lines(self, request):
+        return CartLine.objects.filter(user=request.user)
+
+    @staticmethod
+    def _count_key(request):
+        return f"billing:cart-count:{request.user.pk}"
+
+    def _adjust_count(self, request, delta):
+        try:
+            cache.incr(self._count_key(request), delta)
+        except ValueError:
+            pass  # Not cached; the next count() sums the lines.
+
+    def _set_count(self, request, count):
+        cache.set(self._count_key(request), count, COUNT_CACHE_TIMEOUT)
+
+    def items(self, request):
+        self._adopt_session_cart(request)
+        return dict(self._lines(request).values_list("product_id", "quantity"))
+
+    def add(self, request, product_id, quantity=1):
+        lines = self._lines(request).filter(product_id=product_id)
+        increment = Least(F("quantity") + quantity, MAX_QUANTITY)
+        if not lines.update(quantity=increment):
+            try:
+                with transaction.atomic():
+                    CartLine.objects.create(
+                        user=request.user, product_id=product_id, quantity=min(quantity, MAX_QUANTITY)
+                    )
+                self._adjust_count(request, min(quantity, MAX_QUANTITY))
+                return
+            except IntegrityError:
+                # Another request created the line first.
+                lines.update(quantity=increment)
+        # Below the cap the increment applied in full; at the cap part of it may have been clipped.
+        if lines.values_list("quantity", flat=True).first() == MAX_QUANTITY:
+            cache.delete(self._count_key(request))
+        else:
+            self._adjust_count(request, quantity)
+
+    def remove(self, request, product_id):
+        lines = self._lines(request).filter(product_id=product_id)
+        quantity = lines.values_list("quantity", flat=True).first()
+        if quantity is None or not lines.delete()[0]:
+            return False
+        self._adjust_count(request, -quantity)
+        return True
+
+    def set_quantities(self, request, quantities):
+        keep = {int(pid): qty for pid, qty in quantities.items() if qty > 0}
+        drop = [int(pid) for pid, qty in quantities.items() if qty <= 0]
+        with transaction.atomic():
+            if drop:
+                self._lines(request).filter(product_id__in=drop).delete()
+            if keep:
+                CartLine.objects.bulk_create(
+                    [CartLine(user=request.user, product_id=pid, quantity=qty) for pid, qty in keep.items()],
+                    update_conflicts=True,
+                    unique_fields=["user", "product"],
+                    update_fields=["quantity"],
+                )
+        self._set_count(request, self._total(request))
+
+    def clear(self, request):
+        self._lines(request).delete()
+        self._set_count(request, 0)
+
+    def _total(self, request):
+        return self._lines(request).aggregate(total=Sum("quantity"))["total"] or 0
+
+    def count(self, request):
+        count = cache.get(self._count_key(request))
+        if count is None:
+            self._adopt_session_cart(request)
+            count = self._total(request)
+            self._set_count(request, count)
+        return count
+
+    def _adopt_session_cart(self, request):
+        # A cart kept in the session (before sign-in, or before this backend was enabled)
+        # is added to the user's lines once.
+        legacy = request.session.get(SESSION_KEY)
+        if legacy:
+            known = get_snapshot().get_many(int(pid) for pid in legacy)
+            for pid, qty in legacy.items():
+                if int(pid) in known and int(qty) > 0:
+                    self.add(request, int(pid), int(qty))
+        if legacy is not None:
+            SessionCart().clear(request)
+
+
+def get_cart_backend(request):
+    if not request.user.is_authenticated:
+        return SessionCart()
+    return import_string(getattr(settings, "BILLING_CART_BACKEND", "billing.cart.DatabaseCart"))()
@@ -1,4 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart_backend
+
+
+def _count(request):
+    # Without a session cookie nobody is logged in, so there is no need to load the user.
+    if request is None or request.session.session_key is None or not request.user.is_authenticated:
+        return 0
+    return get_cart_backend(request).count(request)
+
+
 def cart_count(request):
-    cart = request.session.get("cart", {}) if request else {}
-    count = sum(int(qty) for qty in cart.values()) if cart else 0
-    return {"cart_item_count": count}
+    """Cart badge count, computed only if a template actually renders it."""
+    return {"cart_item_count": SimpleLazyObject(lambda: _count(request))}
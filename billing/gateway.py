@@ -0,0 +1,278 @@
+"""Stripe API access for billing views.
+
+All Stripe calls go through one ``StripeGateway`` per process. It owns a
+``StripeClient`` on a pooled keep-alive ``requests`` session with a per-call
+timeout and a bounded number of retries (Stripe's client backs off with jitter
+and reuses an idempotency key across retries). A circuit breaker counts
+connection errors, timeouts, 429s and 5xx responses; once they make up too
+large a share of recent calls, further calls fail fast with ``GatewayUnavailable``
+until a trial call succeeds. Per-endpoint latency is kept for ``metrics()``.
+
+The ``*_async`` methods make the same calls through an ``httpx`` async client for
+the async views, sharing the breaker and metrics with the sync ones.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 512
+# Errors that say Stripe (or the path to it) is unhealthy, as opposed to a bad request.
+UNHEALTHY_ERRORS = (stripe.APIConnectionError, stripe.APIError, stripe.RateLimitError)
+
+
+class GatewayUnavailable(Exception):
+    """Raised instead of calling Stripe while the circuit breaker is open."""
+
+
+# What views should turn into a "try again later" message rather than a server error.
+UNAVAILABLE_ERRORS = UNHEALTHY_ERRORS + (GatewayUnavailable,)
+
+
+class CircuitBreaker:
+    """Opens when at least ``min_calls`` calls in ``window`` seconds failed at ``failure_ratio`` or more.
+
+    ``allow`` hands out a ticket that the caller passes back to ``record``. Only the
+    half-open trial's outcome closes or reopens the breaker; outcomes of calls admitted
+    before it last opened are dropped, so a slow call cannot decide the trial.
+    """
+
+    def __init__(self, failure_ratio=0.5, min_calls=5, window=30, reset_timeout=30):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque()
+        self.opened_at = None
+        self.trial_in_flight = False
+        # Bumped whenever the breaker opens; tickets from an earlier generation are stale.
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if now - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """A ticket ``(generation, is_trial)`` for ``record`` if the call may go ahead, else ``None``."""
+        now = time.monotonic()
+        with self.lock:
+            state = self._state(now)
+            if state == "closed":
+                return self.generation, False
+            # Half-open: let exactly one trial call through.
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return self.generation, True
+            return None
+
+    def record(self, ok, ticket):
+        now = time.monotonic()
+        generation, is_trial = ticket
+        with self.lock:
+            if generation != self.generation:
+                return
+            if is_trial:
+                self.trial_in_flight = False
+                if ok:
+                    self.opened_at = None
+                    self.outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            if self.opened_at is not None:
+                return
+            self.outcomes.append((now, ok))
+            while self.outcomes and now - self.outcomes[0][0] > self.window:
+                self.outcomes.popleft()
+            failures = sum(1 for _, success in self.outcomes if not success)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_ratio:
+                logger.warning("Stripe circuit opened after %s failures in %s calls", failures, len(self.outcomes))
+                self._open(now)
+
+    def _open(self, now):
+        self.opened_at = now
+        self.generation += 1
+
+
+class EndpointMetrics:
+    __slots__ = ("calls", "errors", "rejected", "total_seconds", "max_seconds", "samples")
+
+    def __init__(self):
+        self.calls = self.errors = self.rejected = 0
+        self.total_seconds = self.max_seconds = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, seconds, ok):
+        self.calls += 1
+        self.errors += not ok
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.samples.append(seconds)
+
+    def summary(self):
+        samples = sorted(self.samples)
+
+        def percentile(fraction):
+            return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000 if samples else None
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "avg_ms": self.total_seconds / self.calls * 1000 if self.calls else None,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": self.max_seconds * 1000,
+        }
+
+
+def build_session(pool_size):
+    """Keep-alive session for Stripe; retries are left to Stripe's client, which reuses idempotency keys."""
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class StripeGateway:
+    def __init__(self, api_key, api_base=None, timeout=10, max_retries=2, pool_size=20, breaker=None):
+        self.session = build_session(pool_size)
+        self.client = stripe.StripeClient(
+            api_key,
+            http_client=stripe.RequestsClient(
+                timeout=timeout, session=self.session, async_fallback_client=stripe.HTTPXClient(timeout=timeout)
+            ),
+            max_network_retries=max_retries,
+            base_addresses={"api": api_base} if api_base else None,
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self.endpoints = {}
+        self.metrics_lock = threading.Lock()
+
+    def _admit(self, endpoint):
+        ticket = self.breaker.allow()
+        if ticket is None:
+            with self.metrics_lock:
+                self.endpoints.setdefault(endpoint, EndpointMetrics()).rejected += 1
+            raise GatewayUnavailable(f"Stripe is temporarily unavailable ({endpoint})")
+        return time.perf_counter(), ticket
+
+    def _observe(self, endpoint, admitted, ok):
+        started, ticket = admitted
+        self.breaker.record(ok, ticket)
+        elapsed = time.perf_counter() - started
+        with self.metrics_lock:
+            self.endpoints.setdefault(endpoint, EndpointMetrics()).observe(elapsed, ok)
+
+    def call(self, endpoint, func, *args, **kwargs):
+        admitted = self._admit(endpoint)
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        except UNHEALTHY_ERRORS:
+            raise
+        except stripe.StripeError:
+            # Declines and invalid requests mean Stripe answered; they do not trip the breaker.
+            ok = True
+            raise
+        finally:
+            self._observe(endpoint, admitted, ok)
+
+    async def call_async(self, endpoint, func, *args, **kwargs):
+        admitted = self._admit(endpoint)
+        ok = False
+        try:
+            result = await func(*args, **kwargs)
+            ok = True
+            return result
+        except UNHEALTHY_ERRORS:
+            raise
+        except stripe.StripeError:
+            ok = True
+            raise
+        finally:
+            self._observe(endpoint, admitted, ok)
+
+    def create_checkout_session(self, params, idempotency_key=None):
+        options = {"idempotency_key": idempotency_key} if idempotency_key else None
+        return self.call("checkout.sessions.create", self.client.v1.checkout.sessions.create, params, options)
+
+    def retrieve_checkout_session(self, session_id):
+        return self.call("checkout.sessions.retrieve", self.client.v1.checkout.sessions.retrieve, session_id)
+
+    async def create_checkout_session_async(self, params, idempotency_key=None):
+        options = {"idempotency_key": idempotency_key} if idempotency_key else None
+        return await self.call_async(
+            "checkout.sessions.create", self.client.v1.checkout.sessions.create_async, params, options
+        )
+
+    async def retrieve_checkout_session_async(self, session_id):
+        return await self.call_async(
+            "checkout.sessions.retrieve", self.client.v1.checkout.sessions.retrieve_async, session_id
+        )
+
+    def metrics(self):
+        with self.metrics_lock:
+            endpoints = {name: metrics.summary() for name, metrics in self.endpoints.items()}
+        return {"breaker": self.breaker.state, "endpoints": endpoints}
+
+    def close(self):
+        self.session.close()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = StripeGateway(
+                    settings.STRIPE_SECRET_KEY,
+                    api_base=settings.STRIPE_API_BASE or None,
+                    timeout=settings.STRIPE_TIMEOUT,
+                    max_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                    breaker=CircuitBreaker(
+                        failure_ratio=settings.STRIPE_BREAKER_FAILURE_RATIO,
+                        min_calls=settings.STRIPE_BREAKER_MIN_CALLS,
+                        window=settings.STRIPE_BREAKER_WINDOW,
+                        reset_timeout=settings.STRIPE_BREAKER_RESET_TIMEOUT,
+                    ),
+                )
+    return _gateway
+
+
+def reset_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is not None:
+            _gateway.close()
+        _gateway = None
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    if setting.startswith("STRIPE_"):
+        reset_gateway()
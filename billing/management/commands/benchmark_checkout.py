@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from billing.testing import StripeStubServer
+from catalog.models import Category, Product
+from catalog.versioning import bump_catalog_version
+
+SOURCE_PREFIX = "bench-"
+MODES = ("wsgi", "asgi")
+
+
+def bench_email(mode):
+    return f"{SOURCE_PREFIX}{mode}@example.invalid"
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare checkout throughput of the sync views behind a threaded WSGI handler with the async "
+        "views on one ASGI event loop, against a local Stripe stub that adds --latency to every call"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Checkouts per mode")
+        parser.add_argument("--concurrency", type=int, default=100, help="Checkouts in flight at once")
+        parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads (like gunicorn --threads)")
+        parser.add_argument("--latency", type=float, default=0.3, help="Seconds the Stripe stub takes per call")
+        parser.add_argument("--run", choices=MODES, help="Internal: run one mode against STRIPE_API_BASE and print JSON")
+
+    def handle(self, *args, **options):
+        if options["run"]:
+            result = self._run(options["run"], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(
+            f"{options['requests']} checkouts per mode, {options['concurrency']} in flight, "
+            f"Stripe latency {options['latency'] * 1000:.0f}ms (rows are prefixed '{SOURCE_PREFIX}' and removed afterwards)"
+        )
+        stub = StripeStubServer(delay=options["latency"]).start()
+        try:
+            self._setup(options["requests"])
+            for mode in MODES:
+                result = self._spawn(mode, stub.url, options)
+                throughput = result["ok"] / result["elapsed"] if result["elapsed"] else 0
+                workers = f"{options['threads']} threads" if mode == "wsgi" else "1 event loop"
+                self.stdout.write(
+                    f"{mode:>5} ({workers:>12}) {result['elapsed']:8.2f}s  {throughput:8.1f} checkouts/s  "
+                    f"p50 {result['p50'] * 1000:7.0f}ms  p95 {result['p95'] * 1000:7.0f}ms  "
+                    f"ok {result['ok']}  errors {result['errors']}"
+                )
+        finally:
+            stub.stop()
+            self._cleanup()
+
+    def _spawn(self, mode, api_base, options):
+        # Each mode runs in a fresh process so the URLconf picks the matching views.
+        env = {
+            **os.environ,
+            "STRIPE_SECRET_KEY": "sk_test_benchmark",
+            "STRIPE_API_BASE": api_base,
+            "STRIPE_MAX_NETWORK_RETRIES": "0",
+            "BILLING_ASYNC_VIEWS": "true" if mode == "asgi" else "false",
+        }
+        command = [sys.executable, str(settings.BASE_DIR / "manage.py"), "benchmark_checkout", "--run", mode]
+        for option in ("requests", "concurrency", "threads"):
+            command += [f"--{option}", str(options[option])]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f"{mode} run failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _setup(self, count):
+        self._cleanup()
+        category = Category.objects.create(source_id=f"{SOURCE_PREFIX}c0", name_en="Benchmark")
+        Product.objects.bulk_create(
+            Product(
+                source_id=f"{SOURCE_PREFIX}p{i}", name_en=f"Benchmark product {i}", price=Decimal("9.99"), category=category
+            )
+            for i in range(count)
+        )
+        for mode in MODES:
+            User.objects.create_user(email=bench_email(mode), password=None, email_verified_at=timezone.now())
+        bump_catalog_version()
+
+    def _cleanup(self):
+        # Deleting the users also removes their pending checkouts.
+        User.objects.filter(email__in=[bench_email(mode) for mode in MODES]).delete()
+        if Product.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()[0]:
+            bump_catalog_version()
+        Category.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()
+
+    def _run(self, mode, options):
+        override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]).enable()
+        user = User.objects.get(email=bench_email(mode))
+        urls = [
+            reverse("billing:product_checkout", args=[pk])
+            for pk in Product.objects.filter(source_id__startswith=SOURCE_PREFIX)
+            .order_by("id")
+            .values_list("id", flat=True)[: options["requests"]]
+        ]
+        login = Client()
+        login.force_login(user)
+        started = time.perf_counter()
+        if mode == "wsgi":
+            samples = self._run_wsgi(urls, login.cookies, options["threads"])
+        else:
+            samples = asyncio.run(self._run_asgi(urls, login.cookies, options["concurrency"]))
+        elapsed = time.perf_counter() - started
+        latencies = [seconds for seconds, ok in samples if ok]
+        return {
+            "elapsed": elapsed,
+            "ok": len(latencies),
+            "errors": len(samples) - len(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+        }
+
+    @staticmethod
+    def _succeeded(response):
+        return response.status_code == 302 and response["Location"].startswith("https://checkout.stripe.test/")
+
+    def _run_wsgi(self, urls, cookies, threads):
+        def checkout(url):
+            client = Client()
+            client.cookies = cookies
+            started = time.perf_counter()
+            response = client.post(url)
+            return time.perf_counter() - started, self._succeeded(response)
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(checkout, urls))
+
+    async def _run_asgi(self, urls, cookies, concurrency):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def checkout(url):
+            async with slots:
+                client = AsyncClient()
+                client.cookies = cookies
+                started = time.perf_counter()
+                response = await client.post(url)
+                return time.perf_counter() - started, self._succeeded(response)
+
+        return await asyncio.gather(*(checkout(url) for url in urls))
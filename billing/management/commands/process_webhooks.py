@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing.webhooks import DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS, process_batch
+
+
+class Command(BaseCommand):
+    help = "Apply stored Stripe webhook events in batches, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Events claimed at a time")
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=DEFAULT_MAX_ATTEMPTS,
+            help="Give up on an event (status 'failed') after this many attempts",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep polling for new events instead of exiting")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds to sleep when the inbox is empty (--loop)")
+
+    def handle(self, *args, **options):
+        while True:
+            result = process_batch(options["batch_size"], options["max_attempts"])
+            if result:
+                self.stdout.write(f"Webhook events - {result}")
+            if result.processed + result.skipped + result.retried + result.failed >= options["batch_size"]:
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
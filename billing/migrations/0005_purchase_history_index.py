@@ -0,0 +1,17 @@
+# Generated by Django 4.2.26 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_pendingcheckout'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['user', 'created_at'], name='billing_purchase_history_idx'),
+        ),
+    ]
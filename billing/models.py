@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
@@ -23,6 +25,8 @@ class Subscription(models.Model):
     price_id = models.CharField(max_length=255, blank=True)
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default="incomplete")
     current_period_end = models.DateTimeField(null=True, blank=True)
+    # Creation time of the newest Stripe event applied, so older events delivered late are ignored.
+    last_event_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -47,6 +51,104 @@ class Purchase(models.Model):
     class Meta:
         ordering = ["-created_at"]
         unique_together = ("stripe_checkout_session_id", "product")
+        indexes = [models.Index(fields=["user", "created_at"], name="billing_purchase_history_idx")]
 
     def __str__(self):
         return f"{self.user.email} - {self.product.name_en} x{self.quantity} ({self.amount} {self.currency})"
+
+
+class CartLine(models.Model):
+    """One product in a user's cart (see ``billing.cart.DatabaseCart``)."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart_lines")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    quantity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ("user", "product")
+
+    def __str__(self):
+        return f"{self.user.email} - {self.product_id} x{self.quantity}"
+
+
+class PendingCheckout(models.Model):
+    """A Stripe checkout session we created, with its priced lines frozen at creation.
+
+    The webhook turns the lines straight into Purchase rows, so later catalog price
+    changes never alter what a customer was charged, and stamps ``completed_at``.
+    Subscription sessions have no lines.
+    """
+
+    stripe_checkout_session_id = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="pending_checkouts")
+    lines = models.JSONField(default=list)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=10, default="usd")
+    tier = models.CharField(max_length=10, blank=True)
+    promo_code = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.stripe_checkout_session_id} ({self.total} {self.currency})"
+
+    @staticmethod
+    def lines_from_quote(quote):
+        return [
+            {
+                "product_id": line.product.id,
+                "quantity": line.quantity,
+                "unit_price": str(line.price),
+                "amount": str(line.line_total),
+                "discount_applied": bool(line.discounts),
+            }
+            for line in quote.lines
+        ]
+
+    def build_purchases(self, payment_intent=""):
+        return [
+            Purchase(
+                user_id=self.user_id,
+                product_id=line["product_id"],
+                quantity=line["quantity"],
+                amount=Decimal(line["amount"]),
+                currency=self.currency,
+                stripe_checkout_session_id=self.stripe_checkout_session_id,
+                stripe_payment_intent_id=payment_intent or "",
+                discount_applied=line["discount_applied"],
+            )
+            for line in self.lines
+        ]
+
+
+class WebhookEvent(models.Model):
+    """Stripe event stored on receipt and applied later by ``process_webhooks``."""
+
+    PENDING = "pending"
+    PROCESSED = "processed"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (PROCESSED, "Processed"),
+        (SKIPPED, "Skipped"),
+        (FAILED, "Failed"),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    event_created = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["event_created", "id"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="billing_webhook_due_idx")]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
@@ -0,0 +1,213 @@
+"""Cart pricing shared by the cart page, checkout and the Stripe webhook.
+
+A cart is priced in one pass by ``quote_cart``; every place that shows or charges
+a price consumes the resulting ``Quote``, so the cart page, the Stripe charge and
+the recorded purchase always agree. Discount rules are pluggable (see
+``BILLING_PRICING_RULES``) and take a fraction off a line's unit price, rounded to
+the cent after each rule, so a line total is always unit price times quantity,
+exactly as Stripe computes it.
+
+Quotes are memoized per process on (cart contents, tier, promo code, catalog
+version); a catalog write or a settings change yields fresh quotes.
+"""
+
+import hashlib
+import json
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from catalog.snapshot import get_snapshot
+from catalog.versioning import get_catalog_version
+
+CENT = Decimal("0.01")
+QUOTE_CACHE_SIZE = 2048
+
+DEFAULT_RULES = [
+    "billing.pricing.QuantityTierRule",
+    "billing.pricing.TierDiscountRule",
+    "billing.pricing.PromoCodeRule",
+]
+
+
+def _rate(value):
+    return Decimal(str(value))
+
+
+def _percent(rate):
+    return f"{(rate * 100).normalize():f}%"
+
+
+class QuoteLine:
+    __slots__ = ("product", "quantity", "list_price", "price", "line_total", "discounts")
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.list_price = product.price
+        self.price = product.price
+        self.line_total = None
+        self.discounts = []
+
+    @property
+    def unit_amount(self):
+        """Unit price in the currency's minor unit, as sent to Stripe."""
+        return int((self.price * 100).quantize(Decimal("1")))
+
+    @property
+    def list_total(self):
+        return self.list_price * self.quantity
+
+
+class Quote:
+    __slots__ = ("lines", "tier", "promo_code", "subtotal", "total", "missing")
+
+    def __init__(self, tier, promo_code):
+        self.lines = []
+        self.tier = tier
+        self.promo_code = promo_code
+        self.missing = []
+        self.subtotal = self.total = Decimal("0.00")
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    @property
+    def discount_total(self):
+        return self.subtotal - self.total
+
+    @property
+    def discount_applied(self):
+        return self.total < self.subtotal
+
+    @property
+    def discount_labels(self):
+        labels = []
+        for line in self.lines:
+            for label in line.discounts:
+                if label not in labels:
+                    labels.append(label)
+        return labels
+
+    @property
+    def item_count(self):
+        return sum(line.quantity for line in self.lines)
+
+    def fingerprint(self, *extra):
+        """Stable hash of the priced lines, tier and promo code (plus any ``extra`` values)."""
+        lines = [[line.product.id, line.quantity, str(line.price)] for line in self.lines]
+        payload = json.dumps([lines, self.tier, self.promo_code, *extra], separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class PricingRule:
+    """Base rule: ``discount`` returns ``(rate, label)`` to take ``rate`` off the unit price, or ``None``."""
+
+    def discount(self, line, quote):
+        return None
+
+
+class TierDiscountRule(PricingRule):
+    """Percentage off for account tiers listed in ``BILLING_TIER_DISCOUNTS`` (e.g. pro members)."""
+
+    def discount(self, line, quote):
+        rate = settings.BILLING_TIER_DISCOUNTS.get(quote.tier)
+        if rate:
+            rate = _rate(rate)
+            return rate, f"{str(quote.tier).title()} {_percent(rate)} off"
+        return None
+
+
+class PromoCodeRule(PricingRule):
+    """Percentage off for a valid code from ``BILLING_PROMO_CODES``."""
+
+    def discount(self, line, quote):
+        rate = promo_code_rate(quote.promo_code)
+        if rate:
+            return rate, f"Code {quote.promo_code} ({_percent(rate)} off)"
+        return None
+
+
+class QuantityTierRule(PricingRule):
+    """Percentage off a line once its quantity reaches a threshold in ``BILLING_QUANTITY_TIERS``."""
+
+    def discount(self, line, quote):
+        best = None
+        for min_quantity, rate in settings.BILLING_QUANTITY_TIERS:
+            if line.quantity >= min_quantity and (best is None or min_quantity > best[0]):
+                best = (min_quantity, _rate(rate))
+        if best:
+            return best[1], f"{_percent(best[1])} off {best[0]}+"
+        return None
+
+
+def normalize_promo_code(code):
+    return (code or "").strip().upper()
+
+
+def promo_code_rate(code):
+    code = normalize_promo_code(code)
+    if not code:
+        return None
+    for known, rate in settings.BILLING_PROMO_CODES.items():
+        if normalize_promo_code(known) == code:
+            return _rate(rate)
+    return None
+
+
+def get_rules():
+    return [import_string(path)() for path in getattr(settings, "BILLING_PRICING_RULES", DEFAULT_RULES)]
+
+
+def cart_items(cart):
+    """Canonical, hashable form of a ``{product_id: quantity}`` cart."""
+    items = {}
+    for pid, qty in cart.items():
+        qty = int(qty)
+        if qty > 0:
+            items[int(pid)] = items.get(int(pid), 0) + qty
+    return tuple(sorted(items.items()))
+
+
+def quote_cart(cart, tier, promo_code="", include_inactive=False):
+    """Price a ``{product_id: quantity}`` cart for a user tier.
+
+    Products that no longer exist (or are inactive, unless ``include_inactive``) are left
+    out and listed in ``Quote.missing``. The returned quote is shared; treat it as read-only.
+    """
+    return _quote(cart_items(cart), tier, normalize_promo_code(promo_code), include_inactive, get_catalog_version())
+
+
+@lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def _quote(items, tier, promo_code, include_inactive, version):
+    products = get_snapshot().get_many(pid for pid, _ in items)
+    quote = Quote(tier, promo_code)
+    for pid, qty in items:
+        product = products.get(pid)
+        if product is None or not (product.active or include_inactive):
+            quote.missing.append(pid)
+        else:
+            quote.lines.append(QuoteLine(product, qty))
+
+    rules = get_rules()
+    for line in quote.lines:
+        for rule in rules:
+            result = rule.discount(line, quote)
+            if result:
+                rate, label = result
+                line.price = max((line.price * (1 - rate)).quantize(CENT), Decimal("0.00"))
+                line.discounts.append(label)
+        line.line_total = (line.price * line.quantity).quantize(CENT)
+        quote.subtotal += line.list_total
+        quote.total += line.line_total
+    return quote
+
+
+@receiver(setting_changed)
+def _clear_quotes(setting, **kwargs):
+    if setting.startswith("BILLING_"):
+        _quote.cache_clear()
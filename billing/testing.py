@@ -0,0 +1,85 @@
+"""Test support: a local stand-in for Stripe's Checkout Sessions API.
+
+Used by the billing tests and ``benchmark_checkout``; nothing in the served site imports it.
+
+Creating a session returns a new id, or replays the earlier response for a repeated
+Idempotency-Key as Stripe does. ``failures`` requests are answered with a 503 first,
+and every request waits ``delay`` seconds to simulate Stripe's latency.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        key = self.headers.get("Idempotency-Key")
+        with server.lock:
+            server.requests.append({"path": self.path, "idempotency_key": key, "params": parse_qs(body)})
+        server.wait()
+        with server.lock:
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+            elif key not in server.responses:
+                number = len(server.responses) + 1
+                server.responses[key] = {
+                    "id": f"cs_test_{number}",
+                    "object": "checkout.session",
+                    "url": f"https://checkout.stripe.test/pay/cs_test_{number}",
+                }
+        if failing:
+            self.respond(503, {"error": {"type": "api_error", "message": "Service unavailable"}})
+        else:
+            self.respond(200, server.responses[key])
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StripeStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, delay=0, failures=0):
+        super().__init__(("127.0.0.1", 0), StripeStubHandler)
+        self.delay = delay
+        self.failures = failures
+        self.requests = []
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def wait(self):
+        if self.delay:
+            self.stopped.wait(self.delay)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
@@ -1,3 +1,781 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync
+from django.contrib.messages.storage import default_storage
+from django.core.cache import cache
+from django.db import connection
+from django.middleware.csrf import CsrfViewMiddleware
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from accounts.sessions import SessionStore, flush_sessions
+from catalog.models import Category, Product
+from catalog.snapshot import get_snapshot
+from catalog.versioning import bump_catalog_version
+
+from . import async_views, views
+from .cart import MAX_QUANTITY, DatabaseCart, get_cart_backend
+from .gateway import CircuitBreaker, GatewayUnavailable, StripeGateway, reset_gateway
+from .models import CartLine, PendingCheckout, Purchase, Subscription, WebhookEvent
+from .pricing import quote_cart
+from .testing import StripeStubServer
+from .webhooks import claim_batch, handle_checkout_completed, process_batch, record_event
+
+
+class CheckoutFinalizationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", password="x")
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.products = Product.objects.bulk_create(
+            Product(source_id=f"p{i}", name_en=f"Product {i}", price=Decimal("2.50"), category=category)
+            for i in range(40)
+        )
+        # Rows written inside the test transaction never trigger the on-commit bump.
+        bump_catalog_version()
+        get_snapshot()
+
+    def session(self, products, session_id="cs_test", quantity=2, pending=True):
+        cart = {product.pk: quantity for product in products}
+        if pending:
+            quote = quote_cart(cart, User.BASIC)
+            PendingCheckout.objects.update_or_create(
+                stripe_checkout_session_id=session_id,
+                defaults={
+                    "user": self.user,
+                    "lines": PendingCheckout.lines_from_quote(quote),
+                    "total": quote.total,
+                    "tier": quote.tier,
+                },
+            )
+        return {
+            "id": session_id,
+            "mode": "payment",
+            "currency": "usd",
+            "payment_intent": "pi_test",
+            "metadata": {
+                "user_id": str(self.user.pk),
+                "type": "product_cart",
+                "cart": "|".join(f"{pk}:{qty}" for pk, qty in cart.items()),
+                "tier": User.BASIC,
+            },
+        }
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        small = self.session(self.products[:2], "cs_small")
+        large = self.session(self.products, "cs_large")
+        # pending checkout lookup, savepoint, upsert, completion mark, savepoint release
+        with self.assertNumQueries(5):
+            handle_checkout_completed(small)
+        with self.assertNumQueries(5):
+            handle_checkout_completed(large)
+
+        self.assertEqual(Purchase.objects.filter(stripe_checkout_session_id="cs_large").count(), 40)
+        purchase = Purchase.objects.get(stripe_checkout_session_id="cs_small", product=self.products[0])
+        self.assertEqual(purchase.amount, Decimal("5.00"))
+        self.assertIsNotNone(PendingCheckout.objects.get(stripe_checkout_session_id="cs_small").completed_at)
+
+    def test_records_prices_frozen_at_checkout(self):
+        session = self.session(self.products[:1])
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal("9.99"))
+        bump_catalog_version()
+
+        handle_checkout_completed(session)
+
+        self.assertEqual(Purchase.objects.get(stripe_checkout_session_id="cs_test").amount, Decimal("5.00"))
+
+    def test_session_without_snapshot_is_repriced(self):
+        handle_checkout_completed(self.session(self.products[:2], pending=False))
+        self.assertEqual(Purchase.objects.filter(stripe_checkout_session_id="cs_test").count(), 2)
+
+    def test_redelivery_updates_rows_in_place(self):
+        handle_checkout_completed(self.session(self.products[:3]))
+        handle_checkout_completed(self.session(self.products[:3], quantity=3))
+
+        purchases = Purchase.objects.filter(stripe_checkout_session_id="cs_test")
+        self.assertEqual(purchases.count(), 3)
+        self.assertEqual({purchase.quantity for purchase in purchases}, {3})
+        self.assertEqual({purchase.amount for purchase in purchases}, {Decimal("7.50")})
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    BILLING_TIER_DISCOUNTS={"pro": "0.20"},
+    BILLING_QUANTITY_TIERS=[(10, "0.05")],
+    BILLING_PROMO_CODES={"welcome10": "0.10"},
+)
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.soup, self.tea, self.retired = Product.objects.bulk_create(
+            [
+                Product(source_id="p1", name_en="Soup", price=Decimal("2.50"), category=category),
+                Product(source_id="p2", name_en="Tea", price=Decimal("1.99"), category=category),
+                Product(source_id="p3", name_en="Retired", price=Decimal("5.00"), category=category, active=False),
+            ]
+        )
+        bump_catalog_version()
+
+    def test_basic_totals_and_missing_products(self):
+        quote = quote_cart({self.soup.pk: 2, str(self.tea.pk): "3", self.retired.pk: 1, 999999: 1}, User.BASIC)
+
+        self.assertEqual([line.line_total for line in quote.lines], [Decimal("5.00"), Decimal("5.97")])
+        self.assertEqual((quote.subtotal, quote.total), (Decimal("10.97"), Decimal("10.97")))
+        self.assertEqual(quote.missing, [self.retired.pk, 999999])
+        self.assertFalse(quote.discount_applied)
+
+    def test_pro_discount_is_rounded_per_unit(self):
+        quote = quote_cart({self.tea.pk: 3}, User.PRO)
+        line = quote.lines[0]
+
+        # 1.99 * 0.8 = 1.592 is rounded before multiplying, as Stripe charges unit amounts.
+        self.assertEqual((line.price, line.unit_amount, line.line_total), (Decimal("1.59"), 159, Decimal("4.77")))
+        self.assertEqual(quote.discount_total, Decimal("1.20"))
+        self.assertEqual(quote.discount_labels, ["Pro 20% off"])
+
+    def test_rules_stack_in_order(self):
+        quote = quote_cart({self.tea.pk: 10}, User.PRO, " Welcome10 ")
+        line = quote.lines[0]
+
+        # 1.99 -> 1.89 (5% off 10+) -> 1.51 (pro) -> 1.36 (code)
+        self.assertEqual(line.price, Decimal("1.36"))
+        self.assertEqual(quote.total, Decimal("13.60"))
+        self.assertEqual(line.discounts, ["5% off 10+", "Pro 20% off", "Code WELCOME10 (10% off)"])
+
+    def test_quotes_are_reused_until_the_catalog_changes(self):
+        quote = quote_cart({self.soup.pk: 1}, User.BASIC)
+        self.assertIs(quote_cart({str(self.soup.pk): "1"}, User.BASIC), quote)
+
+        Product.objects.filter(pk=self.soup.pk).update(price=Decimal("3.00"))
+        self.assertIs(quote_cart({self.soup.pk: 1}, User.BASIC), quote)
+        bump_catalog_version()
+
+        self.assertEqual(quote_cart({self.soup.pk: 1}, User.BASIC).total, Decimal("3.00"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OrdersViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", password="x")
+        other = User.objects.create_user(email="other@example.com", password="x")
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.products = Product.objects.bulk_create(
+            Product(source_id=f"p{index}", name_en=f"Product {index}", price=Decimal("2.50"), category=category)
+            for index in range(3)
+        )
+        self.now = timezone.now()
+        self.order(other, "cs_other", 0)
+        self.client.force_login(self.user)
+        self.url = reverse("billing:orders")
+
+    def order(self, user, session_id, minutes_ago, lines=2):
+        Purchase.objects.bulk_create(
+            Purchase(
+                user=user,
+                product=product,
+                amount=Decimal("2.50"),
+                stripe_checkout_session_id=session_id,
+                discount_applied=index == 0,
+                created_at=self.now - timedelta(minutes=minutes_ago),
+            )
+            for index, product in enumerate(self.products[:lines])
+        )
+
+    def orders_page(self, query=""):
+        response = self.client.get(f"{self.url}?{query}")
+        return response.context["orders"], response.context["next_query"]
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.order(self.user, "cs_first", 0)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+
+        for index in range(30):
+            self.order(self.user, f"cs_{index:02}", index + 1, lines=3)
+        with self.assertNumQueries(len(queries)):
+            orders, _ = self.orders_page()
+        self.assertEqual(len(orders), views.ORDERS_PER_PAGE)
+        self.assertEqual(len(orders[1]["items"]), 3)
+
+    def test_pages_cover_every_order_once(self):
+        # Orders sharing a timestamp are ordered by session id.
+        for index in range(views.ORDERS_PER_PAGE + 5):
+            self.order(self.user, f"cs_{index:02}", index // 3)
+
+        seen, query = [], ""
+        while query is not None:
+            orders, query = self.orders_page(query)
+            seen += [order["session_id"] for order in orders]
+
+        newest_first = sorted(range(views.ORDERS_PER_PAGE + 5), key=lambda index: (index // 3, -index))
+        self.assertEqual(seen, [f"cs_{index:02}" for index in newest_first])
+
+    def test_order_totals(self):
+        self.order(self.user, "cs_first", 0)
+
+        orders, next_query = self.orders_page()
+
+        self.assertEqual(orders[0]["total"], Decimal("5.00"))
+        self.assertTrue(orders[0]["discount_applied"])
+        self.assertIsNone(next_query)
+
+
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="member@example.com", password="x")
+        self.created = int(time.time())
+
+    def event(self, event_id, event_type, data_object, created=None):
+        return {
+            "id": event_id,
+            "type": event_type,
+            "created": created or self.created,
+            "data": {"object": data_object},
+        }
+
+    def subscription_checkout(self, event_id="evt_checkout", created=None):
+        session = {
+            "id": "cs_sub",
+            "mode": "subscription",
+            "subscription": "sub_1",
+            "customer": "cus_1",
+            "metadata": {"user_id": str(self.user.pk), "price_id": "price_pro"},
+        }
+        return self.event(event_id, "checkout.session.completed", session, created)
+
+    def subscription_update(self, event_id="evt_update", status="canceled", created=None):
+        subscription = {"id": "sub_1", "customer": "cus_1", "status": status}
+        return self.event(event_id, "customer.subscription.updated", subscription, created)
+
+    def test_redeliveries_and_unhandled_events_are_dropped(self):
+        record_event(self.subscription_checkout())
+        record_event(self.subscription_checkout())
+        record_event(self.event("evt_other", "invoice.paid", {}))
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertEqual(process_batch().processed, 1)
+        record_event(self.subscription_checkout())
+        self.assertFalse(process_batch())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.user_type, User.PRO)
+
+    def test_failure_is_retried_with_backoff(self):
+        # An update for a subscription whose checkout has not been applied cannot be stored yet.
+        record_event(self.subscription_update())
+
+        with self.assertLogs("billing.webhooks", "ERROR"):
+            result = process_batch()
+
+        self.assertEqual(result.retried, 1)
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (WebhookEvent.PENDING, 1))
+        self.assertIn("IntegrityError", event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertFalse(process_batch())
+
+        record_event(self.subscription_checkout(created=self.created - 60))
+        self.assertEqual(process_batch().processed, 1)
+        WebhookEvent.objects.filter(pk=event.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(process_batch().processed, 1)
+        self.assertEqual(Subscription.objects.get().status, "canceled")
+
+    def test_failure_after_max_attempts_is_final(self):
+        record_event(self.subscription_update())
+
+        with self.assertLogs("billing.webhooks", "ERROR"):
+            result = process_batch(max_attempts=1)
+
+        self.assertEqual(result.failed, 1)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.FAILED)
+
+    def test_claimed_events_are_hidden_from_other_workers(self):
+        record_event(self.subscription_checkout())
+
+        self.assertEqual(len(claim_batch(10)), 1)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_claim_is_a_single_conditional_update(self):
+        for number in range(3):
+            record_event(self.subscription_checkout(f"evt_{number}", created=self.created + number))
+        WebhookEvent.objects.filter(event_id="evt_2").update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+
+        with CaptureQueriesContext(connection) as queries:
+            events = claim_batch(10)
+
+        self.assertEqual([event.event_id for event in events], ["evt_0", "evt_1"])
+        statements = [query["sql"] for query in queries if not query["sql"].startswith(("SAVEPOINT", "RELEASE"))]
+        self.assertEqual([sql.split()[0] for sql in statements], ["UPDATE", "SELECT"])
+        self.assertIn('"next_attempt_at" <=', statements[0].split("IN (")[0])
+
+    def test_expired_claims_come_back(self):
+        record_event(self.subscription_checkout())
+        claim_batch(10)
+        WebhookEvent.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(len(claim_batch(10)), 1)
+
+    def test_stale_checkout_does_not_upgrade_the_user(self):
+        record_event(self.subscription_checkout())
+        process_batch()
+        record_event(self.subscription_update(created=self.created + 60))
+        process_batch()
+        User.objects.filter(pk=self.user.pk).update(user_type=User.BASIC)
+
+        # The checkout event is redelivered under a new id after the cancellation was applied.
+        record_event(self.subscription_checkout("evt_checkout_again"))
+        result = process_batch()
+
+        self.assertEqual(result.processed, 1)
+        self.assertEqual(Subscription.objects.get().status, "canceled")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.user_type, User.BASIC)
+
+
+@override_settings(
+    STRIPE_SECRET_KEY="",
+    BILLING_CHECKOUT_STATUS_WAIT=1,
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class CheckoutStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        self.client.force_login(self.user)
+        self.checkout = PendingCheckout.objects.create(
+            stripe_checkout_session_id="cs_status", user=self.user, total=Decimal("5.00")
+        )
+        self.url = reverse("billing:checkout_status")
+
+    def status(self, view=None):
+        started = time.monotonic()
+        if view is None:
+            response = self.client.get(self.url, {"session_id": "cs_status"})
+        else:
+            request = RequestFactory().get(self.url, {"session_id": "cs_status"})
+            request.user = self.user
+            response = async_to_sync(view)(request)
+        return json.loads(response.content)["status"], time.monotonic() - started
+
+    def test_paid_checkout_is_complete(self):
+        PendingCheckout.objects.filter(pk=self.checkout.pk).update(completed_at=timezone.now())
+
+        self.assertEqual(self.status()[0], "complete")
+        self.assertEqual(self.status(async_views.checkout_status)[0], "complete")
+
+    @override_settings(BILLING_CHECKOUT_STATUS_WAIT=20)
+    def test_sync_view_answers_pending_without_waiting(self):
+        state, elapsed = self.status()
+
+        self.assertEqual(state, "pending")
+        self.assertLess(elapsed, 1)
+
+    def test_async_view_answers_pending_after_the_wait(self):
+        state, elapsed = self.status(async_views.checkout_status)
+
+        self.assertEqual(state, "pending")
+        self.assertGreaterEqual(elapsed, 1)
+
+    def test_other_users_checkout_is_unknown(self):
+        other = User.objects.create_user(email="other@example.com", password="x", email_verified_at=timezone.now())
+        self.client.force_login(other)
+
+        self.assertEqual(self.status()[0], "unknown")
+
+
+def start_stripe_stub(test):
+    server = StripeStubServer().start()
+    test.addCleanup(server.stop)
+    return server, server.url
+
+
+@override_settings(
+    STRIPE_SECRET_KEY="sk_test_stub",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class IdempotentCheckoutTests(TestCase):
+    def setUp(self):
+        self.server, api_base = start_stripe_stub(self)
+        stub_settings = override_settings(STRIPE_API_BASE=api_base)
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+        cache.clear()
+
+        self.user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.products = Product.objects.bulk_create(
+            Product(source_id=f"p{i}", name_en=f"Product {i}", price=Decimal("2.50"), category=category)
+            for i in range(2)
+        )
+        bump_catalog_version()
+        self.client.force_login(self.user)
+        CartLine.objects.bulk_create(
+            [
+                CartLine(user=self.user, product=self.products[0], quantity=2),
+                CartLine(user=self.user, product=self.products[1], quantity=1),
+            ]
+        )
+
+    def checkout(self):
+        return self.client.post(reverse("billing:create_cart_checkout"))
+
+    def test_resubmission_reuses_open_session_without_calling_stripe(self):
+        first = self.checkout()
+        second = self.checkout()
+
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(first["Location"], "https://checkout.stripe.test/pay/cs_test_1")
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(PendingCheckout.objects.count(), 1)
+
+    def test_lost_cache_falls_back_to_stripe_idempotency(self):
+        first = self.checkout()
+        flush_sessions(force=True)
+        cache.clear()
+        second = self.checkout()
+        self.assertEqual(len(self.server.requests), 2)
+        keys = {request["idempotency_key"] for request in self.server.requests}
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(PendingCheckout.objects.count(), 1)
+
+    def test_session_expiry_stays_within_stripe_limits(self):
+        quote = quote_cart({self.products[0].pk: 1}, User.BASIC)
+        for ttl in (60, 3600, 7 * 86400):
+            with self.subTest(ttl=ttl), override_settings(BILLING_CHECKOUT_SESSION_TTL=ttl):
+                params, _ = views._payment_session_params(self.user, quote, {}, "fingerprint")
+                expires_in = params["expires_at"] - time.time()
+                self.assertGreaterEqual(expires_in, 1800 - 1)
+                self.assertLessEqual(expires_in, 86400)
+
+    def test_changed_cart_gets_a_new_session(self):
+        self.checkout()
+        CartLine.objects.filter(product=self.products[1]).update(quantity=3)
+
+        response = self.checkout()
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertNotEqual(self.server.requests[0]["idempotency_key"], self.server.requests[1]["idempotency_key"])
+        self.assertEqual(response["Location"], "https://checkout.stripe.test/pay/cs_test_2")
+
+    def test_completed_checkout_is_not_reused(self):
+        self.checkout()
+        PendingCheckout.objects.update(completed_at=timezone.now())
+
+        response = self.checkout()
+
+        self.assertEqual(response["Location"], "https://checkout.stripe.test/pay/cs_test_2")
+
+
+class AsyncCheckoutTests(IdempotentCheckoutTests):
+    """The idempotency tests above, run against ``billing.async_views``."""
+
+    def request(self, method, path, *args, **kwargs):
+        request = getattr(RequestFactory(), method)(path, *args, **kwargs)
+        request.user = self.user
+        request.session = self.client.session
+        request._messages = default_storage(request)
+        return request
+
+    def call(self, view, request, *args):
+        # Every async_to_sync call runs a new event loop and httpx connections cannot outlive theirs;
+        # under ASGI one loop serves all requests.
+        reset_gateway()
+        return async_to_sync(view)(request, *args)
+
+    def checkout(self):
+        request = self.request("post", reverse("billing:create_cart_checkout"))
+        return self.call(async_views.create_cart_checkout, request)
+
+    def test_product_resubmission_reuses_open_session(self):
+        path = reverse("billing:product_checkout", args=[self.products[0].pk])
+        first = self.call(async_views.create_product_checkout, self.request("post", path), self.products[0].pk)
+        second = self.call(async_views.create_product_checkout, self.request("post", path), self.products[0].pk)
+
+        self.assertEqual(first["Location"], "https://checkout.stripe.test/pay/cs_test_1")
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(PendingCheckout.objects.get().total, Decimal("2.50"))
+
+    def test_subscription_checkout_records_a_pending_checkout(self):
+        request = self.request("post", reverse("billing:subscribe"))
+        response = self.call(async_views.create_subscription_checkout, request)
+
+        self.assertEqual(response["Location"], "https://checkout.stripe.test/pay/cs_test_1")
+        self.assertEqual(PendingCheckout.objects.get().tier, User.PRO)
+
+    def test_checkout_rejects_get(self):
+        request = self.request("get", reverse("billing:create_cart_checkout"))
+
+        self.assertEqual(self.call(async_views.create_cart_checkout, request).status_code, 405)
+
+    @override_settings(STRIPE_MAX_NETWORK_RETRIES=0, STRIPE_BREAKER_MIN_CALLS=1)
+    def test_unavailable_stripe_redirects_back_with_a_message(self):
+        self.server.failures = 10
+        request = self.request("post", reverse("billing:create_cart_checkout"))
+
+        with self.assertLogs("billing.gateway", "WARNING"):
+            response = self.call(async_views.create_cart_checkout, request)
+
+        self.assertEqual(response["Location"], reverse("billing:cart"))
+        self.assertEqual([str(m) for m in request._messages], [views.STRIPE_UNAVAILABLE_MESSAGE])
+        self.assertFalse(PendingCheckout.objects.exists())
+
+    def test_success_page_reports_the_paid_checkout_and_clears_the_cart(self):
+        self.checkout()
+        PendingCheckout.objects.update(completed_at=timezone.now())
+        request = self.request("get", reverse("billing:success"), {"session_id": "cs_test_1"})
+
+        response = self.call(async_views.CheckoutSuccessView.as_view(), request)
+
+        self.assertEqual(response.context_data["checkout_state"], "complete")
+        self.assertFalse(CartLine.objects.filter(user=self.user).exists())
+        self.assertEqual(len(self.server.requests), 1)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET="")
+    def test_webhook_records_the_event(self):
+        event = {
+            "id": "evt_async",
+            "type": "checkout.session.completed",
+            "created": int(time.time()),
+            "data": {"object": {"id": "cs_test_1", "mode": "payment", "metadata": {"user_id": str(self.user.pk)}}},
+        }
+        request = RequestFactory().post(reverse("billing:webhook"), json.dumps(event), "application/json")
+
+        response = self.call(async_views.stripe_webhook, request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.get().event_id, "evt_async")
+        self.assertIsNone(CsrfViewMiddleware(lambda r: None).process_view(request, async_views.stripe_webhook, (), {}))
+
+
+class StripeGatewayTests(TestCase):
+    def setUp(self):
+        self.server, self.api_base = start_stripe_stub(self)
+
+    def gateway(self, **kwargs):
+        kwargs.setdefault("max_retries", 0)
+        gateway = StripeGateway("sk_test_stub", api_base=self.api_base, **kwargs)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    def test_retries_server_errors_with_the_same_idempotency_key(self):
+        self.server.failures = 1
+        gateway = self.gateway(max_retries=1)
+
+        session = gateway.create_checkout_session({"mode": "payment"}, idempotency_key="checkout-abc")
+
+        self.assertEqual(session.id, "cs_test_1")
+        self.assertEqual([request["idempotency_key"] for request in self.server.requests], ["checkout-abc"] * 2)
+        self.assertEqual(gateway.metrics()["endpoints"]["checkout.sessions.create"]["errors"], 0)
+
+    def test_times_out_slow_calls(self):
+        self.server.delay = 0.5
+        gateway = self.gateway(timeout=0.1)
+
+        with self.assertRaises(stripe.APIConnectionError):
+            gateway.create_checkout_session({"mode": "payment"})
+        metrics = gateway.metrics()["endpoints"]["checkout.sessions.create"]
+        self.assertEqual((metrics["calls"], metrics["errors"]), (1, 1))
+
+    def test_open_breaker_fails_fast_until_a_trial_call_succeeds(self):
+        self.server.failures = 2
+        breaker = CircuitBreaker(failure_ratio=0.5, min_calls=2, window=30, reset_timeout=0.2)
+        gateway = self.gateway(breaker=breaker)
+
+        with self.assertLogs("billing.gateway", "WARNING"):
+            for _ in range(2):
+                with self.assertRaises(stripe.APIError):
+                    gateway.create_checkout_session({"mode": "payment"})
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(GatewayUnavailable):
+            gateway.create_checkout_session({"mode": "payment"})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(gateway.metrics()["endpoints"]["checkout.sessions.create"]["rejected"], 1)
+
+        time.sleep(0.25)
+        self.assertEqual(breaker.state, "half-open")
+        gateway.create_checkout_session({"mode": "payment"})
+        self.assertEqual(breaker.state, "closed")
+
+    def test_call_admitted_before_the_trip_does_not_decide_the_trial(self):
+        breaker = CircuitBreaker(failure_ratio=0.5, min_calls=2, window=30, reset_timeout=0.05)
+        slow_call = breaker.allow()
+        with self.assertLogs("billing.gateway", "WARNING"):
+            for _ in range(2):
+                breaker.record(False, breaker.allow())
+
+        breaker.record(True, slow_call)
+        self.assertEqual(breaker.state, "open")
+
+        time.sleep(0.06)
+        trial = breaker.allow()
+        self.assertEqual(trial[1], True)
+        breaker.record(False, slow_call)
+        self.assertIsNone(breaker.allow())
+        self.assertEqual(breaker.state, "half-open")
+
+        breaker.record(True, trial)
+        self.assertEqual(breaker.state, "closed")
+
+    @override_settings(
+        STRIPE_SECRET_KEY="sk_test_stub",
+        STRIPE_MAX_NETWORK_RETRIES=0,
+        STRIPE_BREAKER_MIN_CALLS=1,
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_checkout_shows_a_message_while_stripe_is_down(self):
+        self.server.failures = 10
+        user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        product = Product.objects.create(source_id="p1", name_en="Product", price=Decimal("2.50"), category=category)
+        bump_catalog_version()
+        self.client.force_login(user)
+
+        with self.settings(STRIPE_API_BASE=self.api_base), self.assertLogs("billing.gateway", "WARNING"):
+            first = self.client.post(reverse("billing:product_checkout", args=[product.pk]))
+            second = self.client.post(reverse("billing:product_checkout", args=[product.pk]), follow=True)
+        reset_gateway()
+
+        self.assertRedirects(first, reverse("catalog:product_list"), fetch_redirect_response=False)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertContains(second, "Payments are temporarily unavailable")
+        self.assertFalse(PendingCheckout.objects.exists())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CartBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.product = Product.objects.create(source_id="p0", name_en="Product 0", price=Decimal("2.50"), category=category)
+        bump_catalog_version()
+
+    def test_anonymous_catalog_render_touches_neither_session_nor_database(self):
+        self.client.get(reverse("catalog:product_list"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("catalog:product_list"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<span id="cart-count"')
+        self.assertFalse(response.wsgi_request.session.accessed)
+        self.assertNotIn("sessionid", response.cookies)
+        self.assertIn("Cookie", response["Vary"])
+
+    def test_badge_count_is_kept_with_the_cart(self):
+        user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        self.client.force_login(user)
+        self.client.post(reverse("billing:add_to_cart", args=[self.product.id]))
+        self.client.post(reverse("billing:add_to_cart", args=[self.product.id]))
+        self.client.get(reverse("catalog:product_list"))
+
+        flush_sessions(force=True)
+
+        # Session, user row and cart count all come from caches; the cart is not summed again.
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("catalog:product_list"))
+        self.assertContains(response, '<span id="cart-count"')
+        self.assertEqual(response.context["cart_item_count"], 2)
+
+        self.client.post(reverse("billing:remove_from_cart", args=[self.product.id]))
+        self.assertEqual(self.client.get(reverse("catalog:product_list")).context["cart_item_count"], 0)
+
+    def test_cart_writes_update_the_count_without_summing(self):
+        user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        self.client.force_login(user)
+        self.client.get(reverse("catalog:product_list"))
+        add_url = reverse("billing:add_to_cart", args=[self.product.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(add_url, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+            response = self.client.post(add_url, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+            self.client.post(reverse("billing:remove_from_cart", args=[self.product.id]))
+
+        self.assertEqual(response.json()["cart_count"], 2)
+        self.assertFalse(any("SUM(" in query["sql"] for query in queries.captured_queries))
+        self.assertEqual(self.client.get(reverse("catalog:product_list")).context["cart_item_count"], 0)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CartStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", password="x", email_verified_at=timezone.now())
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.products = Product.objects.bulk_create(
+            Product(source_id=f"p{i}", name_en=f"Product {i}", price=Decimal("2.50"), category=category)
+            for i in range(3)
+        )
+        bump_catalog_version()
+
+    def cart_request(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        request.session = SessionStore()
+        return request
+
+    def test_anonymous_requests_use_the_session_cart(self):
+        session = self.client.session
+        session["cart"] = {str(self.products[0].id): 2}
+        session.save()
+
+        response = self.client.get(reverse("billing:success"), {"session_id": "cs_test"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("cart", self.client.session)
+        self.assertFalse(CartLine.objects.exists())
+
+    def test_add_increments_in_one_update_and_caps_the_quantity(self):
+        request = self.cart_request()
+        cart = get_cart_backend(request)
+        self.assertIsInstance(cart, DatabaseCart)
+        cart.add(request, self.products[0].id, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            cart.add(request, self.products[0].id, 3)
+
+        # Incremented in the database, not read-modify-written.
+        self.assertTrue(queries.captured_queries[0]["sql"].startswith("UPDATE"))
+        self.assertEqual(CartLine.objects.get().quantity, 5)
+
+        cart.add(request, self.products[0].id, MAX_QUANTITY)
+        self.assertEqual(CartLine.objects.get().quantity, MAX_QUANTITY)
+
+    def test_set_quantities_upserts_and_removes_lines(self):
+        request = self.cart_request()
+        cart = get_cart_backend(request)
+        cart.add(request, self.products[0].id, 4)
+        cart.add(request, self.products[1].id)
+
+        cart.set_quantities(request, {self.products[0].id: 1, self.products[1].id: 0, self.products[2].id: 7})
+
+        self.assertEqual(cart.items(request), {self.products[0].id: 1, self.products[2].id: 7})
+        self.assertEqual(cart.count(request), 8)
+
+    def test_session_cart_is_merged_into_lines_after_login(self):
+        CartLine.objects.create(user=self.user, product=self.products[0], quantity=2)
+        session = self.client.session
+        session["cart"] = {str(self.products[0].id): 1, str(self.products[1].id): 3, "999999": 1}
+        session.save()
+
+        self.client.login(email="buyer@example.com", password="x")
+        response = self.client.get(reverse("billing:cart"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(CartLine.objects.values_list("product_id", "quantity")),
+            {self.products[0].id: 3, self.products[1].id: 3},
+        )
+        self.assertNotIn("cart", self.client.session)
+        self.client.get(reverse("billing:cart"))
+        self.assertEqual(CartLine.objects.get(product=self.products[0]).quantity, 3)
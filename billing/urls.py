@@ -1,31 +1,38 @@
+from django.conf import settings
 from django.urls import path
 
+from . import async_views, views
 from .views import (
     CheckoutCancelView,
-    CheckoutSuccessView,
     SubscriptionView,
     add_to_cart,
+    apply_promo_code,
     cart_view,
-    create_cart_checkout,
-    create_product_checkout,
-    create_subscription_checkout,
+    gateway_metrics,
     orders_view,
     remove_from_cart,
-    stripe_webhook,
+    set_cart_quantities,
 )
 
 app_name = "billing"
 
+# Views that wait on Stripe have async versions for ASGI deployments.
+checkout_views = async_views if settings.BILLING_ASYNC_VIEWS else views
+
 urlpatterns = [
     path("subscribe/", SubscriptionView.as_view(), name="subscribe_page"),
-    path("subscribe/start/", create_subscription_checkout, name="subscribe"),
+    path("subscribe/start/", checkout_views.create_subscription_checkout, name="subscribe"),
     path("cart/", cart_view, name="cart"),
     path("cart/add/<int:product_id>/", add_to_cart, name="add_to_cart"),
     path("cart/remove/<int:product_id>/", remove_from_cart, name="remove_from_cart"),
-    path("cart/checkout/", create_cart_checkout, name="create_cart_checkout"),
-    path("checkout/<int:product_id>/", create_product_checkout, name="product_checkout"),
+    path("cart/quantities/", set_cart_quantities, name="set_cart_quantities"),
+    path("cart/promo/", apply_promo_code, name="apply_promo_code"),
+    path("cart/checkout/", checkout_views.create_cart_checkout, name="create_cart_checkout"),
+    path("checkout/<int:product_id>/", checkout_views.create_product_checkout, name="product_checkout"),
     path("orders/", orders_view, name="orders"),
-    path("success/", CheckoutSuccessView.as_view(), name="success"),
+    path("success/", checkout_views.CheckoutSuccessView.as_view(), name="success"),
+    path("success/status/", checkout_views.checkout_status, name="checkout_status"),
     path("cancel/", CheckoutCancelView.as_view(), name="cancel"),
-    path("webhook/", stripe_webhook, name="webhook"),
+    path("webhook/", checkout_views.stripe_webhook, name="webhook"),
+    path("gateway/metrics/", gateway_metrics, name="gateway_metrics"),
 ]
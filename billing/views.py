@@ -1,45 +1,176 @@
+import base64
 import json
+import time
 from datetime import datetime
 from decimal import Decimal
+from urllib.parse import urlencode
 
 import stripe
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, HttpResponseBadRequest
-from django.shortcuts import get_object_or_404, redirect, render
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import redirect, render
 from django.http import JsonResponse
 from django.urls import reverse
-from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import TemplateView
 
 from accounts.models import User
-from catalog.models import Product
-
-from .models import Purchase, Subscription
-
-if settings.STRIPE_SECRET_KEY:
-    stripe.api_key = settings.STRIPE_SECRET_KEY
+from catalog.snapshot import get_snapshot
+
+from .cart import MAX_QUANTITY, get_cart_backend
+from .models import PendingCheckout, Purchase
+from .gateway import UNAVAILABLE_ERRORS, GatewayUnavailable, get_gateway
+from .pricing import CENT, normalize_promo_code, promo_code_rate, quote_cart
+from .webhooks import (
+    CHECKOUT_COMPLETE,
+    CHECKOUT_PENDING,
+    CHECKOUT_UNKNOWN,
+    checkout_state,
+    handle_checkout_completed,
+    record_event,
+)
+
+STRIPE_UNAVAILABLE_MESSAGE = "Payments are temporarily unavailable. Please try again in a few minutes."
+ORDERS_PER_PAGE = 20
+CHECKOUT_POLL_INTERVAL = 0.5
+# A checkout whose webhook is overdue is looked up at Stripe at most this often.
+CHECKOUT_VERIFY_INTERVAL = 60
+# Stripe only accepts a checkout session expiry between 30 minutes and 24 hours away.
+CHECKOUT_EXPIRY_MIN = 30 * 60
+CHECKOUT_EXPIRY_MAX = 24 * 3600
 
 
 def _require_stripe_key(request):
     if not settings.STRIPE_SECRET_KEY:
         messages.error(request, "Stripe secret key missing; set STRIPE_SECRET_KEY in your environment.")
         return False
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     return True
 
 
-def _get_cart(request):
-    return request.session.get("cart", {})
+def _is_ajax(request):
+    return request.headers.get("X-Requested-With") == "XMLHttpRequest"
+
+
+def _user_tier(user):
+    return getattr(user, "user_type", User.BASIC)
+
+
+def _quote_for(request, cart):
+    return quote_cart(cart, _user_tier(request.user), request.session.get("promo_code", ""))
+
+
+def _stripe_line_items(quote):
+    return [
+        {
+            "price_data": {
+                "currency": settings.DEFAULT_CURRENCY,
+                "product_data": {"name": line.product.name_en, "description": line.product.summary},
+                "unit_amount": line.unit_amount,
+            },
+            "quantity": line.quantity,
+        }
+        for line in quote.lines
+    ]
+
+
+def _completed_checkouts(user):
+    return (
+        PendingCheckout.objects.filter(user=user, completed_at__isnull=False)
+        .order_by("-id")
+        .values_list("id", flat=True)
+    )
 
 
-def _save_cart(request, cart):
-    request.session["cart"] = cart
-    request.session.modified = True
+def _checkout_fingerprint(user, quote, metadata, last_completed):
+    # A completed checkout changes the fingerprint, so buying the same cart again gets a new session.
+    return quote.fingerprint(user.pk, last_completed, settings.DEFAULT_CURRENCY, metadata.get("type"))
+
+
+def _checkout_cache_key(fingerprint):
+    return f"billing:checkout:{fingerprint}"
+
+
+def _return_urls():
+    return {
+        "success_url": f"{settings.SITE_URL}{reverse('billing:success')}?session_id={{CHECKOUT_SESSION_ID}}",
+        "cancel_url": f"{settings.SITE_URL}{reverse('billing:cancel')}",
+    }
+
+
+def _payment_session_params(user, quote, metadata, fingerprint):
+    """Stripe parameters and idempotency key for a payment session for ``quote``."""
+    # Sessions are keyed per TTL window with a deterministic expiry, so retries within a
+    # window send identical parameters (which Stripe requires when reusing a key). The
+    # expiry lands between one and two windows away, so the window is clamped to keep it
+    # within Stripe's limits.
+    ttl = min(max(settings.BILLING_CHECKOUT_SESSION_TTL, CHECKOUT_EXPIRY_MIN), CHECKOUT_EXPIRY_MAX // 2)
+    window = int(time.time()) // ttl
+    params = {
+        "expires_at": (window + 2) * ttl,
+        "mode": "payment",
+        "customer_email": user.email,
+        "line_items": _stripe_line_items(quote),
+        **_return_urls(),
+        "metadata": {
+            "user_id": str(user.id),
+            "tier": quote.tier,
+            "promo_code": quote.promo_code,
+            "discount_applied": str(quote.discount_applied).lower(),
+            **metadata,
+        },
+    }
+    return params, f"checkout-{fingerprint}-{window}"
+
+
+def _payment_checkout_defaults(user, quote):
+    return {
+        "user": user,
+        "lines": PendingCheckout.lines_from_quote(quote),
+        "total": quote.total,
+        "currency": settings.DEFAULT_CURRENCY,
+        "tier": quote.tier,
+        "promo_code": quote.promo_code,
+    }
+
+
+def _session_url_timeout(params):
+    return max(params["expires_at"] - time.time() - 60, 1)
+
+
+def _start_payment_checkout(request, quote, metadata):
+    """Return the URL of a Stripe payment session for ``quote``, freezing its priced lines for the webhook.
+
+    Identical resubmissions (same user, lines, prices, tier and code) get the open session
+    from the cache; if the cache was lost, the idempotency key makes Stripe return it again.
+    """
+    user = request.user
+    fingerprint = _checkout_fingerprint(user, quote, metadata, _completed_checkouts(user).first())
+    cache_key = _checkout_cache_key(fingerprint)
+    url = cache.get(cache_key)
+    if url:
+        return url
+
+    params, idempotency_key = _payment_session_params(user, quote, metadata, fingerprint)
+    session = get_gateway().create_checkout_session(params, idempotency_key=idempotency_key)
+    PendingCheckout.objects.get_or_create(
+        stripe_checkout_session_id=session.id, defaults=_payment_checkout_defaults(user, quote)
+    )
+    cache.set(cache_key, session.url, _session_url_timeout(params))
+    return session.url
+
+
+def _get_active_product(product_id):
+    product = get_snapshot().get(product_id)
+    if product is None or not product.active:
+        raise Http404("No active product matches the given query.")
+    return product
 
 
 class SubscriptionView(LoginRequiredMixin, TemplateView):
@@ -54,16 +185,8 @@ class SubscriptionView(LoginRequiredMixin, TemplateView):
         return ctx
 
 
-@login_required
-@require_POST
-def create_subscription_checkout(request):
-    if not _require_stripe_key(request):
-        return redirect("home")
-    if not request.user.is_verified:
-        messages.error(request, "Verify your email before subscribing.")
-        return redirect("billing:subscribe_page")
+def _subscription_session_params(user):
     price_id = settings.STRIPE_SUBSCRIPTION_PRICE_ID
-
     line_item = (
         {"price": price_id, "quantity": 1}
         if price_id
@@ -77,18 +200,50 @@ def create_subscription_checkout(request):
             "quantity": 1,
         }
     )
-
-    session = stripe.checkout.Session.create(
-        mode="subscription",
-        customer_email=request.user.email,
-        line_items=[line_item],
-        success_url=f"{settings.SITE_URL}{reverse('billing:success')}?session_id={{CHECKOUT_SESSION_ID}}",
-        cancel_url=f"{settings.SITE_URL}{reverse('billing:cancel')}",
-        metadata={
-            "user_id": str(request.user.id),
+    return {
+        "mode": "subscription",
+        "customer_email": user.email,
+        "line_items": [line_item],
+        **_return_urls(),
+        "metadata": {
+            "user_id": str(user.id),
             "price_id": price_id,
             "type": "subscription",
         },
+    }
+
+
+def _subscription_checkout_defaults(user):
+    return {
+        "user": user,
+        "total": Decimal(str(settings.PRO_PLAN_PRICE)),
+        "currency": settings.DEFAULT_CURRENCY,
+        "tier": User.PRO,
+    }
+
+
+def _subscription_checkout_error(request):
+    if not _require_stripe_key(request):
+        return redirect("home")
+    if not request.user.is_verified:
+        messages.error(request, "Verify your email before subscribing.")
+        return redirect("billing:subscribe_page")
+    return None
+
+
+@login_required
+@require_POST
+def create_subscription_checkout(request):
+    error = _subscription_checkout_error(request)
+    if error:
+        return error
+    try:
+        session = get_gateway().create_checkout_session(_subscription_session_params(request.user))
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, STRIPE_UNAVAILABLE_MESSAGE)
+        return redirect("billing:subscribe_page")
+    PendingCheckout.objects.get_or_create(
+        stripe_checkout_session_id=session.id, defaults=_subscription_checkout_defaults(request.user)
     )
     return redirect(session.url)
 
@@ -96,60 +251,95 @@ def create_subscription_checkout(request):
 @login_required
 @require_POST
 def create_product_checkout(request, product_id):
-    if not _require_stripe_key(request):
+    checkout, error = _product_checkout(request, product_id)
+    if error:
+        return error
+    try:
+        url = _start_payment_checkout(request, *checkout)
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, STRIPE_UNAVAILABLE_MESSAGE)
         return redirect("catalog:product_list")
+    return redirect(url)
+
+
+def _product_checkout(request, product_id):
+    """``((quote, metadata), None)`` for a single-product checkout, or ``(None, redirect)``."""
+    if not _require_stripe_key(request):
+        return None, redirect("catalog:product_list")
     if not request.user.is_verified:
         messages.error(request, "Verify your email before purchasing.")
-        return redirect("accounts:profile")
-
-    product = get_object_or_404(Product, pk=product_id, active=True)
-    price = Decimal(product.price)
-    discount_applied = False
-    if getattr(request.user, "user_type", User.BASIC) == User.PRO:
-        discount_applied = True
-        price = (price * Decimal("0.8")).quantize(Decimal("0.01"))
-
-    session = stripe.checkout.Session.create(
-        mode="payment",
-        customer_email=request.user.email,
-        line_items=[
-            {
-                "price_data": {
-                    "currency": settings.DEFAULT_CURRENCY,
-                    "product_data": {"name": product.name_en, "description": product.description_en[:200]},
-                    "unit_amount": int((price * 100).quantize(Decimal("1"))),
-                },
-                "quantity": 1,
-            }
-        ],
-        success_url=f"{settings.SITE_URL}{reverse('billing:success')}?session_id={{CHECKOUT_SESSION_ID}}",
-        cancel_url=f"{settings.SITE_URL}{reverse('billing:cancel')}",
-        metadata={
-            "user_id": str(request.user.id),
-            "product_id": str(product.id),
-            "quantity": "1",
-            "discount_applied": str(discount_applied).lower(),
-            "type": "product",
-        },
-    )
-    return redirect(session.url)
+        return None, redirect("accounts:profile")
+
+    product = _get_active_product(product_id)
+    quote = _quote_for(request, {product.id: 1})
+    return (quote, {"product_id": str(product.id), "quantity": "1", "type": "product"}), None
+
+
+def _stripe_session_state(session, user):
+    if (session.get("metadata") or {}).get("user_id") != str(user.pk):
+        return CHECKOUT_UNKNOWN
+    if session.get("status") != "complete" or session.get("payment_status") not in ("paid", "no_payment_required"):
+        return CHECKOUT_PENDING
+    return CHECKOUT_COMPLETE
+
+
+def _verify_with_stripe(request, session_id):
+    """Apply a paid session straight from Stripe; returns None when Stripe could not be reached."""
+    try:
+        session = get_gateway().retrieve_checkout_session(session_id)
+    except (stripe.StripeError, GatewayUnavailable):
+        return None
+    state = _stripe_session_state(session, request.user)
+    if state == CHECKOUT_COMPLETE:
+        handle_checkout_completed(session)
+    return state
+
+
+def _clear_cart(request):
+    get_cart_backend(request).clear(request)
 
 
 class CheckoutSuccessView(TemplateView):
+    """Renders from local state; the page long-polls ``checkout_status`` until the webhook lands."""
+
     template_name = "billing/success.html"
 
     def get(self, request, *args, **kwargs):
-        session_id = request.GET.get("session_id")
-        if session_id and settings.STRIPE_SECRET_KEY:
-            try:
-                session = stripe.checkout.Session.retrieve(session_id)
-                _handle_checkout_completed(session)
-            except stripe.error.StripeError:
-                messages.warning(request, "Could not verify payment status from Stripe.")
-        if "cart" in request.session:
-            request.session.pop("cart")
-            request.session.modified = True
-        return super().get(request, *args, **kwargs)
+        session_id = request.GET.get("session_id", "")
+        state = None
+        if session_id and request.user.is_authenticated:
+            state = checkout_state(session_id, request.user)
+            # Only sessions with no local record at all are looked up at Stripe.
+            if state == CHECKOUT_UNKNOWN and settings.STRIPE_SECRET_KEY:
+                state = _verify_with_stripe(request, session_id)
+                if state is None:
+                    messages.warning(request, "Could not verify payment status from Stripe.")
+                    state = CHECKOUT_PENDING
+        _clear_cart(request)
+        return super().get(request, *args, session_id=session_id, checkout_state=state, **kwargs)
+
+
+@login_required
+@require_GET
+def checkout_status(request):
+    """Checkout state for the success page, which polls it; answers at once so no WSGI worker is held.
+
+    The async view in ``billing.async_views`` long-polls instead.
+    """
+    session_id = request.GET.get("session_id", "")
+    if not session_id:
+        return HttpResponseBadRequest("Missing session_id")
+    state = checkout_state(session_id, request.user)
+    if state == CHECKOUT_PENDING and _may_verify(session_id):
+        # The webhook is late or was lost.
+        state = _verify_with_stripe(request, session_id) or CHECKOUT_PENDING
+    return JsonResponse({"status": state})
+
+
+def _may_verify(session_id):
+    return bool(settings.STRIPE_SECRET_KEY) and cache.add(
+        f"billing:checkout-verify:{session_id}", True, CHECKOUT_VERIFY_INTERVAL
+    )
 
 
 class CheckoutCancelView(TemplateView):
@@ -159,12 +349,13 @@ class CheckoutCancelView(TemplateView):
 @login_required
 @require_POST
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, pk=product_id, active=True)
-    cart = _get_cart(request)
-    cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-    _save_cart(request, cart)
-    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return JsonResponse({"ok": True, "message": f"Added {product.name_en} to cart.", "cart_count": sum(cart.values())})
+    product = _get_active_product(product_id)
+    cart = get_cart_backend(request)
+    cart.add(request, product.id)
+    if _is_ajax(request):
+        return JsonResponse(
+            {"ok": True, "message": f"Added {product.name_en} to cart.", "cart_count": cart.count(request)}
+        )
     messages.success(request, f"Added {product.name_en} to cart.")
     return redirect("catalog:product_list")
 
@@ -172,269 +363,198 @@ def add_to_cart(request, product_id):
 @login_required
 @require_POST
 def remove_from_cart(request, product_id):
-    cart = _get_cart(request)
-    if str(product_id) in cart:
-        cart.pop(str(product_id))
-        _save_cart(request, cart)
+    if get_cart_backend(request).remove(request, product_id):
         messages.info(request, "Removed item from cart.")
     return redirect("billing:cart")
 
 
 @login_required
-def cart_view(request):
-    cart = _get_cart(request)
-    product_ids = list(map(int, cart.keys()))
-    products = {p.id: p for p in Product.objects.filter(id__in=product_ids, active=True)}
-    items = []
-    total = Decimal("0")
-    is_pro = getattr(request.user, "user_type", User.BASIC) == User.PRO
-    for pid_str, qty in cart.items():
-        pid = int(pid_str)
-        product = products.get(pid)
-        if not product:
+@require_POST
+def set_cart_quantities(request):
+    """Set several line quantities in one write from ``quantity-<product id>`` fields; 0 removes a line."""
+    quantities = {}
+    for key, value in request.POST.items():
+        if not key.startswith("quantity-"):
             continue
-        qty = int(qty)
-        price = Decimal(product.price)
-        line_total = price * qty
-        total += line_total
-        items.append(
-            {
-                "product": product,
-                "quantity": qty,
-                "price": price,
-                "line_total": line_total,
-            }
-        )
-    discount_total = (total * Decimal("0.8")).quantize(Decimal("0.01")) if is_pro else total
-    return render(
-        request,
-        "billing/cart.html",
-        {
-            "items": items,
-            "total": total,
-            "discount_total": discount_total,
-            "is_pro": is_pro,
-        },
-    )
+        try:
+            product_id, quantity = int(key.removeprefix("quantity-")), int(value)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid quantity")
+        quantities[product_id] = max(0, min(quantity, MAX_QUANTITY))
+    products = get_snapshot().get_many(pid for pid, quantity in quantities.items() if quantity)
+    # Unknown or inactive products can only be removed.
+    quantities = {
+        pid: quantity
+        for pid, quantity in quantities.items()
+        if not quantity or (pid in products and products[pid].active)
+    }
+    cart = get_cart_backend(request)
+    if quantities:
+        cart.set_quantities(request, quantities)
+    if _is_ajax(request):
+        return JsonResponse({"ok": True, "cart_count": cart.count(request)})
+    messages.success(request, "Cart updated.")
+    return redirect("billing:cart")
+
+
+@login_required
+@require_POST
+def apply_promo_code(request):
+    code = normalize_promo_code(request.POST.get("promo_code"))
+    if not code:
+        request.session.pop("promo_code", None)
+        messages.info(request, "Promo code removed.")
+    elif promo_code_rate(code) is None:
+        messages.error(request, f"{code} is not a valid promo code.")
+    else:
+        request.session["promo_code"] = code
+        messages.success(request, f"Promo code {code} applied.")
+    return redirect("billing:cart")
+
+
+@login_required
+def cart_view(request):
+    quote = _quote_for(request, get_cart_backend(request).items(request))
+    return render(request, "billing/cart.html", {"quote": quote, "items": quote.lines})
+
+
+def _encode_order_cursor(order):
+    raw = json.dumps([order["placed_at"].isoformat(), order["stripe_checkout_session_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_order_cursor(value):
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        placed_at, session_id = json.loads(raw)
+        return datetime.fromisoformat(placed_at), str(session_id)
+    except (ValueError, TypeError):
+        return None
 
 
 @login_required
 def orders_view(request):
-    purchases = (
-        Purchase.objects.filter(user=request.user)
-        .select_related("product", "product__category")
-        .order_by("-created_at")
+    """Order history, one order per checkout session, newest first.
+
+    Orders are grouped and totalled in SQL and keyset-paginated with ``?before=``;
+    line items are loaded only for the orders on the page.
+    """
+    cursor = _decode_order_cursor(request.GET.get("before"))
+    purchases = Purchase.objects.filter(user=request.user)
+    orders = purchases.values("stripe_checkout_session_id").annotate(
+        placed_at=Max("created_at"),
+        total=Sum("amount"),
+        currency=Max("currency"),
+        discounted_lines=Count("id", filter=Q(discount_applied=True)),
     )
-    grouped = []
-    current = None
-    for p in purchases:
-        session_id = p.stripe_checkout_session_id or f"order-{p.id}"
-        if not current or current["session_id"] != session_id:
-            current = {
-                "session_id": session_id,
-                "created_at": p.created_at,
-                "items": [],
-                "total": Decimal("0"),
-                "currency": p.currency,
-                "discount_applied": False,
-            }
-            grouped.append(current)
-        current["items"].append(
-            {
-                "product": p.product,
-                "quantity": p.quantity,
-                "amount": p.amount,
-                "discount_applied": p.discount_applied,
-                "created_at": p.created_at,
-            }
+    if cursor:
+        placed_at, session_id = cursor
+        orders = orders.filter(
+            Q(placed_at__lt=placed_at) | Q(placed_at=placed_at, stripe_checkout_session_id__lt=session_id)
         )
-        current["total"] += p.amount
-        if p.discount_applied:
-            current["discount_applied"] = True
-    return render(request, "billing/orders.html", {"orders": grouped})
+    # Fetch one extra order to learn whether another page exists.
+    page = list(orders.order_by("-placed_at", "-stripe_checkout_session_id")[: ORDERS_PER_PAGE + 1])
+    next_query = None
+    if len(page) > ORDERS_PER_PAGE:
+        page = page[:ORDERS_PER_PAGE]
+        next_query = urlencode({"before": _encode_order_cursor(page[-1])})
+
+    items = {}
+    lines = (
+        purchases.filter(stripe_checkout_session_id__in=[order["stripe_checkout_session_id"] for order in page])
+        .select_related("product", "product__category")
+        .order_by("-created_at", "id")
+    )
+    for line in lines:
+        items.setdefault(line.stripe_checkout_session_id, []).append(line)
+    grouped = [
+        {
+            "session_id": order["stripe_checkout_session_id"],
+            "created_at": order["placed_at"],
+            "items": items.get(order["stripe_checkout_session_id"], []),
+            # SQLite returns aggregated decimals unscaled.
+            "total": order["total"].quantize(CENT),
+            "currency": order["currency"],
+            "discount_applied": order["discounted_lines"] > 0,
+        }
+        for order in page
+    ]
+    return render(
+        request,
+        "billing/orders.html",
+        {"orders": grouped, "next_query": next_query, "is_first_page": cursor is None},
+    )
 
 
 @login_required
 @require_POST
 def create_cart_checkout(request):
-    cart = _get_cart(request)
+    checkout, error = _cart_checkout(request)
+    if error:
+        return error
+    try:
+        url = _start_payment_checkout(request, *checkout)
+    except UNAVAILABLE_ERRORS:
+        messages.error(request, STRIPE_UNAVAILABLE_MESSAGE)
+        return redirect("billing:cart")
+    return redirect(url)
+
+
+def _cart_checkout(request):
+    """``((quote, metadata), None)`` for the user's cart, or ``(None, redirect)``."""
+    cart = get_cart_backend(request).items(request)
     if not cart:
         messages.error(request, "Your cart is empty.")
-        return redirect("catalog:product_list")
+        return None, redirect("catalog:product_list")
     if not request.user.is_verified:
         messages.error(request, "Verify your email before purchasing.")
-        return redirect("accounts:profile")
+        return None, redirect("accounts:profile")
     if not _require_stripe_key(request):
-        return redirect("billing:cart")
+        return None, redirect("billing:cart")
 
-    product_ids = list(map(int, cart.keys()))
-    products = {p.id: p for p in Product.objects.filter(id__in=product_ids, active=True)}
-    line_items = []
-    cart_entries = []
-    is_pro = getattr(request.user, "user_type", User.BASIC) == User.PRO
-    for pid_str, qty in cart.items():
-        pid = int(pid_str)
-        product = products.get(pid)
-        if not product:
-            continue
-        qty = int(qty)
-        price = Decimal(product.price)
-        if is_pro:
-            price = (price * Decimal("0.8")).quantize(Decimal("0.01"))
-        line_items.append(
-            {
-                "price_data": {
-                    "currency": settings.DEFAULT_CURRENCY,
-                    "product_data": {"name": product.name_en, "description": product.description_en[:200]},
-                    "unit_amount": int((price * 100).quantize(Decimal("1"))),
-                },
-                "quantity": qty,
-            }
-        )
-        cart_entries.append(f"{pid}:{qty}")
-
-    if not line_items:
+    quote = _quote_for(request, cart)
+    if not quote:
         messages.error(request, "No valid items to purchase.")
-        return redirect("catalog:product_list")
-
-    session = stripe.checkout.Session.create(
-        mode="payment",
-        customer_email=request.user.email,
-        line_items=line_items,
-        success_url=f"{settings.SITE_URL}{reverse('billing:success')}?session_id={{CHECKOUT_SESSION_ID}}",
-        cancel_url=f"{settings.SITE_URL}{reverse('billing:cancel')}",
-        metadata={
-            "user_id": str(request.user.id),
-            "type": "product_cart",
-            "cart": "|".join(cart_entries),
-            "discount_applied": str(is_pro).lower(),
-        },
-    )
-    return redirect(session.url)
+        return None, redirect("catalog:product_list")
+    cart_metadata = "|".join(f"{line.product.id}:{line.quantity}" for line in quote.lines)
+    return (quote, {"type": "product_cart", "cart": cart_metadata}), None
 
 
 @csrf_exempt
 def stripe_webhook(request):
+    event, error = _webhook_event(request)
+    if error:
+        return error
+    record_event(event)
+    return HttpResponse(status=200)
+
+
+def _webhook_event(request):
+    """The verified event payload as ``(event, None)``, or ``(None, error_response)``."""
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
     event = None
     if settings.STRIPE_WEBHOOK_SECRET:
         try:
-            event = stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+            stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+            # Store the plain payload rather than the parsed StripeObject.
+            event = json.loads(payload)
         except (ValueError, stripe.error.SignatureVerificationError):
-            return HttpResponseBadRequest("Invalid webhook signature")
+            return None, HttpResponseBadRequest("Invalid webhook signature")
     else:
         try:
             event = json.loads(payload)
         except json.JSONDecodeError:
-            return HttpResponseBadRequest("Invalid payload")
-
-    event_type = event.get("type")
-    data_object = event.get("data", {}).get("object", {})
+            return None, HttpResponseBadRequest("Invalid payload")
 
-    if event_type == "checkout.session.completed":
-        _handle_checkout_completed(data_object)
-    elif event_type in ("customer.subscription.updated", "customer.subscription.deleted"):
-        _handle_subscription_updated(data_object)
-
-    return HttpResponse(status=200)
+    if not isinstance(event, dict):
+        return None, HttpResponseBadRequest("Invalid payload")
+    return event, None
 
 
-def _handle_checkout_completed(session):
-    mode = session.get("mode")
-    metadata = session.get("metadata") or {}
-    user_id = metadata.get("user_id")
-    user = User.objects.filter(pk=user_id).first()
-    if not user:
-        return
-
-    if mode == "subscription":
-        subscription_id = session.get("subscription")
-        if not subscription_id:
-            return
-        Subscription.objects.update_or_create(
-            stripe_subscription_id=subscription_id,
-            defaults={
-                "user": user,
-                "stripe_customer_id": session.get("customer") or "",
-                "price_id": metadata.get("price_id", ""),
-                "status": "active",
-                "current_period_end": _timestamp_to_dt(session.get("expires_at")),
-            },
-        )
-        if user.user_type != User.PRO:
-            user.user_type = User.PRO
-            user.save(update_fields=["user_type"])
-    elif mode == "payment":
-        cart_map = metadata.get("cart")
-        discount_applied = metadata.get("discount_applied") == "true"
-        if metadata.get("type") == "product_cart" and cart_map:
-            entries = [entry.split(":") for entry in cart_map.split("|") if ":" in entry]
-            for pid_str, qty_str in entries:
-                product = Product.objects.filter(pk=pid_str).first()
-                if not product:
-                    continue
-                qty = int(qty_str)
-                price = Decimal(product.price)
-                if discount_applied:
-                    price = (price * Decimal("0.8")).quantize(Decimal("0.01"))
-                Purchase.objects.update_or_create(
-                    stripe_checkout_session_id=session.get("id"),
-                    product=product,
-                    defaults={
-                        "user": user,
-                        "product": product,
-                        "quantity": qty,
-                        "amount": (price * qty).quantize(Decimal("0.01")),
-                        "currency": session.get("currency", settings.DEFAULT_CURRENCY),
-                        "stripe_payment_intent_id": session.get("payment_intent", ""),
-                        "discount_applied": discount_applied,
-                    },
-                )
-        else:
-            product_id = metadata.get("product_id")
-            product = Product.objects.filter(pk=product_id).first()
-            if not product:
-                return
-            qty = int(metadata.get("quantity", "1"))
-            price = Decimal(product.price)
-            if metadata.get("discount_applied") == "true":
-                price = (price * Decimal("0.8")).quantize(Decimal("0.01"))
-            Purchase.objects.update_or_create(
-                stripe_checkout_session_id=session.get("id"),
-                product=product,
-                defaults={
-                    "user": user,
-                    "product": product,
-                    "quantity": qty,
-                    "amount": (price * qty).quantize(Decimal("0.01")),
-                    "currency": session.get("currency", settings.DEFAULT_CURRENCY),
-                    "stripe_payment_intent_id": session.get("payment_intent", ""),
-                    "discount_applied": metadata.get("discount_applied") == "true",
-                },
-            )
-
-
-def _handle_subscription_updated(subscription):
-    sub_id = subscription.get("id")
-    if not sub_id:
-        return
-    Subscription.objects.update_or_create(
-        stripe_subscription_id=sub_id,
-        defaults={
-            "stripe_customer_id": subscription.get("customer", ""),
-            "status": subscription.get("status", "incomplete"),
-            "current_period_end": _timestamp_to_dt(subscription.get("current_period_end")),
-        },
-    )
-
-
-def _timestamp_to_dt(value):
-    if not value:
-        return None
-    try:
-        return datetime.fromtimestamp(int(value), tz=timezone.utc)
-    except (ValueError, TypeError):
-        return None
-
-# Create your views here.
+@staff_member_required
+def gateway_metrics(request):
+    """Per-endpoint Stripe latency and error counts, and the circuit breaker state, for this process."""
+    return JsonResponse(get_gateway().metrics())
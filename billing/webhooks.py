@@ -0,0 +1,322 @@
+"""Stripe webhook inbox.
+
+The webhook view only verifies and stores each event (duplicates are dropped by
+the unique event id) so Stripe gets its 200 straight away. ``process_webhooks``
+drains the inbox in batches, oldest event first, applying and marking each event in
+its own transaction; failures are retried with exponential backoff until ``max_attempts``.
+
+Completing a checkout stamps its ``PendingCheckout`` and drops a short-lived cache
+marker, which the success page's status endpoint waits on instead of asking Stripe.
+"""
+
+import logging
+import random
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+
+from .models import PendingCheckout, Purchase, Subscription, WebhookEvent
+from .pricing import quote_cart
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT_EVENTS = ("checkout.session.completed",)
+SUBSCRIPTION_EVENTS = ("customer.subscription.updated", "customer.subscription.deleted")
+HANDLED_EVENTS = CHECKOUT_EVENTS + SUBSCRIPTION_EVENTS
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# How long a claimed batch stays hidden from other workers; a crashed worker's events come back after it.
+CLAIM_SECONDS = 300
+EVENT_STATE_FIELDS = ["status", "attempts", "next_attempt_at", "last_error", "processed_at"]
+CHECKOUT_COMPLETE = "complete"
+CHECKOUT_PENDING = "pending"
+CHECKOUT_UNKNOWN = "unknown"
+CHECKOUT_MARKER_TTL = 3600
+PURCHASE_UPSERT_FIELDS = ["user", "quantity", "amount", "currency", "stripe_payment_intent_id", "discount_applied"]
+
+
+class ProcessResult:
+    __slots__ = ("processed", "skipped", "retried", "failed")
+
+    def __init__(self):
+        self.processed = self.skipped = self.retried = self.failed = 0
+
+    def __bool__(self):
+        return bool(self.processed or self.skipped or self.retried or self.failed)
+
+    def __str__(self):
+        return f"processed: {self.processed}, skipped: {self.skipped}, retried: {self.retried}, failed: {self.failed}"
+
+
+def timestamp_to_dt(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    except (ValueError, TypeError):
+        return None
+
+
+def checkout_marker_key(session_id):
+    return f"billing:checkout-done:{session_id}"
+
+
+def checkout_state(session_id, user):
+    """Whether ``user``'s checkout session has been applied locally, without calling Stripe."""
+    pending = (
+        PendingCheckout.objects.filter(stripe_checkout_session_id=session_id, user=user)
+        .values("completed_at")
+        .first()
+    )
+    if pending is not None:
+        return CHECKOUT_COMPLETE if pending["completed_at"] else CHECKOUT_PENDING
+    # Sessions created before checkouts were recorded only leave purchases behind.
+    if Purchase.objects.filter(stripe_checkout_session_id=session_id, user=user).exists():
+        return CHECKOUT_COMPLETE
+    return CHECKOUT_UNKNOWN
+
+
+async def acheckout_state(session_id, user):
+    pending = (
+        await PendingCheckout.objects.filter(stripe_checkout_session_id=session_id, user=user)
+        .values("completed_at")
+        .afirst()
+    )
+    if pending is not None:
+        return CHECKOUT_COMPLETE if pending["completed_at"] else CHECKOUT_PENDING
+    if await Purchase.objects.filter(stripe_checkout_session_id=session_id, user=user).aexists():
+        return CHECKOUT_COMPLETE
+    return CHECKOUT_UNKNOWN
+
+
+def _mark_checkout_completed(session_id, pending=None):
+    if pending is None:
+        PendingCheckout.objects.filter(stripe_checkout_session_id=session_id, completed_at__isnull=True).update(
+            completed_at=timezone.now()
+        )
+    elif pending.completed_at is None:
+        PendingCheckout.objects.filter(pk=pending.pk).update(completed_at=timezone.now())
+    transaction.on_commit(lambda: cache.set(checkout_marker_key(session_id), True, CHECKOUT_MARKER_TTL))
+
+
+def _inbox_rows(event):
+    event_type = event.get("type") or ""
+    if event_type not in HANDLED_EVENTS or not event.get("id"):
+        return []
+    return [
+        WebhookEvent(
+            event_id=event["id"],
+            event_type=event_type,
+            payload=event,
+            event_created=timestamp_to_dt(event.get("created")),
+        )
+    ]
+
+
+def record_event(event):
+    """Store a verified event for processing; redeliveries and unhandled types are dropped."""
+    rows = _inbox_rows(event)
+    if rows:
+        WebhookEvent.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+async def arecord_event(event):
+    rows = _inbox_rows(event)
+    if rows:
+        await WebhookEvent.objects.abulk_create(rows, ignore_conflicts=True)
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter so a failing batch does not retry in lockstep."""
+    delay = min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.75, 1.0))
+
+
+def claim_batch(batch_size):
+    """Take up to ``batch_size`` due events, oldest first, off the inbox for ``CLAIM_SECONDS``.
+
+    The claim is one conditional UPDATE, so on SQLite, which has no row locks, a
+    concurrent worker's statement runs after it and no longer finds the rows due.
+    The lease it writes marks the rows this call won.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=CLAIM_SECONDS)
+    due = WebhookEvent.objects.filter(status=WebhookEvent.PENDING, next_attempt_at__lte=now)
+    batch = due.select_for_update(skip_locked=True).order_by("event_created", "id").values("pk")[:batch_size]
+    with transaction.atomic():
+        claimed = due.filter(pk__in=batch).update(next_attempt_at=lease)
+    if not claimed:
+        return []
+    return list(
+        WebhookEvent.objects.filter(status=WebhookEvent.PENDING, next_attempt_at=lease).order_by("event_created", "id")
+    )
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    result = ProcessResult()
+    for event in claim_batch(batch_size):
+        event.attempts += 1
+        try:
+            # The event is marked in the transaction that applies it, so each one commits on its own.
+            with transaction.atomic():
+                applied = apply_event(event)
+                event.status = WebhookEvent.PROCESSED if applied else WebhookEvent.SKIPPED
+                event.processed_at = timezone.now()
+                event.last_error = ""
+                event.save(update_fields=EVENT_STATE_FIELDS)
+        except Exception as exc:
+            logger.exception("Webhook event %s failed (attempt %s)", event.event_id, event.attempts)
+            event.status = WebhookEvent.PENDING
+            event.processed_at = None
+            event.last_error = f"{type(exc).__name__}: {exc}"
+            if event.attempts >= max_attempts:
+                event.status = WebhookEvent.FAILED
+                result.failed += 1
+            else:
+                event.next_attempt_at = timezone.now() + retry_delay(event.attempts)
+                result.retried += 1
+            event.save(update_fields=EVENT_STATE_FIELDS)
+            continue
+        if applied:
+            result.processed += 1
+        else:
+            result.skipped += 1
+    return result
+
+
+def apply_event(event):
+    """Apply one stored event; returns False when it was stale or had nothing to apply."""
+    data_object = (event.payload.get("data") or {}).get("object") or {}
+    if event.event_type in CHECKOUT_EVENTS:
+        return handle_checkout_completed(data_object, event.event_created)
+    if event.event_type in SUBSCRIPTION_EVENTS:
+        return handle_subscription_updated(data_object, event.event_created)
+    return False
+
+
+def _is_stale(subscription_id, event_created):
+    if event_created is None:
+        return False
+    last_event_at = (
+        Subscription.objects.filter(stripe_subscription_id=subscription_id)
+        .values_list("last_event_at", flat=True)
+        .first()
+    )
+    return last_event_at is not None and event_created < last_event_at
+
+
+def handle_checkout_completed(session, event_created=None):
+    mode = session.get("mode")
+    metadata = session.get("metadata") or {}
+    if mode == "payment":
+        return finalize_payment(session, metadata)
+
+    user_id = metadata.get("user_id")
+    user = User.objects.filter(pk=user_id).first()
+    if not user:
+        return False
+
+    if mode == "subscription":
+        subscription_id = session.get("subscription")
+        if not subscription_id:
+            return False
+        defaults = {
+            "user": user,
+            "stripe_customer_id": session.get("customer") or "",
+            "price_id": metadata.get("price_id", ""),
+            "current_period_end": timestamp_to_dt(session.get("expires_at")),
+        }
+        # A later subscription update (e.g. a cancellation) wins over this activation.
+        stale = _is_stale(subscription_id, event_created)
+        if not stale:
+            defaults["status"] = "active"
+            if event_created:
+                defaults["last_event_at"] = event_created
+        Subscription.objects.update_or_create(stripe_subscription_id=subscription_id, defaults=defaults)
+        if not stale and user.user_type != User.PRO:
+            user.user_type = User.PRO
+            user.save(update_fields=["user_type"])
+        _mark_checkout_completed(session.get("id"))
+        return True
+    return False
+
+
+def finalize_payment(session, metadata):
+    """Record the purchases of a paid session from the lines priced when it was created."""
+    session_id = session.get("id")
+    pending = PendingCheckout.objects.filter(stripe_checkout_session_id=session_id).first()
+    if pending is not None:
+        purchases = pending.build_purchases(session.get("payment_intent"))
+    else:
+        purchases = _reprice_purchases(session, metadata)
+    if not purchases:
+        return False
+    # One upsert for the whole cart, so redelivered events rewrite rows instead of duplicating them.
+    with transaction.atomic():
+        Purchase.objects.bulk_create(
+            purchases,
+            update_conflicts=True,
+            unique_fields=["stripe_checkout_session_id", "product"],
+            update_fields=PURCHASE_UPSERT_FIELDS,
+        )
+        _mark_checkout_completed(session_id, pending)
+    return True
+
+
+def _reprice_purchases(session, metadata):
+    # Sessions created before line snapshots were stored are priced from the current catalog.
+    user = User.objects.filter(pk=metadata.get("user_id")).first()
+    if not user:
+        return []
+    return [
+        Purchase(
+            user=user,
+            product_id=line.product.id,
+            quantity=line.quantity,
+            amount=line.line_total,
+            currency=session.get("currency", settings.DEFAULT_CURRENCY),
+            stripe_checkout_session_id=session.get("id"),
+            stripe_payment_intent_id=session.get("payment_intent", ""),
+            discount_applied=bool(line.discounts),
+        )
+        for line in quote_for_session(metadata).lines
+    ]
+
+
+def quote_for_session(metadata):
+    """Re-price the cart a checkout session was created for, with the tier and code it was created with."""
+    if metadata.get("type") == "product_cart":
+        entries = [entry.split(":", 1) for entry in (metadata.get("cart") or "").split("|") if ":" in entry]
+        cart = {pid: qty for pid, qty in entries}
+    else:
+        cart = {metadata["product_id"]: metadata.get("quantity", "1")} if metadata.get("product_id") else {}
+    # Sessions created before tiers were recorded only carry the discount flag.
+    tier = metadata.get("tier") or (User.PRO if metadata.get("discount_applied") == "true" else User.BASIC)
+    return quote_cart(cart, tier, metadata.get("promo_code", ""), include_inactive=True)
+
+
+def handle_subscription_updated(subscription, event_created=None):
+    sub_id = subscription.get("id")
+    if not sub_id:
+        return False
+    if _is_stale(sub_id, event_created):
+        logger.info("Ignoring stale update for subscription %s from %s", sub_id, event_created)
+        return False
+    defaults = {
+        "stripe_customer_id": subscription.get("customer", ""),
+        "status": subscription.get("status", "incomplete"),
+        "current_period_end": timestamp_to_dt(subscription.get("current_period_end")),
+    }
+    if event_created:
+        defaults["last_event_at"] = event_created
+    # Raises for a subscription whose checkout has not been applied yet; the event is retried later.
+    Subscription.objects.update_or_create(stripe_subscription_id=sub_id, defaults=defaults)
+    return True
@@ -9,9 +9,18 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ("name_en", "name_kh", "description")
     list_filter = ("active",)
 
+    def save_model(self, request, obj, form, change):
+        # Forget the feed fingerprint so the next import re-applies upstream values.
+        obj.fingerprint = ""
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ("name_en", "category", "price", "active", "popular")
     search_fields = ("name_en", "name_kh", "description_en", "description_kh")
     list_filter = ("active", "popular", "category")
+
+    def save_model(self, request, obj, form, change):
+        obj.fingerprint = ""
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,192 @@
+"""Incremental readers for catalog feeds.
+
+Feeds are read from binary streams in fixed-size chunks and yielded one record at
+a time, so memory use does not depend on the size of the feed. Supported inputs:
+
+* JSON documents shaped like ``{"categories": [...], "products": [...]}``; other
+  top-level keys are skipped.
+* NDJSON, one record per line. A record is a product when it has a ``type`` of
+  ``"product"`` or, without a ``type``, a ``category_id``; otherwise it is a category.
+  Lines with a ``type`` of ``"meta"`` carry feed metadata such as ``next``.
+* Either of the above gzip-compressed (detected from the stream's magic bytes).
+"""
+
+import codecs
+import gzip
+import io
+import json
+import re
+from urllib.parse import urlparse
+
+CHUNK_SIZE = 64 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+FEED_SECTIONS = {"categories": "category", "products": "product"}
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class FeedError(ValueError):
+    pass
+
+
+def open_stream(raw):
+    """Wrap a binary stream, transparently decompressing gzip content."""
+    buffered = raw if hasattr(raw, "peek") else io.BufferedReader(raw, CHUNK_SIZE)
+    if buffered.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=buffered)
+    return buffered
+
+
+def detect_format(name, content_type=""):
+    path = urlparse(name).path.lower() if "://" in name else name.lower()
+    path = path[:-3] if path.endswith(".gz") else path
+    if path.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    return "json"
+
+
+def iter_records(stream, fmt="json", meta=None):
+    """Yield ``(kind, item)`` pairs where kind is ``"category"`` or ``"product"``.
+
+    Scalar top-level values (e.g. a ``next`` page link) are collected into ``meta`` if given.
+    """
+    meta = {} if meta is None else meta
+    if fmt == "ndjson":
+        return _iter_ndjson(stream, meta)
+    return _JsonFeedReader(stream, meta).records()
+
+
+def iter_batches(records, batch_size):
+    """Group consecutive records of the same kind into lists of at most ``batch_size``."""
+    kind, batch = None, []
+    for record_kind, item in records:
+        if batch and (record_kind != kind or len(batch) >= batch_size):
+            yield kind, batch
+            batch = []
+        kind = record_kind
+        batch.append(item)
+    if batch:
+        yield kind, batch
+
+
+def _iter_ndjson(stream, meta):
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+    for line_number, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise FeedError(f"Invalid JSON on line {line_number}: {exc}") from exc
+        if not isinstance(item, dict):
+            raise FeedError(f"Expected an object on line {line_number}")
+        kind = item.pop("type", None) or ("product" if "category_id" in item else "category")
+        if kind == "meta":
+            meta.update(item)
+            continue
+        if kind not in FEED_SECTIONS.values():
+            raise FeedError(f"Unknown record type {kind!r} on line {line_number}")
+        yield kind, item
+
+
+class _JsonFeedReader:
+    """Pulls the elements of the top-level ``categories``/``products`` arrays one by one."""
+
+    def __init__(self, stream, meta):
+        self.stream = stream
+        self.meta = meta
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def records(self):
+        seen = set()
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+        else:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise FeedError("Expected an object key")
+                self._expect(":")
+                kind = FEED_SECTIONS.get(key)
+                if kind and self._peek() == "[":
+                    seen.add(key)
+                    for item in self._array():
+                        yield kind, item
+                else:
+                    value = self._value()
+                    if not isinstance(value, (dict, list)):
+                        self.meta[key] = value
+                separator = self._next_char()
+                if separator == "}":
+                    break
+                if separator != ",":
+                    raise FeedError(f"Expected ',' or '}}' but found {separator!r}")
+        if not seen:
+            raise FeedError("Unexpected payload shape; expected 'categories' and/or 'products'.")
+
+    def _array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            item = self._value()
+            if not isinstance(item, dict):
+                raise FeedError("Expected feed entries to be objects")
+            yield item
+            separator = self._next_char()
+            if separator == "]":
+                return
+            if separator != ",":
+                raise FeedError(f"Expected ',' or ']' but found {separator!r}")
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.stream.read(CHUNK_SIZE)
+        self.eof = not data
+        try:
+            text = self.text_decoder.decode(data, final=self.eof)
+        except UnicodeDecodeError as exc:
+            raise FeedError(f"Invalid UTF-8: {exc}") from exc
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def _next_char(self):
+        char = self._peek()
+        self.pos += 1
+        return char
+
+    def _expect(self, char):
+        found = self._next_char()
+        if found != char:
+            raise FeedError(f"Expected {char!r} but found {found!r}")
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as exc:
+                if not self._fill():
+                    raise FeedError(f"Invalid JSON: {exc}") from exc
+                continue
+            # A value that runs to the end of the buffer may be a truncated number or literal.
+            if end < len(self.buffer) or not self._fill():
+                self.pos = end
+                return value
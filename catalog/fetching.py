@@ -0,0 +1,79 @@
+"""HTTP fetching for catalog feeds: pooled keep-alive sessions, bounded retries and conditional GETs."""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import FeedState
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def build_session(retries=3, backoff=0.5, backoff_max=10, pool_size=10):
+    """Session whose adapter retries failed GETs with exponential backoff capped at ``backoff_max`` seconds."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        backoff_max=backoff_max,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class FeedFetcher:
+    """Fetches feed URLs, sending the validators stored from the last successful import.
+
+    ``fetch`` returns ``None`` when the server answers 304 Not Modified. Validators of a
+    200 response are only persisted once the caller calls ``remember`` after importing it.
+    Stored validators are loaded up front, so ``fetch`` never touches the database and is
+    safe to call from worker threads.
+    """
+
+    def __init__(self, session=None, timeout=20, conditional=True):
+        self.session = session or build_session()
+        self.timeout = timeout
+        self.conditional = conditional
+        self.validators = {}
+        if conditional:
+            rows = FeedState.objects.values_list("url", "etag", "last_modified")
+            self.validators = {url: (etag, last_modified) for url, etag, last_modified in rows}
+
+    def fetch(self, url, stream=False, conditional=True):
+        headers = self.conditional_headers(url) if self.conditional and conditional else {}
+        resp = self.session.get(url, timeout=self.timeout, stream=stream, headers=headers)
+        if resp.status_code == 304:
+            resp.close()
+            return None
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError:
+            resp.close()
+            raise
+        return resp
+
+    def conditional_headers(self, url):
+        etag, last_modified = self.validators.get(url, ("", ""))
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def remember(self, url, resp):
+        etag = resp.headers.get("ETag", "")
+        last_modified = resp.headers.get("Last-Modified", "")
+        if etag or last_modified:
+            FeedState.objects.update_or_create(url=url, defaults={"etag": etag, "last_modified": last_modified})
+        else:
+            FeedState.objects.filter(url=url).delete()
+
+    def close(self):
+        self.session.close()
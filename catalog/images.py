@@ -0,0 +1,162 @@
+"""Local cache of product images with resized WebP/JPEG variants.
+
+Source images are downloaded by a bounded pool of worker threads and hashed.
+Variants are stored under a path derived from that hash, so products sharing an
+image share its files, and an image whose bytes have not changed is never
+re-encoded. Each product records the source URL, hash and variant paths it was
+cached from; templates fall back to ``image_url`` until that matches.
+"""
+
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .fetching import build_session
+from .models import Product
+from .versioning import bump_catalog_version_on_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640)
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+UPDATE_BATCH_SIZE = 500
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+class ImageCacheResult:
+    __slots__ = ("cached", "unchanged", "skipped", "failed")
+
+    def __init__(self):
+        self.cached = self.unchanged = self.skipped = self.failed = 0
+
+    def __str__(self):
+        return f"cached: {self.cached}, unchanged: {self.unchanged}, skipped: {self.skipped}, failed: {self.failed}"
+
+
+def image_widths():
+    return tuple(sorted(getattr(settings, "CATALOG_IMAGE_WIDTHS", DEFAULT_WIDTHS)))
+
+
+def variant_path(digest, width, ext):
+    return f"catalog/images/{digest[:2]}/{digest}-{width}.{ext}"
+
+
+def build_variants(data, digest, widths=None):
+    """Write resized variants of ``data`` (skipping files already on disk) and return their paths by format."""
+    widths = widths or image_widths()
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ("RGB", "L"):
+            source = source.convert("RGBA")
+            background = Image.new("RGB", source.size, (255, 255, 255))
+            background.paste(source, mask=source.getchannel("A"))
+            source = background
+        elif source.mode == "L":
+            source = source.convert("RGB")
+        # Never upscale: widths above the original collapse into one full-size variant.
+        targets = sorted({min(width, source.width) for width in widths})
+        variants = {ext: [] for ext in FORMATS}
+        for width in targets:
+            resized = None
+            for ext, (pil_format, params) in FORMATS.items():
+                path = variant_path(digest, width, ext)
+                if not default_storage.exists(path):
+                    if resized is None:
+                        height = max(1, round(source.height * width / source.width))
+                        resized = source.resize((width, height), Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    resized.save(buffer, pil_format, **params)
+                    saved = default_storage.save(path, ContentFile(buffer.getvalue()))
+                    if saved != path:
+                        # A concurrent build stored the same bytes under this name first.
+                        default_storage.delete(saved)
+                variants[ext].append([width, path])
+    return variants
+
+
+def _download(session, url, timeout):
+    with session.get(url, timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        chunks, size = [], 0
+        for chunk in resp.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > MAX_SOURCE_BYTES:
+                raise ValueError(f"image larger than {MAX_SOURCE_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _variants_exist(variants):
+    return all(default_storage.exists(path) for ext in FORMATS for _, path in variants.get(ext) or [])
+
+
+def _cache_url(session, url, known, timeout):
+    """Download one source URL; returns ``(digest, variants)`` with ``variants`` None when unchanged."""
+    data = _download(session, url, timeout)
+    digest = hashlib.sha256(data).hexdigest()
+    previous = known.get(digest)
+    if previous and _variants_exist(previous):
+        return digest, None
+    return digest, build_variants(data, digest)
+
+
+def cache_product_images(products=None, workers=8, refresh=False, timeout=20, session=None):
+    """Cache the images of ``products`` (default: all active products with an image)."""
+    if products is None:
+        products = Product.objects.filter(active=True)
+    rows = products.exclude(image_url="").values_list("id", "image_url", "image_hash", "image_variants")
+
+    result = ImageCacheResult()
+    by_url, known = {}, {}
+    for pk, url, digest, variants in rows.iterator():
+        if digest and variants:
+            known[digest] = variants
+        if not refresh and variants and variants.get("source") == url:
+            result.skipped += 1
+            continue
+        by_url.setdefault(url, []).append((pk, digest, variants.get("source") if variants else None))
+    if not by_url:
+        return result
+
+    own_session = session is None
+    session = session or build_session(pool_size=workers)
+    updates = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="catalog-image") as pool:
+            futures = {pool.submit(_cache_url, session, url, known, timeout): url for url in by_url}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    digest, variants = future.result()
+                except Exception as exc:
+                    logger.warning("Could not cache image %s: %s", url, exc)
+                    result.failed += len(by_url[url])
+                    continue
+                if variants is None:
+                    variants = known[digest]
+                variants = {**variants, "source": url}
+                for pk, previous_digest, previous_source in by_url[url]:
+                    if previous_digest != digest:
+                        result.cached += 1
+                    else:
+                        result.unchanged += 1
+                        if previous_source == url:
+                            continue
+                    updates.append(Product(pk=pk, image_hash=digest, image_variants=variants))
+    finally:
+        if own_session:
+            session.close()
+
+    if updates:
+        Product.objects.bulk_update(updates, ["image_hash", "image_variants"], batch_size=UPDATE_BATCH_SIZE)
+        bump_catalog_version_on_commit()
+    return result
@@ -0,0 +1,331 @@
+"""Writers that upsert the upstream catalog feed into Category and Product.
+
+Every mapped row carries a fingerprint (a hash of its normalized fields), so rows
+the feed has not changed are never rewritten, and rows that disappear from the
+feed are soft-deactivated in one set-based UPDATE per table.
+"""
+
+import hashlib
+import json
+import logging
+import tempfile
+from contextlib import nullcontext
+from decimal import Decimal
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .feeds import iter_batches
+from .models import Category, Product
+from .versioning import bump_catalog_version_on_commit
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_FIELDS = ["name_en", "name_kh", "description", "active", "display_order", "fingerprint"]
+PRODUCT_FIELDS = [
+    "name_en",
+    "name_kh",
+    "description_en",
+    "description_kh",
+    "price",
+    "image_url",
+    "category",
+    "active",
+    "popular",
+    "display_order",
+    "fingerprint",
+]
+LOOKUP_BATCH_SIZE = 500
+
+
+def category_fields(item):
+    return {
+        "name_en": item.get("name_en", "") or "",
+        "name_kh": item.get("name_kh", "") or "",
+        "description": item.get("description", "") or "",
+        "active": bool(item.get("active", True)),
+        "display_order": item.get("display_order") or 0,
+    }
+
+
+def product_fields(item):
+    return {
+        "name_en": item.get("name_en", "") or "",
+        "name_kh": item.get("name_kh", "") or "",
+        "description_en": item.get("description_en", "") or "",
+        "description_kh": item.get("description_kh", "") or "",
+        "price": Decimal(str(item.get("price") or 0)).quantize(Decimal("0.01")),
+        "image_url": item.get("image_url", "") or "",
+        "active": bool(item.get("active", True)),
+        "popular": bool(item.get("popular", False)),
+        "display_order": item.get("display_order") or 0,
+    }
+
+
+def fingerprint(fields):
+    normalized = json.dumps(fields, sort_keys=True, separators=(",", ":"), cls=DjangoJSONEncoder)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class ImportResult:
+    __slots__ = ("created", "updated", "unchanged", "deactivated", "skipped")
+
+    def __init__(self):
+        self.created = self.updated = self.unchanged = self.deactivated = self.skipped = 0
+
+    def __str__(self):
+        return (
+            f"created: {self.created}, updated: {self.updated}, "
+            f"unchanged: {self.unchanged}, deactivated: {self.deactivated}"
+        )
+
+
+SEEN_TABLE = "catalog_import_seen"
+# Temp tables and ON CONFLICT upserts exist on these backends; only the two-argument minimum is spelled differently.
+SEEN_LOWEST = {"sqlite": "MIN", "postgresql": "LEAST"}
+
+
+class SeenSourceIds:
+    """Source ids present in the feed, kept in a connection-local temp table rather than in memory.
+
+    Each id also records the best (lowest) priority of the sources that supplied it,
+    which is how rows from several feeds are arbitrated. Needs SQLite or PostgreSQL.
+    """
+
+    def __init__(self):
+        if connection.vendor not in SEEN_LOWEST:
+            raise NotImplementedError(f"Feed imports need SQLite or PostgreSQL, not {connection.vendor}")
+        self.counts = {Category: 0, Product: 0}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {SEEN_TABLE} "
+                "(kind TEXT NOT NULL, source_id TEXT NOT NULL, priority INTEGER NOT NULL, "
+                "PRIMARY KEY (kind, source_id))"
+            )
+            cursor.execute(f"DELETE FROM {SEEN_TABLE}")
+
+    def add(self, model, source_ids, priority=0):
+        kind = model._meta.model_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEEN_TABLE} (kind, source_id, priority) VALUES (%s, %s, %s) "
+                "ON CONFLICT (kind, source_id) "
+                f"DO UPDATE SET priority = {SEEN_LOWEST[connection.vendor]}({SEEN_TABLE}.priority, excluded.priority)",
+                [(kind, source_id, priority) for source_id in source_ids],
+            )
+        self.counts[model] += len(source_ids)
+
+    def outranked(self, model, source_ids, priority):
+        """The subset of ``source_ids`` already supplied by a source that takes precedence."""
+        if priority <= 0:
+            return set()
+        kind = model._meta.model_name
+        found = set()
+        with connection.cursor() as cursor:
+            for start in range(0, len(source_ids), LOOKUP_BATCH_SIZE):
+                chunk = source_ids[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"SELECT source_id FROM {SEEN_TABLE} "
+                    f"WHERE kind = %s AND priority < %s AND source_id IN ({placeholders})",
+                    [kind, priority, *chunk],
+                )
+                found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def missing(self, model):
+        """Active rows of ``model`` whose source id was not seen."""
+        seen = RawSQL(f"SELECT source_id FROM {SEEN_TABLE} WHERE kind = %s", [model._meta.model_name])
+        return model.objects.filter(active=True).exclude(source_id__in=seen)
+
+    def drop(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEEN_TABLE}")
+
+
+class BaseImporter:
+    """Writes the feed batch by batch; call ``finish`` once the whole feed has been added.
+
+    Memory stays bounded by the batch size: existing rows are looked up per batch,
+    seen source ids go to a temp table, and products that arrive before their
+    category are spooled to a temporary file and retried at the end.
+
+    Batches may come from several sources. A lower ``priority`` number wins: rows a
+    better source already supplied are skipped, and rows from a better source that
+    arrives later overwrite what a worse one wrote.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.categories = ImportResult()
+        self.products = ImportResult()
+        self.category_map = {}
+        self.seen = SeenSourceIds()
+        self.deferred = None
+
+    def add(self, kind, items, priority=0):
+        if kind == "category":
+            self.add_categories(items, priority)
+        else:
+            self.add_products(items, priority)
+
+    def add_categories(self, items, priority=0):
+        rows = {}
+        for item in items:
+            fields = category_fields(item)
+            fields["fingerprint"] = fingerprint(fields)
+            rows[str(item["id"])] = fields
+        existing = self._apply(Category, rows, self.categories, priority)
+
+        pks = {source_id: pk for source_id, (pk, _) in existing.items()}
+        unknown = [source_id for source_id in rows if source_id not in pks]
+        if unknown:
+            pks.update(Category.objects.filter(source_id__in=unknown).values_list("source_id", "pk"))
+        self.category_map.update((source_id, pks[source_id]) for source_id in rows)
+
+    def add_products(self, items, priority=0, defer_unknown=True):
+        rows = {}
+        for item in items:
+            category_source_id = str(item.get("category_id"))
+            category_id = self.category_map.get(category_source_id)
+            if not category_id:
+                if defer_unknown:
+                    self._defer(item, priority)
+                    continue
+                logger.warning("Skipping product %s due to missing category %s", item.get("id"), item.get("category_id"))
+                self.products.skipped += 1
+                continue
+            fields = product_fields(item)
+            fields["fingerprint"] = fingerprint({**fields, "category": category_source_id})
+            fields["category_id"] = category_id
+            rows[str(item["id"])] = fields
+        if rows:
+            self._apply(Product, rows, self.products, priority)
+
+    def finish(self, deactivate_missing=True):
+        """Import deferred products, deactivate rows missing from the feed; returns the results."""
+        if self.deferred is not None:
+            self.deferred.seek(0)
+            entries = (json.loads(line) for line in self.deferred)
+            # Group by priority so each batch keeps its source's precedence.
+            grouped = iter_batches(((entry["priority"], entry["item"]) for entry in entries), self.batch_size)
+            for priority, batch in grouped:
+                self.add_products(batch, priority, defer_unknown=False)
+            self.deferred.close()
+            self.deferred = None
+        if deactivate_missing:
+            for model, result in ((Category, self.categories), (Product, self.products)):
+                result.deactivated = self._deactivate_missing(model)
+        self.seen.drop()
+        return self.categories, self.products
+
+    def _defer(self, item, priority):
+        if self.deferred is None:
+            self.deferred = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.deferred.write(json.dumps({"priority": priority, "item": item}) + "\n")
+
+    def _existing(self, model, source_ids):
+        existing = {}
+        for start in range(0, len(source_ids), LOOKUP_BATCH_SIZE):
+            lookup = model.objects.filter(source_id__in=source_ids[start : start + LOOKUP_BATCH_SIZE])
+            for source_id, pk, digest in lookup.values_list("source_id", "pk", "fingerprint"):
+                existing[source_id] = (pk, digest)
+        return existing
+
+    def _apply(self, model, rows, result, priority):
+        """Write the rows that changed; returns the pre-existing ``{source_id: (pk, fingerprint)}``."""
+        outranked = self.seen.outranked(model, list(rows), priority)
+        result.skipped += len(outranked)
+        candidates = [source_id for source_id in rows if source_id not in outranked]
+        existing = self._existing(model, candidates)
+        changed = {}
+        for source_id in candidates:
+            fields = rows[source_id]
+            current = existing.get(source_id)
+            if current and current[1] == fields["fingerprint"]:
+                result.unchanged += 1
+            else:
+                changed[source_id] = fields
+        if changed:
+            self.write(model, changed, existing, result)
+        self.seen.add(model, list(rows), priority)
+        return existing
+
+    def _deactivate_missing(self, model):
+        if not self.seen.counts[model]:
+            logger.warning("Feed has no %s rows; not deactivating anything", model._meta.verbose_name)
+            return 0
+        # Clearing the fingerprint makes a row that later reappears get rewritten (and reactivated).
+        deactivated = self.seen.missing(model).update(active=False, fingerprint="")
+        if deactivated:
+            bump_catalog_version_on_commit()
+        return deactivated
+
+    def write(self, model, rows, existing, result):
+        """Write ``rows`` (``{source_id: fields}``, changed or new) and count them in ``result``.
+
+        ``existing`` maps the source ids already in the table to ``(pk, fingerprint)``.
+        """
+        raise NotImplementedError
+
+
+class RowImporter(BaseImporter):
+    """Writes each changed row with update_or_create."""
+
+    def write(self, model, rows, existing, result):
+        for source_id, fields in rows.items():
+            _, was_created = model.objects.update_or_create(source_id=source_id, defaults=fields)
+            if was_created:
+                result.created += 1
+            else:
+                result.updated += 1
+
+
+class BulkImporter(BaseImporter):
+    """Writes changed rows in chunked INSERT ... ON CONFLICT UPDATE statements."""
+
+    def write(self, model, rows, existing, result):
+        # Rows are keyed by source_id so a feed repeating an id upserts it once (last wins);
+        # SQLite rejects an ON CONFLICT clause that touches the same row twice.
+        objs = [model(source_id=source_id, **fields) for source_id, fields in rows.items()]
+        update_fields = CATEGORY_FIELDS if model is Category else PRODUCT_FIELDS
+        for start in range(0, len(objs), self.batch_size):
+            model.objects.bulk_create(
+                objs[start : start + self.batch_size],
+                update_conflicts=True,
+                unique_fields=["source_id"],
+                update_fields=update_fields,
+            )
+        updated = sum(1 for source_id in rows if source_id in existing)
+        result.updated += updated
+        result.created += len(rows) - updated
+        bump_catalog_version_on_commit()
+
+
+def create_importer(bulk=False, batch_size=500):
+    return BulkImporter(batch_size=batch_size) if bulk else RowImporter(batch_size=batch_size)
+
+
+def import_records(records, bulk=False, batch_size=500, deactivate_missing=True):
+    """Import ``(kind, item)`` records; returns (category_result, product_result).
+
+    In bulk mode each batch is written in its own transaction (a savepoint when the
+    caller already holds one), so long streaming imports keep the WAL small.
+    """
+    importer = create_importer(bulk, batch_size)
+    for kind, batch in iter_batches(records, batch_size):
+        with transaction.atomic() if bulk else nullcontext():
+            importer.add(kind, batch)
+    return importer.finish(deactivate_missing=deactivate_missing)
+
+
+def import_catalog(data, bulk=False, batch_size=500):
+    """Import a decoded feed; in bulk mode the whole feed is written in one transaction."""
+    records = chain(
+        (("category", item) for item in data["categories"]),
+        (("product", item) for item in data["products"]),
+    )
+    with transaction.atomic() if bulk else nullcontext():
+        return import_records(records, bulk=bulk, batch_size=batch_size)
@@ -0,0 +1,117 @@
+import gzip
+import json
+import os
+import resource
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.feeds import iter_batches, iter_records, open_stream
+from catalog.importer import import_records
+from catalog.models import Category, Product
+from catalog.versioning import single_version_bump
+
+SOURCE_PREFIX = "memfeed-"
+CATEGORY_COUNT = 50
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _product(index):
+    return {
+        "id": f"{SOURCE_PREFIX}p{index}",
+        "category_id": f"{SOURCE_PREFIX}c{index % CATEGORY_COUNT}",
+        "name_en": f"Product {index}",
+        "name_kh": f"ផលិតផល {index}",
+        "description_en": f"Generated product {index} " + "lorem ipsum dolor sit amet " * 8,
+        "price": f"{1 + index % 50}.{index % 100:02d}",
+        "display_order": index % 100,
+    }
+
+
+class Command(BaseCommand):
+    help = "Generate a large feed file and measure peak memory while streaming through it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=2048, help="Uncompressed size of the generated feed")
+        parser.add_argument("--format", choices=["json", "ndjson"], default="json")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the generated feed")
+        parser.add_argument("--path", help="Reuse or keep the feed at this path instead of a temporary file")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--import",
+            dest="write",
+            action="store_true",
+            help="Also write the feed into the database (rows are prefixed and removed afterwards)",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        keep = bool(path)
+        if not path:
+            suffix = ".ndjson" if options["format"] == "ndjson" else ".json"
+            fd, path = tempfile.mkstemp(suffix=suffix + (".gz" if options["gzip"] else ""))
+            os.close(fd)
+        try:
+            if not keep or not os.path.exists(path):
+                self._generate(path, options)
+            self.stdout.write(f"Feed: {path} ({os.path.getsize(path) / 1024 ** 2:.0f} MB on disk)")
+            baseline = _peak_rss_mb()
+            started = time.perf_counter()
+            with open(path, "rb") as handle:
+                records = iter_records(open_stream(handle), options["format"])
+                if options["write"]:
+                    with single_version_bump():
+                        categories, products = import_records(
+                            records, bulk=True, batch_size=options["batch_size"], deactivate_missing=False
+                        )
+                    summary = f"categories {categories}; products {products}"
+                else:
+                    count = sum(len(batch) for _, batch in iter_batches(records, options["batch_size"]))
+                    summary = f"{count} records parsed"
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{summary} in {elapsed:.1f}s")
+            self.stdout.write(
+                f"Peak RSS: {_peak_rss_mb():.0f} MB (baseline before parsing {baseline:.0f} MB)"
+            )
+        finally:
+            if not keep and os.path.exists(path):
+                os.remove(path)
+            if options["write"]:
+                with single_version_bump():
+                    Product.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()
+                    Category.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()
+
+    def _generate(self, path, options):
+        target = options["size_mb"] * 1024 ** 2
+        opener = gzip.open if options["gzip"] else open
+        ndjson = options["format"] == "ndjson"
+        written = 0
+        self.stdout.write(f"Generating {options['size_mb']} MB {options['format']} feed...")
+        with opener(path, "wt", encoding="utf-8") as out:
+
+            def emit(text):
+                nonlocal written
+                out.write(text)
+                written += len(text)
+
+            categories = [
+                {"id": f"{SOURCE_PREFIX}c{i}", "name_en": f"Category {i}", "display_order": i}
+                for i in range(CATEGORY_COUNT)
+            ]
+            if ndjson:
+                for category in categories:
+                    emit(json.dumps(category) + "\n")
+            else:
+                emit('{"categories": ' + json.dumps(categories) + ', "products": [\n')
+            index = 0
+            while written < target:
+                line = json.dumps(_product(index))
+                emit(line + "\n" if ndjson else ("," if index else "") + line + "\n")
+                index += 1
+            if not ndjson:
+                emit("]}\n")
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.importer import import_catalog
+from catalog.models import Category, Product
+from catalog.versioning import single_version_bump
+
+SOURCE_PREFIX = "bench-"
+
+
+def synthetic_feed(categories, products, revision=0):
+    return {
+        "categories": [
+            {"id": f"{SOURCE_PREFIX}c{i}", "name_en": f"Category {i}", "display_order": i}
+            for i in range(categories)
+        ],
+        "products": [
+            {
+                "id": f"{SOURCE_PREFIX}p{i}",
+                "category_id": f"{SOURCE_PREFIX}c{i % categories}",
+                "name_en": f"Product {i}",
+                "name_kh": f"ផលិតផល {i}",
+                "description_en": f"Synthetic product {i} revision {revision}",
+                "price": f"{1 + (i + revision) % 50}.{i % 100:02d}",
+                "display_order": i % 100,
+            }
+            for i in range(products)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare row-by-row and bulk import modes on a synthetic feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Synthetic feed: {options['categories']} categories, {options['products']} products "
+            f"(rows are prefixed '{SOURCE_PREFIX}' and removed afterwards)"
+        )
+        try:
+            for label, bulk in (("row", False), ("bulk", True)):
+                self._cleanup()
+                for phase, revision in (("insert", 0), ("update", 1), ("idle", 1)):
+                    feed = synthetic_feed(options["categories"], options["products"], revision)
+                    started = time.perf_counter()
+                    with single_version_bump():
+                        _, products = import_catalog(feed, bulk=bulk, batch_size=options["batch_size"])
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f"{label:>5} {phase:<7} {elapsed:8.3f}s  {options['products'] / elapsed:10.0f} products/s  ({products})"
+                    )
+        finally:
+            self._cleanup()
+
+    def _cleanup(self):
+        with single_version_bump(), transaction.atomic():
+            Product.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()
+            Category.objects.filter(source_id__startswith=SOURCE_PREFIX).delete()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from catalog.images import cache_product_images
+from catalog.models import Product
+
+
+class Command(BaseCommand):
+    help = "Download product images and store resized WebP/JPEG variants under MEDIA_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8, help="Images downloaded and resized concurrently")
+        parser.add_argument("--timeout", type=float, default=20, help="Seconds to wait for each image server")
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="Re-download already cached images; variants are only rebuilt if the image bytes changed",
+        )
+        parser.add_argument("--all", action="store_true", help="Include inactive products")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all() if options["all"] else Product.objects.filter(active=True)
+        result = cache_product_images(
+            products,
+            workers=options["workers"],
+            refresh=options["refresh"],
+            timeout=options["timeout"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Images - {result}"))
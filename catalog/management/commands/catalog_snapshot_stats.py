@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from catalog.snapshot import get_snapshot
+
+
+class Command(BaseCommand):
+    help = "Build the in-process catalog snapshot used by billing and report its size"
+
+    def handle(self, *args, **options):
+        stats = get_snapshot().stats()
+        self.stdout.write(f"Catalog version: {stats['version']}")
+        self.stdout.write(f"Products: {stats['products']}")
+        self.stdout.write(f"Memory: {stats['memory_bytes'] / 1024:.1f} KiB")
+        self.stdout.write(f"Build time: {stats['build_seconds'] * 1000:.1f} ms")
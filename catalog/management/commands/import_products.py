@@ -2,12 +2,18 @@ import logging
 
 import requests
 from django.core.management.base import BaseCommand, CommandError
-from decimal import Decimal
 
-from catalog.models import Category, Product
+from catalog.feeds import FeedError, detect_format, iter_records, open_stream
+from catalog.fetching import FeedFetcher, build_session
+from catalog.images import cache_product_images
+from catalog.importer import create_importer, import_records
+from catalog.pipeline import FeedPipeline
+from catalog.versioning import single_version_bump
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_URL = "https://ousa-food.vercel.app/api/products"
+
 
 class Command(BaseCommand):
     help = "Import products and categories from the external API"
@@ -15,68 +21,138 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
             "--url",
-            default="https://ousa-food.vercel.app/api/products",
-            help="Endpoint returning categories and products JSON",
+            action="append",
+            help=(
+                "Endpoint returning categories and products JSON; repeat for several feeds. "
+                "Feeds listed earlier win when they disagree about a row. "
+                f"Defaults to {DEFAULT_URL}"
+            ),
+        )
+        parser.add_argument(
+            "--file",
+            help="Read the feed from a local file (JSON or NDJSON, optionally gzipped) instead of --url; implies --stream",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Parse the feed incrementally and write it in batches with flat memory use",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["auto", "json", "ndjson"],
+            default="auto",
+            help="Feed format for --stream/--file; auto uses the file extension or Content-Type",
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Upsert in chunked set-based statements inside one transaction instead of row by row",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows per batch (and per INSERT statement in --bulk mode)",
+        )
+        parser.add_argument("--workers", type=int, default=4, help="Feeds fetched concurrently")
+        parser.add_argument(
+            "--max-pages",
+            type=int,
+            default=1000,
+            help="Stop following a feed's next-page links after this many pages",
+        )
+        parser.add_argument("--timeout", type=float, default=20, help="Seconds to wait for the feed server")
+        parser.add_argument("--retries", type=int, default=3, help="Retries for connection errors and 429/5xx responses")
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=0.5,
+            help="Base delay in seconds for exponential backoff between retries (capped at 10s)",
+        )
+        parser.add_argument(
+            "--images",
+            action="store_true",
+            help="Cache product images locally after importing (see cache_product_images)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Ignore the stored ETag/Last-Modified and download the feed even if unchanged",
         )
 
     def handle(self, *args, **options):
-        url = options["url"]
-        self.stdout.write(f"Fetching data from {url}")
+        with single_version_bump():
+            if options["file"]:
+                results = self._import_file(options)
+            else:
+                results = self._import_urls(options)
+        if results is None:
+            self.stdout.write(self.style.SUCCESS("Feed not modified since the last import; nothing to do."))
+        else:
+            category_result, product_result = results
+            self.stdout.write(self.style.SUCCESS(f"Categories - {category_result}"))
+            self.stdout.write(self.style.SUCCESS(f"Products - {product_result}"))
+        if options["images"]:
+            image_result = cache_product_images(workers=options["workers"], timeout=options["timeout"])
+            self.stdout.write(self.style.SUCCESS(f"Images - {image_result}"))
+
+    def _import_urls(self, options):
+        urls = options["url"] or [DEFAULT_URL]
+        stream = options["stream"]
+        fetcher = FeedFetcher(
+            build_session(
+                retries=options["retries"],
+                backoff=options["backoff"],
+                pool_size=max(options["workers"], 1),
+            ),
+            timeout=options["timeout"],
+            conditional=not options["force"],
+        )
+        pipeline = FeedPipeline(
+            fetcher,
+            create_importer(options["bulk"], options["batch_size"]),
+            stream=stream,
+            fmt=options["format"],
+            batch_size=options["batch_size"],
+            workers=min(options["workers"], len(urls)),
+            max_pages=options["max_pages"],
+        )
+        for url in urls:
+            self.stdout.write(f"{'Streaming' if stream else 'Fetching'} data from {url}")
         try:
-            resp = requests.get(url, timeout=20)
-            resp.raise_for_status()
+            # A whole-document bulk import is one transaction; streaming commits batch by batch.
+            results = pipeline.run(
+                urls,
+                atomic=options["bulk"] and not stream,
+                batch_atomic=options["bulk"] and stream,
+            )
         except requests.RequestException as exc:
             raise CommandError(f"Failed to fetch data: {exc}") from exc
+        except (FeedError, ValueError, OSError) as exc:
+            raise CommandError(f"Failed to read feed: {exc}") from exc
+        finally:
+            fetcher.close()
 
-        data = resp.json()
-        if not isinstance(data, dict) or "categories" not in data or "products" not in data:
-            raise CommandError("Unexpected payload shape; expected 'categories' and 'products'.")
+        if len(urls) > 1:
+            for source in pipeline.sources:
+                status = "not modified" if source.not_modified else f"{source.pages} page(s)"
+                self.stdout.write(f"  {source.url}: {status}")
+        if results is not None and any(source.not_modified for source in pipeline.sources):
+            self.stdout.write(self.style.WARNING("Some feeds were not modified; skipped deactivating missing rows."))
+        return results
 
-        category_map = self._import_categories(data["categories"])
-        self._import_products(data["products"], category_map)
-
-    def _import_categories(self, categories):
-        created = updated = 0
-        category_map = {}
-        for item in categories:
-            obj, was_created = Category.objects.update_or_create(
-                source_id=item["id"],
-                defaults={
-                    "name_en": item.get("name_en", "") or "",
-                    "name_kh": item.get("name_kh", "") or "",
-                    "description": item.get("description", "") or "",
-                    "active": bool(item.get("active", True)),
-                    "display_order": item.get("display_order") or 0,
-                },
-            )
-            category_map[obj.source_id] = obj
-            created += 1 if was_created else 0
-            updated += 0 if was_created else 1
-        self.stdout.write(self.style.SUCCESS(f"Categories - created: {created}, updated: {updated}"))
-        return category_map
-
-    def _import_products(self, products, category_map):
-        created = updated = 0
-        for item in products:
-            category = category_map.get(item.get("category_id"))
-            if not category:
-                logger.warning("Skipping product %s due to missing category %s", item.get("id"), item.get("category_id"))
-                continue
-            obj, was_created = Product.objects.update_or_create(
-                source_id=item["id"],
-                defaults={
-                    "name_en": item.get("name_en", "") or "",
-                    "name_kh": item.get("name_kh", "") or "",
-                    "description_en": item.get("description_en", "") or "",
-                    "description_kh": item.get("description_kh", "") or "",
-                    "price": Decimal(str(item.get("price") or 0)),
-                    "image_url": item.get("image_url", "") or "",
-                    "category": category,
-                    "active": bool(item.get("active", True)),
-                    "popular": bool(item.get("popular", False)),
-                    "display_order": item.get("display_order") or 0,
-                },
-            )
-            created += 1 if was_created else 0
-            updated += 0 if was_created else 1
-        self.stdout.write(self.style.SUCCESS(f"Products - created: {created}, updated: {updated}"))
+    def _import_file(self, options):
+        path = options["file"]
+        self.stdout.write(f"Streaming data from {path}")
+        fmt = options["format"]
+        if fmt == "auto":
+            fmt = detect_format(path)
+        try:
+            with open(path, "rb") as handle:
+                return import_records(
+                    iter_records(open_stream(handle), fmt),
+                    bulk=options["bulk"],
+                    batch_size=options["batch_size"],
+                )
+        except (FeedError, OSError) as exc:
+            raise CommandError(f"Failed to read feed: {exc}") from exc
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.26 on 2026-10-18 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'category', 'display_order', 'name_en'], name='catalog_product_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+
+FTS_TABLE = "catalog_product_fts"
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name_en, name_kh, description_en, description_kh,
+        content='catalog_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS catalog_product_fts_ai AFTER INSERT ON catalog_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name_en, name_kh, description_en, description_kh)
+        VALUES (new.id, new.name_en, new.name_kh, new.description_en, new.description_kh);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS catalog_product_fts_ad AFTER DELETE ON catalog_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name_en, name_kh, description_en, description_kh)
+        VALUES ('delete', old.id, old.name_en, old.name_kh, old.description_en, old.description_kh);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS catalog_product_fts_au
+    AFTER UPDATE OF name_en, name_kh, description_en, description_kh ON catalog_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name_en, name_kh, description_en, description_kh)
+        VALUES ('delete', old.id, old.name_en, old.name_kh, old.description_en, old.description_kh);
+        INSERT INTO {FTS_TABLE}(rowid, name_en, name_kh, description_en, description_kh)
+        VALUES (new.id, new.name_en, new.name_kh, new.description_en, new.description_kh);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS catalog_product_fts_au",
+    "DROP TRIGGER IF EXISTS catalog_product_fts_ad",
+    "DROP TRIGGER IF EXISTS catalog_product_fts_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def _run(statements):
+    def apply(apps, schema_editor):
+        # FTS5 is SQLite-only; other backends fall back to ORM lookups in catalog.search.
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_product_listing_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SQL), _run(DROP_SQL)),
+    ]
@@ -1,6 +1,26 @@
+from django.core.files.storage import default_storage
 from django.db import models
 
 
+class ProductImage:
+    """Template-facing view of a product image: local variants when cached, the upstream URL otherwise."""
+
+    __slots__ = ("src", "webp_srcset", "jpeg_srcset")
+
+    def __init__(self, image_url, variants):
+        self.src, self.webp_srcset, self.jpeg_srcset = image_url, "", ""
+        if variants and variants.get("source") == image_url:
+            jpeg = variants.get("jpeg") or []
+            self.webp_srcset = _srcset(variants.get("webp") or [])
+            self.jpeg_srcset = _srcset(jpeg)
+            if jpeg:
+                self.src = default_storage.url(jpeg[-1][1])
+
+
+def _srcset(variants):
+    return ", ".join(f"{default_storage.url(path)} {width}w" for width, path in variants)
+
+
 class Category(models.Model):
     source_id = models.CharField(max_length=100, unique=True)
     name_en = models.CharField(max_length=255)
@@ -8,6 +28,7 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     active = models.BooleanField(default=True)
     display_order = models.PositiveIntegerField(default=0)
+    fingerprint = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         ordering = ["display_order", "name_en"]
@@ -28,11 +49,38 @@ class Product(models.Model):
     active = models.BooleanField(default=True)
     popular = models.BooleanField(default=False)
     display_order = models.PositiveIntegerField(default=0)
+    fingerprint = models.CharField(max_length=64, blank=True, editable=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ["display_order", "name_en"]
+        indexes = [
+            models.Index(
+                fields=["active", "category", "display_order", "name_en"],
+                name="catalog_product_listing_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name_en
 
+    @property
+    def image(self):
+        if not self.image_url:
+            return None
+        return ProductImage(self.image_url, self.image_variants)
+
+
+class FeedState(models.Model):
+    """HTTP validators from the last successful import of a feed URL."""
+
+    url = models.CharField(max_length=500, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
 # Create your models here.
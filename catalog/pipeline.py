@@ -0,0 +1,175 @@
+"""Concurrent ingestion of one or more (paginated) catalog feeds.
+
+Each feed is fetched and parsed in a worker thread, following its page cursor.
+Workers push parsed batches onto a bounded queue and a single writer, running on
+the caller's thread, drains it into the importer, so the database only ever sees
+one writer. Feeds run in parallel, so wall time tracks the slowest feed rather
+than the sum of all of them.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import chain
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from django.db import transaction
+
+from .feeds import FEED_SECTIONS, FeedError, detect_format, iter_batches, iter_records, open_stream
+
+logger = logging.getLogger(__name__)
+
+QUEUE_BATCHES_PER_WORKER = 4
+PUT_TIMEOUT = 0.5
+
+
+class FeedSource:
+    """One feed URL; a lower ``priority`` wins when feeds disagree about a row."""
+
+    __slots__ = ("url", "priority", "pages", "not_modified", "response")
+
+    def __init__(self, url, priority):
+        self.url = url
+        self.priority = priority
+        self.pages = 0
+        self.not_modified = False
+        self.response = None
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def next_page_url(resp, meta, url):
+    """Follow a ``Link: rel=next`` header, a ``next`` URL or a ``next_cursor`` in the page body."""
+    link = resp.links.get("next", {}).get("url")
+    if link:
+        return urljoin(url, link)
+    if meta.get("next"):
+        return urljoin(url, str(meta["next"]))
+    if meta.get("next_cursor"):
+        parts = urlsplit(url)
+        query = [(key, value) for key, value in parse_qsl(parts.query) if key != "cursor"]
+        query.append(("cursor", str(meta["next_cursor"])))
+        return urlunsplit(parts._replace(query=urlencode(query)))
+    return None
+
+
+class FeedPipeline:
+    def __init__(self, fetcher, importer, stream=False, fmt="auto", batch_size=500, workers=4, max_pages=1000):
+        self.fetcher = fetcher
+        self.importer = importer
+        self.stream = stream
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.max_pages = max_pages
+        self.queue = queue.Queue(maxsize=self.workers * QUEUE_BATCHES_PER_WORKER)
+        self.cancelled = threading.Event()
+        self.sources = []
+
+    def run(self, urls, atomic=False, batch_atomic=False):
+        """Import every URL; returns the importer results, or ``None`` if every feed was unchanged.
+
+        ``atomic`` wraps the whole write phase in one transaction, ``batch_atomic`` each batch.
+        Rows are only deactivated when every feed was downloaded in full.
+
+        Once any feed has changed, feeds that answered 304 are downloaded again in full:
+        their ids must be seen for a feed they outrank not to overwrite their rows.
+        """
+        sources = self.sources = [FeedSource(url, priority) for priority, url in enumerate(urls)]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="catalog-feed") as pool:
+            for source in sources:
+                pool.submit(self._fetch, source)
+            try:
+                with transaction.atomic() if atomic else nullcontext():
+                    self._write(len(sources), batch_atomic)
+                    not_modified = [source for source in sources if source.not_modified]
+                    if not_modified and len(not_modified) < len(sources):
+                        for source in not_modified:
+                            source.not_modified = False
+                            pool.submit(self._fetch, source, False)
+                        self._write(len(not_modified), batch_atomic)
+                    unchanged = sum(source.not_modified for source in sources)
+                    results = self.importer.finish(deactivate_missing=not unchanged)
+            except BaseException:
+                self.cancelled.set()
+                raise
+        if unchanged:
+            logger.info("%s of %s feeds not modified; skipped deactivation", unchanged, len(sources))
+        if unchanged == len(sources):
+            return None
+        for source in sources:
+            if source.response is not None:
+                self.fetcher.remember(source.url, source.response)
+        return results
+
+    def _write(self, pending, batch_atomic):
+        while pending:
+            message, source, payload = self.queue.get()
+            if message == "batch":
+                kind, batch = payload
+                with transaction.atomic() if batch_atomic else nullcontext():
+                    self.importer.add(kind, batch, source.priority)
+            elif message == "error":
+                raise payload
+            else:
+                pending -= 1
+
+    def _fetch(self, source, conditional=True):
+        try:
+            url = source.url
+            while url:
+                if source.pages >= self.max_pages:
+                    logger.warning("Stopped following %s after %s pages", source.url, self.max_pages)
+                    break
+                # Validators are stored per feed, so only the first page is fetched conditionally.
+                resp = self.fetcher.fetch(url, stream=self.stream, conditional=conditional and not source.pages)
+                if resp is None:
+                    source.not_modified = True
+                    break
+                if not source.pages:
+                    source.response = resp
+                meta = {}
+                with resp:
+                    for kind, batch in iter_batches(self._records(resp, url, meta), self.batch_size):
+                        self._put(("batch", source, (kind, batch)))
+                source.pages += 1
+                url = next_page_url(resp, meta, url)
+            self._put(("done", source, None))
+        except _Cancelled:
+            pass
+        except Exception as exc:
+            try:
+                self._put(("error", source, exc))
+            except _Cancelled:
+                pass
+
+    def _records(self, resp, url, meta):
+        if self.stream:
+            resp.raw.decode_content = True
+            # Keep reads past the end of the body returning b"" instead of failing on a closed file.
+            resp.raw.auto_close = False
+            fmt = detect_format(url, resp.headers.get("Content-Type", "")) if self.fmt == "auto" else self.fmt
+            return iter_records(open_stream(resp.raw), fmt, meta)
+
+        data = resp.json()
+        if not isinstance(data, dict) or not FEED_SECTIONS.keys() & data.keys():
+            raise FeedError("Unexpected payload shape; expected 'categories' and 'products'.")
+        meta.update((key, value) for key, value in data.items() if key not in FEED_SECTIONS)
+        return chain(
+            (("category", item) for item in data.get("categories") or []),
+            (("product", item) for item in data.get("products") or []),
+        )
+
+    def _put(self, message):
+        while True:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self.queue.put(message, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
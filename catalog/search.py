@@ -0,0 +1,150 @@
+"""Full-text product search backed by the SQLite FTS5 index on catalog_product.
+
+The index's unicode61 tokenizer only splits words on spaces and punctuation, so
+Khmer text (written without spaces between words) is indexed as whole phrases and
+a word inside one would never match. Queries in Khmer and the other unspaced
+scripts of the region go through substring (LIKE) matching instead, unranked.
+
+Triggers keep the index in step with catalog_product. SQLite migrations that
+rebuild the table drop them, so ``ensure_search_index`` restores them after
+every ``migrate``.
+"""
+
+import json
+import re
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Product, ProductImage
+
+FTS_TABLE = "catalog_product_fts"
+MAX_RESULTS = 50
+
+_FTS_COLUMNS = "name_en, name_kh, description_en, description_kh"
+_FTS_INSERT = f"INSERT INTO {FTS_TABLE}(rowid, {_FTS_COLUMNS}) VALUES (new.id, new.name_en, new.name_kh, new.description_en, new.description_kh);"
+_FTS_DELETE = (
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_FTS_COLUMNS}) "
+    "VALUES ('delete', old.id, old.name_en, old.name_kh, old.description_en, old.description_kh);"
+)
+INDEX_TRIGGERS = {
+    "catalog_product_fts_ai": f"AFTER INSERT ON catalog_product BEGIN {_FTS_INSERT} END",
+    "catalog_product_fts_ad": f"AFTER DELETE ON catalog_product BEGIN {_FTS_DELETE} END",
+    "catalog_product_fts_au": (
+        f"AFTER UPDATE OF {_FTS_COLUMNS} ON catalog_product BEGIN {_FTS_DELETE} {_FTS_INSERT} END"
+    ),
+}
+
+# Khmer, Thai, Lao and Myanmar.
+_UNSPACED_SCRIPT = re.compile("[\u0e00-\u0eff\u1000-\u109f\u1780-\u17ff\u19e0-\u19ff]")
+
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+# Names outrank descriptions: bm25 weights follow the FTS column order.
+_SEARCH_SQL = f"""
+    SELECT p.id, p.name_en, p.name_kh, p.price, p.image_url, p.image_variants, c.name_en,
+           snippet({FTS_TABLE}, -1, char(2), char(3), '…', 12),
+           bm25({FTS_TABLE}, 10.0, 10.0, 1.0, 1.0) AS score
+    FROM {FTS_TABLE}
+    JOIN catalog_product p ON p.id = {FTS_TABLE}.rowid
+    JOIN catalog_category c ON c.id = p.category_id
+    WHERE {FTS_TABLE} MATCH %s AND p.active
+    ORDER BY score
+    LIMIT %s
+"""
+
+
+class SearchResult:
+    __slots__ = ("id", "name_en", "name_kh", "price", "image_url", "image", "category_name", "snippet", "score")
+
+    def __init__(self, id, name_en, name_kh, price, image_url, image_variants, category_name, snippet, score):
+        self.id = id
+        self.name_en = name_en
+        self.name_kh = name_kh
+        self.price = price
+        self.image_url = image_url
+        self.image = ProductImage(image_url, image_variants) if image_url else None
+        self.category_name = category_name
+        self.snippet = snippet
+        self.score = score
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query where every term must match as a prefix."""
+    terms = [term.replace('"', '""') for term in (text or "").split()]
+    return " ".join(f'"{term}"*' for term in terms if term.strip('"'))
+
+
+def ensure_search_index(connection):
+    """Recreate missing index triggers and rebuild the index; returns whether anything was missing."""
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name = %s OR type = 'trigger'", [FTS_TABLE])
+        existing = {name for _, name in cursor.fetchall()}
+        missing = [name for name in INDEX_TRIGGERS if name not in existing]
+        # The index itself is created by migration 0003.
+        if FTS_TABLE not in existing or not missing:
+            return False
+        for name in missing:
+            cursor.execute(f"CREATE TRIGGER {name} {INDEX_TRIGGERS[name]}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def _to_price(value):
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet or "").replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>"))
+
+
+def search_products(text, limit=20):
+    limit = max(1, min(int(limit), MAX_RESULTS))
+    match = build_match_query(text)
+    if not match:
+        return []
+    if connection.vendor != "sqlite" or _UNSPACED_SCRIPT.search(text):
+        return _search_fallback(text, limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(_SEARCH_SQL, [match, limit])
+        rows = cursor.fetchall()
+    return [
+        SearchResult(
+            pk, name_en, name_kh, _to_price(price), image_url, json.loads(variants or "{}"), category, _highlight(snippet), score
+        )
+        for pk, name_en, name_kh, price, image_url, variants, category, snippet, score in rows
+    ]
+
+
+def _search_fallback(text, limit):
+    query = Q()
+    for term in text.split():
+        query &= (
+            Q(name_en__icontains=term)
+            | Q(name_kh__icontains=term)
+            | Q(description_en__icontains=term)
+            | Q(description_kh__icontains=term)
+        )
+    products = Product.objects.filter(query, active=True).select_related("category")[:limit]
+    return [
+        SearchResult(
+            p.id,
+            p.name_en,
+            p.name_kh,
+            p.price,
+            p.image_url,
+            p.image_variants,
+            p.category.name_en,
+            escape(p.description_en[:120]),
+            0.0,
+        )
+        for p in products
+    ]
+
@@ -0,0 +1,17 @@
+from django.apps import apps
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+from .models import Category, Product
+from .search import ensure_search_index
+from .versioning import bump_catalog_version_on_commit
+
+
+def repair_search_index(using, **kwargs):
+    ensure_search_index(connections[using])
+
+
+for model in (Category, Product):
+    post_save.connect(bump_catalog_version_on_commit, sender=model, dispatch_uid=f"catalog_version_save_{model.__name__}")
+    post_delete.connect(bump_catalog_version_on_commit, sender=model, dispatch_uid=f"catalog_version_delete_{model.__name__}")
+post_migrate.connect(repair_search_index, sender=apps.get_app_config("catalog"), dispatch_uid="catalog_search_index")
@@ -0,0 +1,138 @@
+"""Per-process read model of the product catalog for hot billing paths.
+
+Carts, checkout and the Stripe webhook only need a handful of product columns.
+The snapshot holds them in compact slotted records built from one ``values_list``
+query and is rebuilt when the catalog version changes, so lookups are plain dict
+reads. Ids missing from the snapshot (rows written since it was built, before
+the version bump is visible) are fetched in a single query and added to it.
+"""
+
+import logging
+import sys
+import threading
+import time
+from decimal import Decimal
+
+from .models import Product, ProductImage
+from .versioning import get_catalog_version
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_LENGTH = 200
+FIELDS = ("id", "name_en", "description_en", "price", "active", "image_url", "image_variants", "category__name_en")
+
+
+class ProductRecord:
+    __slots__ = ("id", "name_en", "summary", "price", "active", "image_url", "image_variants", "category_name")
+
+    def __init__(self, id, name_en, description_en, price, active, image_url, image_variants, category_name):
+        self.id = id
+        self.name_en = name_en
+        self.summary = description_en[:SUMMARY_LENGTH]
+        self.price = Decimal(price)
+        self.active = active
+        self.image_url = image_url
+        self.image_variants = image_variants or None
+        self.category_name = category_name
+
+    @property
+    def image(self):
+        if not self.image_url:
+            return None
+        return ProductImage(self.image_url, self.image_variants)
+
+    def __repr__(self):
+        return f"<ProductRecord {self.id} {self.name_en!r}>"
+
+
+def _load(queryset):
+    return {row[0]: ProductRecord(*row) for row in queryset.values_list(*FIELDS).iterator(chunk_size=2000)}
+
+
+def _record_size(record):
+    size = sys.getsizeof(record)
+    for name in ProductRecord.__slots__:
+        value = getattr(record, name)
+        # Interned/shared small values (ints, bools, None) are not counted twice.
+        if isinstance(value, (str, Decimal, dict)):
+            size += sys.getsizeof(value)
+    return size
+
+
+class CatalogSnapshot:
+    def __init__(self, version, records, build_seconds=0.0):
+        self.version = version
+        self.records = records
+        self.build_seconds = build_seconds
+        self.built_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, version):
+        started = time.perf_counter()
+        records = _load(Product.objects.all())
+        return cls(version, records, time.perf_counter() - started)
+
+    def get(self, pk):
+        return self.get_many([pk]).get(int(pk))
+
+    def get_many(self, ids):
+        """Map each of ``ids`` to its record; unknown ids are looked up in one query and absent ones omitted."""
+        found, missing = {}, []
+        for pk in ids:
+            pk = int(pk)
+            record = self.records.get(pk)
+            if record is None:
+                missing.append(pk)
+            else:
+                found[pk] = record
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            loaded = _load(Product.objects.filter(id__in=missing))
+            with self._lock:
+                self.records.update(loaded)
+            found.update(loaded)
+        return found
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        records = list(self.records.values())
+        return {
+            "version": self.version,
+            "products": len(records),
+            "memory_bytes": sys.getsizeof(self.records) + sum(_record_size(record) for record in records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "build_seconds": self.build_seconds,
+            "age_seconds": time.time() - self.built_at,
+        }
+
+
+_snapshot = None
+_build_lock = threading.Lock()
+
+
+def get_snapshot():
+    """The snapshot for the current catalog version, rebuilding it on the first call after a bump."""
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _build_lock:
+        if _snapshot is None or _snapshot.version != version:
+            if _snapshot is not None:
+                logger.info("Retiring catalog snapshot: %s", _snapshot.stats())
+            _snapshot = CatalogSnapshot.build(version)
+            logger.info(
+                "Built catalog snapshot of %s products in %.3fs", len(_snapshot.records), _snapshot.build_seconds
+            )
+        return _snapshot
+
+
+def snapshot_stats():
+    return _snapshot.stats() if _snapshot is not None else None
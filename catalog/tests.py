@@ -1,3 +1,658 @@
-from django.test import TestCase
+import base64
+import gzip
+import html
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from .feeds import FeedError, detect_format, iter_records, open_stream
+from .models import Category, FeedState, Product, ProductImage
+from .images import build_variants, cache_product_images
+from .importer import import_catalog
+from .search import search_products
+from .snapshot import get_snapshot, snapshot_stats
+from .versioning import bump_catalog_version, get_catalog_version, single_version_bump
+
+FEED = {
+    "categories": [{"id": "c1", "name_en": "Noodles", "display_order": 1}],
+    "products": [
+        {"id": "p1", "category_id": "c1", "name_en": "Kuy teav", "price": "2.50"},
+        {"id": "p2", "category_id": "c1", "name_en": "Lort cha", "price": "2.00"},
+    ],
+}
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        rows = [(0, "Zed"), (1, "Another"), (1, "Same"), (1, "Same"), (1, "Same")]
+        Product.objects.bulk_create(
+            Product(
+                source_id=f"p{index}",
+                name_en=name,
+                description_en=f"row {index}",
+                display_order=display_order,
+                price="1.00",
+                category=category,
+            )
+            for index, (display_order, name) in enumerate(rows)
+        )
+
+    def page(self, **params):
+        response = self.client.get(reverse("catalog:product_list"), params)
+        content = response.content.decode()
+        rows = re.findall(r'<p class="mt-2 text-sm text-slate-400">(row \d+)</p>', content)
+        next_link = re.search(r'href="[^"?]*\?([^"]*)">Next page', content)
+        return rows, dict(re.findall(r"([^&=]+)=([^&]*)", html.unescape(next_link.group(1)))) if next_link else None
+
+    def test_pages_walk_rows_with_equal_sort_keys(self):
+        seen, params, pages = [], {"limit": 2}, 0
+        while params is not None:
+            rows, params = self.page(**params)
+            seen += rows
+            pages += 1
+
+        self.assertEqual(seen, ["row 0", "row 1", "row 2", "row 3", "row 4"])
+        self.assertEqual(pages, 3)
+
+    def test_full_last_page_has_no_next_link(self):
+        rows, next_params = self.page(limit=5)
+
+        self.assertEqual(len(rows), 5)
+        self.assertIsNone(next_params)
+
+    def test_invalid_or_tampered_cursor_starts_from_the_first_page(self):
+        first_page = self.page(limit=2)
+        tampered = (["x", "Same", 1], [1, "Same"], {"a": 1, "b": 2, "c": 3}, 7)
+        cursors = ["not a cursor", "e30"] + [base64.urlsafe_b64encode(json.dumps(value).encode()).decode() for value in tampered]
+
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.page(limit=2, after=cursor), first_page)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CatalogVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.product = Product.objects.create(source_id="p1", name_en="Kuy teav", price="2.50", category=self.category)
+
+    def test_write_bumps_the_version_on_commit(self):
+        version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name_en = "Kuy teav special"
+            self.product.save()
+            self.assertEqual(get_catalog_version(), version)
+
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_batched_writes_bump_once(self):
+        with self.captureOnCommitCallbacks() as callbacks, single_version_bump():
+            self.product.save()
+            self.category.save()
+
+        self.assertEqual(len(callbacks), 1)
+
+    def test_cached_grid_is_served_without_queries_until_a_write(self):
+        url = reverse("catalog:product_list")
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), "Kuy teav")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name_en = "Lort cha"
+            self.product.save()
+        self.assertContains(self.client.get(url), "Lort cha")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CatalogApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.product = Product.objects.create(source_id="p1", name_en="Kuy teav", price="2.50", category=self.category)
+        self.url = reverse("catalog:catalog_api")
+
+    def test_document_lists_active_rows(self):
+        Product.objects.create(source_id="p2", name_en="Hidden", price="1.00", category=self.category, active=False)
+
+        response = self.client.get(self.url)
+        document = json.loads(b"".join(response.streaming_content))
+
+        self.assertEqual([category["source_id"] for category in document["categories"]], ["c1"])
+        self.assertEqual([(product["source_id"], product["price"]) for product in document["products"]], [("p1", "2.50")])
+
+    def test_matching_etag_gets_304_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_when_the_catalog_changes(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        bump_catalog_version()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Product.objects.filter(pk=self.product.pk).update(price="3.00")
+        bump_catalog_version()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ImportCountTests(TestCase):
+    def feed(self, *products):
+        return {"categories": FEED["categories"], "products": list(products)}
+
+    def test_upserts_count_created_and_updated_rows(self):
+        for bulk in (True, False):
+            with self.subTest(bulk=bulk):
+                Product.objects.all().delete()
+                p1, p2 = FEED["products"]
+                categories, products = import_catalog(self.feed(p1, p2), bulk=bulk)
+                self.assertEqual((products.created, products.updated), (2, 0))
+
+                changed = {**p1, "price": "3.00"}
+                new = {"id": "p3", "category_id": "c1", "name_en": "Num pang", "price": "1.50"}
+                categories, products = import_catalog(self.feed(changed, p2, new), bulk=bulk)
+
+                self.assertEqual((categories.created, categories.updated), (0, 0))
+                self.assertEqual((products.created, products.updated, products.unchanged), (1, 1, 1))
+                self.assertEqual(str(Product.objects.get(source_id="p1").price), "3.00")
+                self.assertEqual(Product.objects.count(), 3)
+
+    def test_repeated_id_in_a_batch_is_written_once(self):
+        p1 = FEED["products"][0]
+
+        _, products = import_catalog(self.feed(p1, {**p1, "name_en": "Kuy teav (large)"}), bulk=True)
+
+        self.assertEqual((products.created, products.updated), (1, 0))
+        self.assertEqual(Product.objects.get().name_en, "Kuy teav (large)")
+
+
+class ImportChangeDetectionTests(TestCase):
+    def test_unchanged_rows_are_not_rewritten(self):
+        import_catalog(FEED)
+        # Edited behind the importer's back, so a rewrite would be visible.
+        Product.objects.filter(source_id="p1").update(name_en="Edited locally")
+
+        with CaptureQueriesContext(connection) as queries:
+            categories, products = import_catalog(FEED, bulk=True)
+
+        self.assertEqual((categories.unchanged, products.unchanged), (1, 2))
+        self.assertEqual((products.created, products.updated), (0, 0))
+        self.assertEqual(Product.objects.get(source_id="p1").name_en, "Edited locally")
+        self.assertFalse([query for query in queries.captured_queries if query["sql"].startswith("INSERT INTO \"catalog_product\"")])
+
+    def test_missing_rows_are_deactivated_and_restored(self):
+        import_catalog(FEED)
+
+        _, products = import_catalog({**FEED, "products": FEED["products"][:1]})
+
+        self.assertEqual(products.deactivated, 1)
+        dropped = Product.objects.get(source_id="p2")
+        self.assertEqual((dropped.active, dropped.fingerprint), (False, ""))
+
+        _, products = import_catalog(FEED)
+
+        self.assertEqual((products.updated, products.unchanged, products.deactivated), (1, 1, 0))
+        self.assertTrue(Product.objects.get(source_id="p2").active)
+
+    def test_feed_without_products_deactivates_nothing(self):
+        import_catalog(FEED)
+
+        with self.assertLogs("catalog.importer", "WARNING"):
+            _, products = import_catalog({**FEED, "products": []})
+
+        self.assertEqual(products.deactivated, 0)
+        self.assertEqual(Product.objects.filter(active=True).count(), 2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(source_id="c1", name_en="Noodles")
+        self.products = Product.objects.bulk_create(
+            Product(source_id=f"p{index}", name_en=f"Product {index}", price="2.50", category=category)
+            for index in range(3)
+        )
+        bump_catalog_version()
+
+    def test_snapshot_is_rebuilt_after_a_version_bump(self):
+        snapshot = get_snapshot()
+        Product.objects.filter(pk=self.products[0].pk).update(price="4.00")
+
+        self.assertIs(get_snapshot(), snapshot)
+        self.assertEqual(str(snapshot.get(self.products[0].pk).price), "2.50")
+
+        bump_catalog_version()
+        rebuilt = get_snapshot()
+
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertEqual(str(rebuilt.get(self.products[0].pk).price), "4.00")
+
+    def test_lookups_and_stats(self):
+        snapshot = get_snapshot()
+        category = Category.objects.get()
+        late = Product.objects.create(source_id="late", name_en="Late", price="1.00", category=category)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(snapshot.get_many(product.pk for product in self.products)), 3)
+        with self.assertNumQueries(1):
+            found = snapshot.get_many([late.pk, 999999])
+        self.assertEqual(list(found), [late.pk])
+        with self.assertNumQueries(0):
+            snapshot.get(late.pk)
+
+        stats = snapshot_stats()
+        self.assertEqual((stats["products"], stats["hits"], stats["misses"]), (4, 4, 2))
+        self.assertAlmostEqual(stats["hit_rate"], 4 / 6)
+        self.assertGreater(stats["memory_bytes"], 0)
+
+    def test_stats_command(self):
+        out = StringIO()
+        call_command("catalog_snapshot_stats", stdout=out)
+
+        self.assertIn("Products: 3", out.getvalue())
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(source_id="c1", name_en="Noodles")
+
+    def product(self, source_id, **fields):
+        return Product.objects.create(source_id=source_id, category=self.category, price="2.00", **fields)
+
+    def names(self, text):
+        return [result.name_en for result in search_products(text)]
+
+    def test_name_matches_outrank_description_matches(self):
+        self.product("p1", name_en="Fried rice", description_en="Rice with beef, served beside a noodle soup")
+        self.product("p2", name_en="Beef noodle soup", description_en="Slow-cooked broth")
+        self.product("p3", name_en="Iced coffee", description_en="Condensed milk")
+
+        self.assertEqual(self.names("nood"), ["Beef noodle soup", "Fried rice"])
+        self.assertEqual(self.names("beef soup"), ["Beef noodle soup", "Fried rice"])
+
+    def test_khmer_words_inside_a_phrase_match(self):
+        self.product("p1", name_en="Beef noodle soup", name_kh="គុយទាវសាច់គោ")
+        self.product("p2", name_en="Pork rice", name_kh="បាយសាច់ជ្រូក")
+
+        self.assertEqual(self.names("សាច់គោ"), ["Beef noodle soup"])
+        self.assertEqual(sorted(self.names("សាច់")), ["Beef noodle soup", "Pork rice"])
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        product = self.product("p1", name_en="Mango sticky rice")
+        self.assertEqual(self.names("mango"), ["Mango sticky rice"])
+
+        Product.objects.filter(pk=product.pk).update(name_en="Durian sticky rice")
+        self.assertEqual(self.names("mango"), [])
+        self.assertEqual(self.names("durian"), ["Durian sticky rice"])
+
+        product.delete()
+        self.assertEqual(self.names("durian"), [])
+
+    def test_inactive_products_are_not_found(self):
+        self.product("p1", name_en="Mango sticky rice", active=False)
+
+        self.assertEqual(self.names("mango"), [])
+        self.assertEqual(self.names("ស្វាយ"), [])
+
+
+class TrickleStream(io.RawIOBase):
+    """Binary stream that returns at most ``step`` bytes per read."""
+
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunk = self.data[self.offset : self.offset + self.step]
+        self.offset += len(chunk)
+        return chunk
+
+
+class FeedReaderTests(SimpleTestCase):
+    def read(self, data, fmt="json", step=None):
+        meta = {}
+        stream = TrickleStream(data, step) if step else open_stream(io.BytesIO(data))
+        return list(iter_records(stream, fmt, meta)), meta
+
+    def test_values_split_across_chunks(self):
+        feed = {
+            "version": 2,
+            "categories": [{"id": "c1", "name_en": "Say \"noodles\" \\ slash\n", "name_kh": "គុយទាវ"}],
+            "ignored": {"products": [{"id": "nested"}]},
+            "products": [
+                {
+                    "id": "p1",
+                    "category_id": "c1",
+                    "name_en": "Kuy teav \u00e9",
+                    "price": 12.5,
+                    "variants": {"size": {"large": {"price": "3.00"}}, "tags": ["hot", {"spicy": True}]},
+                },
+                {"id": "p2", "category_id": "c1", "name_kh": "បាយ", "price": 2, "popular": False},
+            ],
+            "next": "https://example.com/feed?page=2",
+        }
+        data = json.dumps(feed, ensure_ascii=False, indent=1).encode()
+        expected = [("category", item) for item in feed["categories"]] + [
+            ("product", item) for item in feed["products"]
+        ]
+
+        for step in range(1, 12):
+            with self.subTest(step=step):
+                records, meta = self.read(data, step=step)
+                self.assertEqual(records, expected)
+                self.assertEqual(meta, {"version": 2, "next": feed["next"]})
+
+    def test_truncated_stream_is_an_error(self):
+        data = json.dumps({"products": [{"id": "p1", "name_kh": "បាយ", "price": 2.5}]}, ensure_ascii=False).encode()
+
+        for end in range(len(data)):
+            with self.subTest(end=end), self.assertRaises(FeedError):
+                self.read(data[:end], step=4)
+
+    def test_gzip_ndjson(self):
+        lines = [
+            {"type": "meta", "next": "page-2"},
+            {"id": "c1", "name_en": "Noodles"},
+            {"id": "p1", "category_id": "c1", "name_en": "Kuy teav"},
+            {"type": "product", "id": "p2", "name_en": "No category yet"},
+        ]
+        data = gzip.compress(b"\n".join(json.dumps(line).encode() for line in lines) + b"\n\n")
+
+        records, meta = self.read(data, fmt=detect_format("https://example.com/feed.ndjson.gz"))
+
+        self.assertEqual(meta, {"next": "page-2"})
+        self.assertEqual(
+            records,
+            [
+                ("category", {"id": "c1", "name_en": "Noodles"}),
+                ("product", {"id": "p1", "category_id": "c1", "name_en": "Kuy teav"}),
+                ("product", {"id": "p2", "name_en": "No category yet"}),
+            ],
+        )
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves ``server.payload`` (or ``server.pages[path]``) with an ETag (``server.etags[path]`` or ``server.etag``), failing the first ``server.failures`` requests."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        server.paths.append(self.path)
+        payload = server.pages.get(self.path, server.payload)
+        if server.failures:
+            server.failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = server.etags.get(self.path, server.etag)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", "Sat, 17 Oct 2026 10:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImportProductsFetchTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.server.payload = FEED
+        self.server.etag = '"v1"'
+        self.server.failures = 0
+        self.server.requests = []
+        self.server.pages = {}
+        self.server.etags = {}
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/products"
+
+    def run_import(self, *args, **options):
+        out = StringIO()
+        call_command("import_products", *args, url=options.pop("url", [self.url]), backoff=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_stores_validators_and_short_circuits_on_304(self):
+        self.run_import()
+        self.assertEqual(Product.objects.count(), 2)
+        state = FeedState.objects.get(url=self.url)
+        self.assertEqual(state.etag, '"v1"')
+
+        Product.objects.filter(source_id="p1").update(name_en="Edited locally")
+        output = self.run_import()
+
+        self.assertIn("not modified", output)
+        self.assertEqual(self.server.requests[-1]["If-None-Match"], '"v1"')
+        self.assertEqual(self.server.requests[-1]["If-Modified-Since"], "Sat, 17 Oct 2026 10:00:00 GMT")
+        self.assertEqual(Product.objects.get(source_id="p1").name_en, "Edited locally")
+
+    def test_changed_feed_is_imported(self):
+        self.run_import("--stream")
+        self.server.etag = '"v2"'
+        self.server.payload = {**FEED, "products": FEED["products"][:1]}
+
+        output = self.run_import("--stream")
+
+        self.assertIn("deactivated: 1", output)
+        self.assertEqual(FeedState.objects.get(url=self.url).etag, '"v2"')
+
+    def test_force_ignores_stored_validators(self):
+        self.run_import()
+        self.run_import(force=True)
+        self.assertNotIn("If-None-Match", self.server.requests[-1])
+
+    def test_retries_transient_failures(self):
+        self.server.failures = 2
+        self.run_import()
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_gives_up_after_retry_budget(self):
+        self.server.failures = 10
+        with self.assertRaises(CommandError):
+            self.run_import(retries=1)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertFalse(FeedState.objects.exists())
+
+    def test_follows_pages_and_merges_feeds_by_priority(self):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        self.server.pages = {
+            "/primary": {**FEED, "products": FEED["products"][:1], "next_cursor": "2"},
+            "/primary?cursor=2": {"products": FEED["products"][1:]},
+            "/secondary": {
+                "products": [
+                    {"id": "p1", "category_id": "c1", "name_en": "Overridden", "price": "9.00"},
+                    {"id": "p3", "category_id": "c1", "name_en": "Num pang", "price": "1.50"},
+                ],
+            },
+        }
+
+        self.run_import("--bulk", url=[f"{base}/primary", f"{base}/secondary"])
+
+        self.assertEqual(Product.objects.filter(active=True).count(), 3)
+        self.assertEqual(Product.objects.get(source_id="p1").name_en, "Kuy teav")
+        self.assertIn("/primary?cursor=2", self.server.paths)
+
+    def test_unchanged_primary_still_outranks_a_changed_secondary(self):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        secondary = {
+            "categories": FEED["categories"],
+            "products": [{"id": "p1", "category_id": "c1", "name_en": "Overridden", "price": "9.00"}],
+        }
+        self.server.pages = {"/primary": FEED, "/secondary": secondary}
+        urls = [f"{base}/primary", f"{base}/secondary"]
+        self.run_import("--bulk", url=urls)
+
+        self.server.etags["/secondary"] = '"v2"'
+        secondary["products"][0].update(name_en="Overridden v2", price="9.50")
+        self.server.paths.clear()
+        self.run_import("--bulk", url=urls)
+
+        product = Product.objects.get(source_id="p1")
+        self.assertEqual((product.name_en, str(product.price)), ("Kuy teav", "2.50"))
+        self.assertEqual(sorted(self.server.paths), ["/primary", "/primary", "/secondary"])
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), None)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serves ``server.images[path]``, 404 for anything else."""
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = self.server.images.get(self.path)
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Length", str(len(body or b"")))
+        self.end_headers()
+        self.wfile.write(body or b"")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def image_bytes(size, mode="RGBA", fmt="PNG", color=(200, 40, 40, 128)):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color[: len(mode)]).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class RacingStorage(FileSystemStorage):
+    """Lets another worker store each file between the caller's ``exists`` check and its save."""
+
+    def _save(self, name, content):
+        super()._save(name, content)
+        content.seek(0)
+        return super()._save(name, content)
+
+
+class ProductImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root, CATALOG_IMAGE_WIDTHS=(160, 320, 640))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        self.server.images = {"/a.png": image_bytes((800, 400)), "/copy.png": image_bytes((800, 400))}
+        self.server.paths = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.category = Category.objects.create(source_id="c1", name_en="Noodles")
+
+    def product(self, source_id, path):
+        return Product.objects.create(
+            source_id=source_id, name_en=source_id, price="1.00", category=self.category, image_url=self.base + path
+        )
+
+    def test_variants_are_resized_and_encoded(self):
+        variants = build_variants(image_bytes((800, 400)), "ab" * 32)
+
+        self.assertEqual([width for width, _ in variants["webp"]], [160, 320, 640])
+        for ext, pil_format in (("webp", "WEBP"), ("jpeg", "JPEG")):
+            width, path = variants[ext][1]
+            with default_storage.open(path) as stored, Image.open(stored) as image:
+                self.assertEqual((image.format, image.mode, image.size), (pil_format, "RGB", (320, 160)))
+
+    def test_small_images_are_not_upscaled(self):
+        variants = build_variants(image_bytes((200, 100), mode="L", fmt="JPEG"), "cd" * 32)
+
+        self.assertEqual([width for width, _ in variants["jpeg"]], [160, 200])
+
+    def test_racing_builds_leave_no_duplicate_files(self):
+        storages = {
+            "default": {"BACKEND": "catalog.tests.RacingStorage"},
+            "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+        }
+        with override_settings(STORAGES=storages):
+            variants = build_variants(image_bytes((800, 400)), "ef" * 32)
+            _, files = default_storage.listdir("catalog/images/ef")
+
+        self.assertEqual(variants["jpeg"][0][1], f"catalog/images/ef/{'ef' * 32}-160.jpeg")
+        self.assertEqual(sorted(files), sorted(path.rsplit("/", 1)[1] for ext in variants for _, path in variants[ext]))
+
+    def test_images_are_cached_once_and_shared(self):
+        first, second = self.product("p1", "/a.png"), self.product("p2", "/a.png")
+        self.product("p3", "/copy.png")
+        self.product("p4", "/missing.png")
+
+        with self.assertLogs("catalog.images", "WARNING"):
+            result = cache_product_images(workers=2)
+
+        self.assertEqual((result.cached, result.failed), (3, 1))
+        self.assertEqual(sorted(self.server.paths), ["/a.png", "/copy.png", "/missing.png"])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image_variants, second.image_variants)
+        self.assertEqual(Product.objects.get(source_id="p3").image_hash, first.image_hash)
+        image = ProductImage(first.image_url, first.image_variants)
+        self.assertEqual(image.src, default_storage.url(first.image_variants["jpeg"][-1][1]))
+        self.assertIn("320w", image.webp_srcset)
+
+        self.server.paths.clear()
+        with self.assertLogs("catalog.images", "WARNING"):
+            result = cache_product_images()
+        self.assertEqual((result.skipped, result.failed), (3, 1))
+        self.assertEqual(self.server.paths, ["/missing.png"])
+
+    def test_same_bytes_at_a_new_url_are_not_re_encoded(self):
+        product = self.product("p1", "/a.png")
+        cache_product_images()
+        product.refresh_from_db()
+        path = product.image_variants["jpeg"][0][1]
+        modified = default_storage.get_modified_time(path)
+
+        Product.objects.filter(pk=product.pk).update(image_url=self.base + "/copy.png")
+        result = cache_product_images()
+
+        self.assertEqual(result.unchanged, 1)
+        self.assertEqual(default_storage.get_modified_time(path), modified)
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["source"], self.base + "/copy.png")
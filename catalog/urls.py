@@ -1,9 +1,11 @@
 from django.urls import path
 
-from .views import product_list
+from .views import catalog_api, product_list, product_search
 
 app_name = "catalog"
 
 urlpatterns = [
     path("products/", product_list, name="product_list"),
+    path("products/search/", product_search, name="product_search"),
+    path("api/catalog/", catalog_api, name="catalog_api"),
 ]
@@ -0,0 +1,61 @@
+"""Catalog version token used to key caches derived from catalog data.
+
+The token changes whenever a Category or Product is written, so anything cached
+under an old token simply stops being read. Tokens are nanosecond timestamps
+rather than a counter: if the key is evicted the new token is still unique and
+can never collide with entries written under an earlier one.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = "catalog:version"
+
+_local = threading.local()
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def bump_catalog_version_on_commit(**kwargs):
+    """Signal receiver; bumps only once the write is visible to other connections.
+
+    Also called directly by writers that bypass model signals (bulk upserts, queryset updates).
+    """
+    if getattr(_local, "suppressed", 0):
+        _local.pending = True
+        return
+    transaction.on_commit(bump_catalog_version)
+
+
+@contextmanager
+def single_version_bump():
+    """Collapse the bumps requested inside the block into one when it exits.
+
+    Nothing is bumped when the block wrote nothing, so an idle import leaves caches warm.
+    """
+    if not getattr(_local, "suppressed", 0):
+        _local.pending = False
+    _local.suppressed = getattr(_local, "suppressed", 0) + 1
+    try:
+        yield
+    finally:
+        _local.suppressed -= 1
+        if not _local.suppressed and _local.pending:
+            _local.pending = False
+            transaction.on_commit(bump_catalog_version)
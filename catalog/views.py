@@ -1,16 +1,183 @@
-from django.contrib.auth.decorators import login_required
+import base64
+import hashlib
+import json
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition, require_GET
 
 from .models import Category, Product
+from .search import search_products
+from .versioning import get_catalog_version
 
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 96
+CSRF_PLACEHOLDER = "__catalog_csrf_token__"
 
-def product_list(request):
-    categories = Category.objects.prefetch_related("products").all()
+API_CATEGORY_FIELDS = ("source_id", "name_en", "name_kh", "description", "display_order")
+API_PRODUCT_FIELDS = (
+    "id",
+    "source_id",
+    "category__source_id",
+    "name_en",
+    "name_kh",
+    "description_en",
+    "description_kh",
+    "price",
+    "image_url",
+    "popular",
+    "display_order",
+)
+API_PRODUCT_KEYS = tuple(field.replace("category__source_id", "category") for field in API_PRODUCT_FIELDS)
+API_CHUNK_SIZE = 2000
+
+
+def _encode_cursor(product):
+    raw = json.dumps([product.display_order, product.name_en, product.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(value):
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        display_order, name_en, pk = json.loads(raw)
+        return int(display_order), str(name_en), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _page_size(request):
+    max_size = getattr(settings, "CATALOG_MAX_PAGE_SIZE", MAX_PAGE_SIZE)
+    try:
+        size = int(request.GET.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, max_size))
+
+
+def _grid_cache_key(user_type, category_id, cursor, limit):
+    digest = hashlib.md5(json.dumps([category_id, cursor, limit]).encode()).hexdigest()
+    return f"catalog:product_grid:{get_catalog_version()}:{user_type}:{digest}"
+
+
+def _render_product_grid(category_id, cursor, limit, is_authenticated):
     products = Product.objects.filter(active=True).select_related("category")
-    return render(
-        request,
-        "catalog/product_list.html",
-        {"categories": categories, "products": products},
+    if category_id:
+        products = products.filter(category__source_id=category_id)
+    if cursor:
+        display_order, name_en, pk = cursor
+        products = products.filter(
+            Q(display_order__gt=display_order)
+            | Q(display_order=display_order, name_en__gt=name_en)
+            | Q(display_order=display_order, name_en=name_en, id__gt=pk)
+        )
+    # Fetch one extra row to learn whether another page exists.
+    page = list(products.order_by("display_order", "name_en", "id")[: limit + 1])
+    next_query = None
+    if len(page) > limit:
+        params = {"category": category_id, "limit": limit, "after": _encode_cursor(page[limit - 1])}
+        next_query = urlencode({key: value for key, value in params.items() if value})
+
+    categories = Category.objects.filter(active=True).only("source_id", "name_en")
+    return render_to_string(
+        "catalog/_product_grid.html",
+        {
+            "categories": categories,
+            "products": page[:limit],
+            "current_category": category_id,
+            "next_query": next_query,
+            "is_first_page": cursor is None,
+            "is_authenticated": is_authenticated,
+            # The grid is shared between users; the real token is swapped in per request.
+            "csrf_token": CSRF_PLACEHOLDER,
+        },
     )
 
-# Create your views here.
+
+def product_list(request):
+    limit = _page_size(request)
+    category_id = request.GET.get("category") or ""
+    cursor = _decode_cursor(request.GET.get("after"))
+    is_authenticated = request.user.is_authenticated
+    user_type = request.user.user_type if is_authenticated else "anonymous"
+
+    key = _grid_cache_key(user_type, category_id, cursor, limit)
+    grid = cache.get(key)
+    if grid is None:
+        grid = _render_product_grid(category_id, cursor, limit, is_authenticated)
+        cache.set(key, grid, settings.CATALOG_CACHE_TIMEOUT)
+    if is_authenticated:
+        grid = grid.replace(CSRF_PLACEHOLDER, get_token(request))
+    return render(request, "catalog/product_list.html", {"product_grid": mark_safe(grid)})
+
+
+def product_search(request):
+    query = request.GET.get("q", "").strip()
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        limit = 20
+    results = search_products(query, limit=limit) if query else []
+    return render(request, "catalog/search.html", {"query": query, "results": results})
+
+
+def _iter_catalog_json():
+    """Yield the catalog document in chunks straight from value rows, without building models."""
+    encoder = DjangoJSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    categories = (
+        Category.objects.filter(active=True)
+        .order_by("display_order", "name_en", "id")
+        .values_list(*API_CATEGORY_FIELDS)
+    )
+    products = (
+        Product.objects.filter(active=True, category__active=True)
+        .order_by("display_order", "name_en", "id")
+        .values_list(*API_PRODUCT_FIELDS)
+    )
+    for prefix, rows, keys in (
+        ('{"categories":[', categories, API_CATEGORY_FIELDS),
+        ('],"products":[', products, API_PRODUCT_KEYS),
+    ):
+        yield prefix
+        buffer = []
+        for index, row in enumerate(rows.iterator(chunk_size=API_CHUNK_SIZE)):
+            buffer.append(("," if index else "") + encoder.encode(dict(zip(keys, row))))
+            if len(buffer) >= API_CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer = []
+        if buffer:
+            yield "".join(buffer)
+    yield "]}"
+
+
+def _catalog_etag(request):
+    # The tag is a hash of the exact document bytes, computed once per catalog version
+    # so polling clients get their 304 without touching the database.
+    key = f"catalog:api_etag:{get_catalog_version()}"
+    etag = cache.get(key)
+    if etag is None:
+        digest = hashlib.sha256()
+        for chunk in _iter_catalog_json():
+            digest.update(chunk.encode())
+        etag = digest.hexdigest()
+        cache.set(key, etag, settings.CATALOG_CACHE_TIMEOUT)
+    return etag
+
+
+@require_GET
+@condition(etag_func=_catalog_etag)
+def catalog_api(request):
+    response = StreamingHttpResponse(_iter_catalog_json(), content_type="application/json; charset=utf-8")
+    patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+    return response
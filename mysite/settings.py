@@ -47,9 +47,9 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'accounts.middleware.DisabledUserMiddleware',
+    'accounts.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'accounts.middleware.DisabledUserMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -85,6 +85,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# File-based by default so management commands and web workers share entries.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", str(BASE_DIR / ".cache")),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,6 +134,12 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+MEDIA_URL = os.getenv("MEDIA_URL", "media/")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT") or str(BASE_DIR / "media")
+
+# Widths (px) of the resized variants generated for cached product images.
+CATALOG_IMAGE_WIDTHS = (160, 320, 640)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -130,15 +147,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# CachedModelBackend serves request.user from the cache. ModelBackend stays listed so
+# sessions created before it was added remain valid until their users log in again.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# Seconds a cached user row is trusted; also bounds how long a disabled user can stay signed in
+# when the flag is changed without saving the model.
+ACCOUNTS_USER_CACHE_TTL = int(os.getenv("ACCOUNTS_USER_CACHE_TTL", "60"))
+
+# Sessions (accounts.sessions): local cache tier in front of the shared cache, rows written behind.
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "accounts.sessions")
+# Seconds between batched session writes; 0 writes after every response.
+SESSION_WRITE_BEHIND_INTERVAL = float(os.getenv("SESSION_WRITE_BEHIND_INTERVAL", "2"))
+# Seconds a process trusts its own copy of a session. Keep 0 (no local tier) unless the site runs as
+# a single process: another process would still accept a session for this long after a logout.
+SESSION_LOCAL_TTL = float(os.getenv("SESSION_LOCAL_TTL", "0"))
+
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/accounts/login/'
 LOGIN_URL = '/accounts/login/'
 
 # Email
-EMAIL_BACKEND = os.getenv(
-    "EMAIL_BACKEND",
+# Mail is queued in accounts.OutboundEmail and delivered through EMAIL_DELIVERY_BACKEND by
+# `manage.py send_outbound_email --loop`.
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "accounts.outbox.OutboxEmailBackend")
+EMAIL_DELIVERY_BACKEND = os.getenv(
+    "EMAIL_DELIVERY_BACKEND",
     "django.core.mail.backends.console.EmailBackend",
 )
+EMAIL_TIMEOUT = int(os.getenv("EMAIL_TIMEOUT", "30"))
 EMAIL_HOST = os.getenv("EMAIL_HOST", "")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", "587"))
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
@@ -147,8 +186,43 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() == "true"
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", EMAIL_HOST_USER or "no-reply@example.com")
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
+# Outbound Stripe calls (billing.gateway): per-call timeout, retry budget and circuit breaker.
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
+STRIPE_BREAKER_FAILURE_RATIO = 0.5
+STRIPE_BREAKER_MIN_CALLS = 5
+STRIPE_BREAKER_WINDOW = 30
+STRIPE_BREAKER_RESET_TIMEOUT = 30
+# Serve checkout, success and webhook views from billing.async_views (for ASGI deployments).
+BILLING_ASYNC_VIEWS = os.getenv("BILLING_ASYNC_VIEWS", "false").lower() == "true"
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 STRIPE_SUBSCRIPTION_PRICE_ID = os.getenv("STRIPE_SUBSCRIPTION_PRICE_ID", "")
 PRO_PLAN_PRICE = float(os.getenv("PRO_PLAN_PRICE", "20"))
 DEFAULT_CURRENCY = os.getenv("STRIPE_CURRENCY", "usd")
+# Window (seconds) in which identical checkouts reuse an open Stripe Checkout session. Sessions expire
+# one to two windows after creation; clamped to 1800-43200 seconds.
+BILLING_CHECKOUT_SESSION_TTL = int(os.getenv("BILLING_CHECKOUT_SESSION_TTL", "3600"))
+# Longest an async (BILLING_ASYNC_VIEWS) success-page status request waits for the checkout webhook
+# before answering "pending"; the sync view answers at once and the page polls again.
+BILLING_CHECKOUT_STATUS_WAIT = int(os.getenv("BILLING_CHECKOUT_STATUS_WAIT", "20"))
+
+# Cart storage (billing.cart): "billing.cart.DatabaseCart" (one row per line) or "billing.cart.SessionCart".
+BILLING_CART_BACKEND = os.getenv("BILLING_CART_BACKEND", "billing.cart.DatabaseCart")
+
+# Cart pricing (billing.pricing). Rates are fractions taken off the unit price, applied in rule order.
+BILLING_PRICING_RULES = [
+    "billing.pricing.QuantityTierRule",
+    "billing.pricing.TierDiscountRule",
+    "billing.pricing.PromoCodeRule",
+]
+BILLING_TIER_DISCOUNTS = {"pro": "0.20"}
+# (minimum quantity of one product, rate), e.g. [(10, "0.05")]
+BILLING_QUANTITY_TIERS = []
+# Comma-separated CODE:rate pairs, e.g. "WELCOME10:0.10,STAFF:0.25"
+BILLING_PROMO_CODES = dict(
+    entry.split(":", 1) for entry in os.getenv("BILLING_PROMO_CODES", "").split(",") if ":" in entry
+)
+
+CATALOG_CACHE_TIMEOUT = int(os.getenv("CATALOG_CACHE_TIMEOUT", "3600"))